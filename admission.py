@@ -0,0 +1,279 @@
+"""
+Admission control for /chatkit turns.
+
+- ThreadGate: turns of one thread_id run one at a time; a bounded number may
+  wait behind the running one, further ones are rejected with 429
+- UpstreamLimiter: global cap on concurrent OpenAI calls with a bounded wait
+  queue; once the queue is full new turns are shed with 503
+- RateLimiter: token bucket per device_id (or client IP), 429 when empty;
+  every turn also draws from a bucket of the caller's IP, so rotating
+  device_ids does not escape the limit
+
+X-Forwarded-For is honoured only when the peer is a trusted proxy
+(TRUSTED_PROXIES); the caller is the right-most hop no trusted proxy added.
+
+Rejections raise `Rejected`, which carries the status code and a Retry-After
+hint. State is per process, so with several workers the limits apply per
+worker (route a thread to one worker to keep turns serialized).
+"""
+import asyncio
+import ipaddress
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import metrics
+
+REJECTED = metrics.registry.counter(
+    "chatkit_admission_rejected_total", "Requests rejected by admission control"
+)
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+        REJECTED.inc(reason=reason)
+
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class _HoldTime:
+    """Moving average of how long a slot is held, for Retry-After hints."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, initial: float):
+        self.value = initial
+
+    def add(self, seconds: float) -> None:
+        self.value += 0.2 * (seconds - self.value)
+
+
+class _ThreadSlot:
+    __slots__ = ("lock", "waiting")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+
+
+class ThreadGate:
+    """Serializes turns per thread_id."""
+
+    def __init__(self, max_waiting: int = 1, wait_timeout: float = 60.0):
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.hold = _HoldTime(5.0)
+        self._slots: dict = {}  # thread_id -> _ThreadSlot, only while busy
+
+    def _discard(self, thread_id: str, slot: _ThreadSlot) -> None:
+        if not slot.lock.locked() and slot.waiting == 0:
+            self._slots.pop(thread_id, None)
+
+    async def acquire(self, thread_id: str) -> None:
+        slot = self._slots.get(thread_id)
+        if slot is None:
+            slot = self._slots[thread_id] = _ThreadSlot()
+        if slot.lock.locked() and slot.waiting >= self.max_waiting:
+            raise Rejected(429, "thread_busy", self.hold.value * (slot.waiting + 1))
+
+        slot.waiting += 1
+        try:
+            await asyncio.wait_for(slot.lock.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise Rejected(429, "thread_timeout", self.hold.value)
+        finally:
+            slot.waiting -= 1
+            self._discard(thread_id, slot)
+
+    def release(self, thread_id: str, held: Optional[float] = None) -> None:
+        """Free the thread; `held` (None: the turn never ran) feeds the Retry-After hint."""
+        slot = self._slots.get(thread_id)
+        if slot is None or not slot.lock.locked():
+            return
+        slot.lock.release()
+        if held is not None:
+            self.hold.add(held)
+        self._discard(thread_id, slot)
+
+    def busy(self) -> int:
+        return len(self._slots)
+
+
+class UpstreamLimiter:
+    """Global semaphore for OpenAI calls with a bounded wait queue."""
+
+    def __init__(self, limit: int = 32, max_waiting: int = 64, wait_timeout: float = 10.0):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.hold = _HoldTime(2.0)
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    def _retry_after(self) -> float:
+        return self.hold.value * (self.waiting + 1) / self.limit
+
+    def check(self, turns: int) -> None:
+        """Shed a new turn up front when `turns` running ones already fill every slot and queue place."""
+        if turns >= self.limit + self.max_waiting:
+            raise Rejected(503, "upstream_saturated", self._retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.waiting >= self.max_waiting:
+            raise Rejected(503, "upstream_saturated", self._retry_after())
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise Rejected(503, "upstream_timeout", self._retry_after())
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        metrics.observe("upstream_queue", started - queued)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+            self.hold.add(time.perf_counter() - started)
+
+
+class RateLimiter:
+    """Token bucket per key: `per_minute` refill rate, `burst` capacity."""
+
+    def __init__(self, per_minute: float = 20.0, burst: int = 10, max_keys: int = 100_000, reason: str = "rate_limited"):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.reason = reason
+        self.max_keys = max_keys
+        self._buckets: OrderedDict = OrderedDict()  # key -> (tokens, updated)
+
+    def check(self, key: str) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            raise Rejected(429, self.reason, (1 - tokens) / self.rate)
+        self._buckets[key] = (tokens - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+
+class Admission:
+    def __init__(
+        self,
+        threads: ThreadGate,
+        upstream: UpstreamLimiter,
+        rate: RateLimiter,
+        ip_rate: RateLimiter,
+        trusted_proxies: tuple = (),
+    ):
+        self.threads = threads
+        self.upstream = upstream
+        self.rate = rate
+        self.ip_rate = ip_rate
+        self.trusted_proxies = trusted_proxies
+        self.turns = 0  # admitted turns not yet released
+
+    async def admit(self, thread_id: str, client_key: str, ip: str) -> None:
+        """
+        Admit one turn: rate limit (client and IP), fast shedding, then wait
+        for the thread. Every admitted turn must be ended with `release()`.
+        """
+        self.ip_rate.check(ip)
+        self.rate.check(client_key)
+        self.upstream.check(self.turns)
+        await self.threads.acquire(thread_id)
+        self.turns += 1
+
+    def release(self, thread_id: str, held: Optional[float] = None) -> None:
+        self.turns -= 1
+        self.threads.release(thread_id, held)
+
+    def snapshot(self) -> dict:
+        return {
+            "turns": self.turns,
+            "busy_threads": self.threads.busy(),
+            "upstream_active": self.upstream.active,
+            "upstream_waiting": self.upstream.waiting,
+        }
+
+
+def parse_networks(value: str) -> tuple:
+    """Comma separated IPs/CIDRs, e.g. "10.0.0.0/8,203.0.113.7"."""
+    return tuple(ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip())
+
+
+def _trusted(address: str, trusted_proxies: tuple) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+def client_ip(headers, client_host: Optional[str], trusted_proxies: tuple = ()) -> str:
+    """
+    The caller's IP. X-Forwarded-For is only read when the peer is a trusted
+    proxy, from the right: the first hop not added by a trusted proxy wins,
+    so a forged left-hand entry is ignored.
+    """
+    address = client_host or "unknown"
+    if not _trusted(address, trusted_proxies):
+        return address
+    hops = [hop.strip() for hop in headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        address = hop
+        if not _trusted(hop, trusted_proxies):
+            break
+    return address
+
+
+def client_key(ip: str, device_id: Optional[str] = None) -> str:
+    """device_id when the client sent one, else the caller's IP."""
+    if device_id:
+        return f"device:{device_id}"
+    return f"ip:{ip}"
+
+
+def create_admission() -> Admission:
+    """Build admission control from the THREAD_*, UPSTREAM_*, RATE_LIMIT_* and TRUSTED_PROXIES settings."""
+    return Admission(
+        ThreadGate(
+            max_waiting=int(os.environ.get("THREAD_MAX_QUEUED", "1")),
+            wait_timeout=float(os.environ.get("THREAD_QUEUE_TIMEOUT", "60")),
+        ),
+        UpstreamLimiter(
+            limit=int(os.environ.get("UPSTREAM_MAX_CONCURRENCY", "32")),
+            max_waiting=int(os.environ.get("UPSTREAM_MAX_QUEUED", "64")),
+            wait_timeout=float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", "10")),
+        ),
+        RateLimiter(
+            per_minute=float(os.environ.get("RATE_LIMIT_PER_MINUTE", "20")),
+            burst=int(os.environ.get("RATE_LIMIT_BURST", "10")),
+        ),
+        # Shared by every device behind one IP (offices, NAT), hence roomier
+        RateLimiter(
+            per_minute=float(os.environ.get("RATE_LIMIT_IP_PER_MINUTE", "60")),
+            burst=int(os.environ.get("RATE_LIMIT_IP_BURST", "30")),
+            reason="ip_rate_limited",
+        ),
+        # Loopback and private ranges: the platform's load balancer and other workers
+        parse_networks(os.environ.get("TRUSTED_PROXIES", "127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,::1/128,fc00::/7")),
+    )
@@ -2,23 +2,43 @@
 # Vercel will use this file when requests come to /
 # This wraps the FastAPI app with Mangum to make it compatible with Vercel's serverless functions
 
-from mangum import Mangum
-import sys
 import os
+import sys
+import tempfile
+
+# Shared modules (app_factory, settings, ...) live in the repo root
+root_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+if root_path not in sys.path:
+    sys.path.insert(0, root_path)
+
+# Sessions only unless CHATKIT_ENABLED=1 is set for the function: keeps the
+# chat pipeline (and its NumPy/tiktoken imports) out of the cold start
+os.environ.setdefault("CHATKIT_ENABLED", "0")
 
-# Add backend directory to Python path
-backend_path = os.path.join(os.path.dirname(__file__), '..', 'backend')
-if backend_path not in sys.path:
-    sys.path.insert(0, backend_path)
+# With CHATKIT_ENABLED=1: the deployment is read-only except the temp dir, and
+# background work stops after each response, so intents go to n8n inline
+for name, filename in (
+    ("N8N_OUTBOX_PATH", "intent_outbox.db"),
+    ("USAGE_DB_PATH", "usage.db"),
+    ("CONVERSATION_DB_PATH", "conversations.db"),
+):
+    os.environ.setdefault(name, os.path.join(tempfile.gettempdir(), filename))
+os.environ.setdefault("N8N_DISPATCH", "sync")
 
-# Import the FastAPI app
-from server import app
+from mangum import Mangum  # noqa: E402
+
+from app_factory import create_app  # noqa: E402
+
+app = create_app()
 
 # Wrap FastAPI app with Mangum for AWS Lambda/Vercel compatibility
-# Mangum converts ASGI (FastAPI) to Lambda handler format
+# Mangum converts ASGI (FastAPI) to Lambda handler format.
+# Mangum runs the lifespan hook around every invocation, which would rebuild the
+# httpx pool and restart the services per request. With lifespan="off" they are
+# created on first use (http_pool, session broker, outbox, store) and then kept
+# for the life of the warm function.
 handler = Mangum(app, lifespan="off")
 
 # Export handler for Vercel
 # Vercel looks for 'handler' or 'app' in serverless functions
 __all__ = ['handler', 'app']
-
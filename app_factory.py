@@ -0,0 +1,88 @@
+"""
+The one FastAPI app behind every entry point (server.py for uvicorn/Render,
+backend/server.py, api/index.py for Vercel/Mangum).
+
+    app = create_app()                                   # settings from the environment
+    app = create_app(load_settings().replace(chatkit_enabled=False))
+
+Routers are optional (SESSIONS_ENABLED, CHATKIT_ENABLED) and imported only
+when enabled, so a sessions-only function never loads the chat pipeline.
+"""
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+
+from settings import Settings, load_settings
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    if settings is None:
+        settings = load_settings()
+
+    # Imported here so `.env` is loaded first: these read their settings at import time
+    import http_pool
+    import metrics
+
+    services = []
+    if settings.sessions_enabled:
+        from session_api import SessionService
+        services.append(SessionService(settings))
+    if settings.chatkit_enabled:
+        from chatkit_api import ChatService
+        services.append(ChatService(settings))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with AsyncExitStack() as stack:
+            await stack.enter_async_context(http_pool.lifespan(app))
+            for service in services:
+                await service.start()
+                stack.push_async_callback(service.close)
+            yield
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.services = services
+
+    # CORS (keep it permissive for Framer)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=list(settings.cors_origins),
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    for service in services:
+        app.include_router(service.router())
+
+    @app.get("/health")
+    async def health_check():
+        status = {
+            "status": "ok",
+            "workflow_id_set": settings.workflow_id is not None,
+            "api_key_set": settings.openai_api_key is not None,
+        }
+        for service in services:
+            status.update(await service.health())
+        return status
+
+    @app.get("/metrics")
+    async def metrics_endpoint():
+        """Prometheus text exposition of the counters, gauges and stage histograms."""
+        return PlainTextResponse(await metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+    endpoints = {"health": "/health", "metrics": "/metrics"}
+    if settings.sessions_enabled:
+        endpoints["create_session"] = "/api/chatkit/session (GET or POST)"
+    if settings.chatkit_enabled:
+        endpoints["chatkit"] = "/chatkit (POST)"
+
+    @app.get("/")
+    def root():
+        return {"message": "ChatKit Backend API", "endpoints": endpoints}
+
+    return app
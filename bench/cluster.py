@@ -0,0 +1,235 @@
+"""
+Local multi-worker harness for the scale-out mode (cluster.py).
+
+Starts the OpenAI stub and N backend workers on one box, each on its own port
+with WORKER_ID=i and the same CLUSTER_NODES, then runs simulated ChatKit
+clients that send every request of a thread to a random worker, as a
+non-sticky load balancer would. Turns for a thread another worker owns are
+forwarded to the owner.
+
+The stub answers with the number of user messages it was sent
+(STUB_OPENAI_ECHO_HISTORY), so every turn checks that the thread's full
+history was seen. Repeats the run for each worker count and reports
+turns/sec, latency, continuity failures and scaling relative to 1 worker.
+
+    python bench/cluster.py --workers 1,2,4 --clients 48 --threads 120 --turns 4
+    python bench/cluster.py --workers 2 --no-routing    # shows history being lost
+
+Each worker gets UPSTREAM_MAX_CONCURRENCY=--per-worker-upstream, so the
+capacity added per worker is the same as in production, where the
+per-process upstream cap (not CPU) bounds throughput.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from loadtest import ROOT, free_port, git_sha, percentiles, start_server, wait_ready
+
+ECHO = re.compile(r"^\[(\d+)\]")
+
+
+class Recorder:
+    def __init__(self):
+        self.latency: list = []
+        self.turns = 0
+        self.lost = 0
+        self.errors: dict = {}
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def final_text(body: str) -> str:
+    for line in reversed(body.splitlines()):
+        if line.startswith("data: {"):
+            event = json.loads(line[6:])
+            if event.get("type") == "thread.item.done":
+                return event["item"]["content"][0]["text"]
+    return ""
+
+
+async def simulated_client(client: httpx.AsyncClient, urls: list, queue: asyncio.Queue, args, rec: Recorder):
+    while True:
+        try:
+            index = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        device = f"device-{index}"
+        try:
+            resp = await client.post(f"{random.choice(urls)}/chatkit", json={"type": "threads.create", "params": {}})
+            thread_id = resp.json()["id"]
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            rec.error(f"create_{type(e).__name__}")
+            continue
+        for turn in range(1, args.turns + 1):
+            payload = {
+                "type": "threads.add_user_message",
+                "params": {"thread_id": thread_id, "input": {"content": [{"type": "text", "text": f"fråga {index}.{turn}"}]}},
+            }
+            start = time.perf_counter()
+            try:
+                resp = await client.post(
+                    f"{random.choice(urls)}/chatkit", json=payload, headers={"x-device-id": device}
+                )
+            except httpx.HTTPError as e:
+                rec.error(type(e).__name__)
+                break
+            if resp.status_code != 200:
+                rec.error(f"http_{resp.status_code}")
+                break
+            rec.latency.append(time.perf_counter() - start)
+            rec.turns += 1
+            match = ECHO.match(final_text(resp.text))
+            if not match or int(match.group(1)) != turn:
+                rec.lost += 1
+
+
+async def scrape_forwards(client: httpx.AsyncClient, urls: list) -> dict:
+    totals = {}
+    for url in urls:
+        text = (await client.get(f"{url}/metrics")).text
+        for line in text.splitlines():
+            if line.startswith("chatkit_cluster_forwards_total{"):
+                result = line.split('result="')[1].split('"')[0]
+                totals[result] = totals.get(result, 0) + float(line.rsplit(" ", 1)[1])
+    return totals
+
+
+async def run_cluster(workers: int, args, base_env: dict) -> dict:
+    ports = [free_port() for _ in range(workers)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    nodes = ",".join(f"{i}={url}" for i, url in enumerate(urls))
+    procs = []
+    try:
+        for i, port in enumerate(ports):
+            env = dict(base_env, WORKER_ID=str(i))
+            if not args.no_routing:
+                env["CLUSTER_NODES"] = nodes
+            procs.append(start_server("server:app", port, env))
+        for url in urls:
+            await wait_ready(f"{url}/health")
+
+        rec = Recorder()
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(args.threads):
+            queue.put_nowait(index)
+        limits = httpx.Limits(max_connections=args.clients * 2, max_keepalive_connections=args.clients * 2)
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(120.0)) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(simulated_client(client, urls, queue, args, rec) for _ in range(args.clients)))
+            elapsed = time.perf_counter() - start
+            forwards = await scrape_forwards(client, urls)
+        return {
+            "workers": workers,
+            "turns": rec.turns,
+            "elapsed_s": round(elapsed, 2),
+            "turns_per_sec": round(rec.turns / elapsed, 2) if elapsed else None,
+            "latency": percentiles(rec.latency),
+            "lost_history": rec.lost,
+            "forwards": forwards,
+            "errors": rec.errors,
+        }
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait()
+
+
+async def run(args) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="chatkit-cluster-")
+    stub_env = dict(os.environ, STUB_OPENAI_ECHO_HISTORY="1")
+    # Short replies keep the stub and the client cheap, so the box's CPU is not the bottleneck
+    stub_env.setdefault("STUB_OPENAI_LATENCY", "0.5")
+    stub_env.setdefault("STUB_OPENAI_JITTER", "0.05")
+    stub_env.setdefault("STUB_OPENAI_TOKEN_DELAY", "0.005")
+    stub_env.setdefault("STUB_OPENAI_REPLY_TOKENS", "5")
+    openai_port = free_port()
+    stub = start_server("stubs.openai_api:app", openai_port, stub_env)
+    base_env = dict(
+        os.environ,
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-bench"),
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+        N8N_OUTBOX_PATH=os.path.join(tmpdir, "outbox.db"),
+        USAGE_DB_PATH=os.path.join(tmpdir, "usage.db"),
+        USAGE_IP_DAILY_TOKENS="0",
+        SESSION_POOL_SIZE="0",
+        FAQ_CACHE_ENABLED="0",
+        SUMMARY_MODEL="",
+        UPSTREAM_MAX_CONCURRENCY=str(args.per_worker_upstream),
+        UPSTREAM_MAX_QUEUED="1000",
+        UPSTREAM_QUEUE_TIMEOUT="120",
+        RATE_LIMIT_PER_MINUTE="100000",
+        RATE_LIMIT_BURST="100000",
+        RATE_LIMIT_IP_PER_MINUTE="0",
+    )
+    base_env.pop("CLUSTER_NODES", None)
+    try:
+        await wait_ready(f"http://127.0.0.1:{openai_port}/stats")
+        runs = []
+        for workers in args.workers:
+            result = await run_cluster(workers, args, base_env)
+            runs.append(result)
+            print(
+                f"{workers} worker(s): {result['turns_per_sec']} turns/s, "
+                f"p50 {result['latency'].get('p50_ms')}ms p95 {result['latency'].get('p95_ms')}ms, "
+                f"lost history {result['lost_history']}/{result['turns']}, forwards {result['forwards']}, "
+                f"errors {result['errors']}"
+            )
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    base = next((r for r in runs if r["workers"] == 1), None)
+    if base and base["turns_per_sec"]:
+        for result in runs:
+            result["scaling"] = round(result["turns_per_sec"] / base["turns_per_sec"], 2)
+            result["efficiency"] = round(result["scaling"] / result["workers"], 2)
+            print(f"{result['workers']} worker(s): {result['scaling']}x of 1 worker ({result['efficiency']:.0%} efficiency)")
+    return {
+        "meta": {
+            "git_sha": git_sha(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "args": vars(args),
+        },
+        "runs": runs,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts to run")
+    parser.add_argument("--clients", type=int, default=48, help="concurrent simulated clients")
+    parser.add_argument("--threads", type=int, default=120, help="threads per run")
+    parser.add_argument("--turns", type=int, default=4, help="user messages per thread")
+    parser.add_argument("--per-worker-upstream", type=int, default=4, help="UPSTREAM_MAX_CONCURRENCY per worker")
+    parser.add_argument("--no-routing", action="store_true", help="independent workers without CLUSTER_NODES")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"), help="directory for the JSON result")
+    args = parser.parse_args()
+    args.workers = [int(n) for n in args.workers.split(",")]
+    random.seed(args.seed)
+
+    result = asyncio.run(run(args))
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.out, f"cluster_{stamp}_{result['meta']['git_sha']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {path}")
+
+    lost = sum(r["lost_history"] for r in result["runs"])
+    if lost and not args.no_routing:
+        raise SystemExit(f"{lost} turns did not see their full thread history")
+
+
+if __name__ == "__main__":
+    main()
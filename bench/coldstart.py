@@ -0,0 +1,202 @@
+"""
+Cold-start benchmark for the two serverless-relevant entry points.
+
+- uvicorn: spawn `python -m uvicorn server:app` and time until the first
+  200 from /health (interpreter start + imports + create_app + lifespan)
+- mangum: in a fresh interpreter, time `import api.index` and the first
+  (and a second, warm) `handler(event, context)` call with a synthetic API
+  Gateway v2 event
+
+Every run uses a new process; medians over --runs are compared against
+--budget-ms (COLD_START_BUDGET_MS) and the script exits 1 if a target is
+over budget, so it can gate a deploy.
+
+    python bench/coldstart.py --runs 5
+    python bench/coldstart.py --root /path/to/older/checkout   # compare trees
+    python bench/coldstart.py --importtime                     # slowest imports
+
+The children get OPENAI_API_KEY=bench (if unset), SESSION_POOL_SIZE=0 and a
+temporary outbox path, so nothing talks to OpenAI or n8n.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+from loadtest import free_port, git_sha
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter: import the Mangum entry point, then invoke it twice
+MANGUM_PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, ".")
+from api.index import handler
+imported = time.perf_counter()
+event = {
+    "version": "2.0",
+    "routeKey": "$default",
+    "rawPath": "/health",
+    "rawQueryString": "",
+    "headers": {"host": "localhost", "user-agent": "coldstart"},
+    "requestContext": {
+        "http": {"method": "GET", "path": "/health", "protocol": "HTTP/1.1",
+                 "sourceIp": "127.0.0.1", "userAgent": "coldstart"},
+        "requestId": "coldstart", "routeKey": "$default", "stage": "$default",
+    },
+    "isBase64Encoded": False,
+}
+response = handler(event, None)
+done = time.perf_counter()
+handler(event, None)
+print(json.dumps({
+    "status": response["statusCode"],
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (done - imported) * 1000,
+    "warm_request_ms": (time.perf_counter() - done) * 1000,
+}))
+"""
+
+
+def child_env(tmp: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench")
+    env["SESSION_POOL_SIZE"] = "0"
+    env["N8N_OUTBOX_PATH"] = os.path.join(tmp, "intent_outbox.db")
+    env["USAGE_DB_PATH"] = os.path.join(tmp, "usage.db")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def import_profile(root: str, module: str, env: dict, limit: int = 12) -> list:
+    """Slowest modules (self time) while importing `module`, via -X importtime."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, '.'); import {module}"],
+        cwd=root, env=env, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "self_ms": s / 1000, "cumulative_ms": c / 1000} for s, c, name in rows[:limit]]
+
+
+def run_uvicorn(args, env: dict) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", args.app, "--port", str(port), "--log-level", "warning"],
+        cwd=args.root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        deadline = started + args.timeout
+        while time.perf_counter() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited: {proc.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(url, timeout=1.0) as response:
+                    return {"status": response.status, "total_ms": (time.perf_counter() - started) * 1000}
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.005)
+        raise RuntimeError(f"{url} did not answer within {args.timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def run_mangum(args, env: dict) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", MANGUM_PROBE], cwd=args.root, env=env, capture_output=True, text=True,
+        timeout=args.timeout,
+    )
+    total_ms = (time.perf_counter() - started) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"mangum probe failed: {proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["total_ms"] = total_ms
+    return result
+
+
+def summarize(runs: list) -> dict:
+    summary = {}
+    for key in ("import_ms", "first_request_ms", "warm_request_ms", "total_ms"):
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {"median": round(statistics.median(values), 1), "max": round(max(values), 1)}
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("all", "uvicorn", "mangum"), default="all")
+    parser.add_argument("--app", default="server:app", help="ASGI app for the uvicorn target")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per target")
+    parser.add_argument("--root", default=ROOT, help="checkout to measure (default: this one)")
+    parser.add_argument(
+        "--budget-ms", type=float, default=float(os.environ.get("COLD_START_BUDGET_MS", "1000")),
+        help="median spawn-to-first-response budget per target",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--importtime", action="store_true", help="also list the slowest imports per target")
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"), help="directory for the JSON result")
+    args = parser.parse_args()
+
+    targets = ("uvicorn", "mangum") if args.target == "all" else (args.target,)
+    runners = {"uvicorn": run_uvicorn, "mangum": run_mangum}
+    result = {
+        "meta": {
+            "git_sha": git_sha(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "targets": {},
+    }
+    over_budget = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = child_env(tmp)
+        for target in targets:
+            runs = [runners[target](args, env) for _ in range(args.runs)]
+            summary = summarize(runs)
+            result["targets"][target] = {"runs": runs, "summary": summary}
+            line = "  ".join(f"{key} {value['median']:.0f}ms (max {value['max']:.0f})" for key, value in summary.items())
+            print(f"{target:<8} {line}")
+            if summary["total_ms"]["median"] > args.budget_ms:
+                over_budget.append(target)
+            if args.importtime:
+                module = "api.index" if target == "mangum" else args.app.split(":")[0]
+                profile = import_profile(args.root, module, env)
+                result["targets"][target]["slowest_imports"] = profile
+                for row in profile:
+                    print(f"    {row['self_ms']:>7.1f}ms self {row['cumulative_ms']:>8.1f}ms cum  {row['module']}")
+
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.out, f"coldstart_{stamp}_{result['meta']['git_sha']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {path}")
+
+    if over_budget:
+        print(f"over the {args.budget_ms:.0f}ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"within the {args.budget_ms:.0f}ms budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Offline evaluation of the intent pre-classifier (intent_classifier.py).
+
+Runs every labeled turn of bench/intent_eval.jsonl (the prompt messages and
+the tools the turn needs) through `IntentClassifier.select()`, with keywords
+only and with keywords plus the n-gram model, and reports:
+
+- precision/recall per tool: was the schema sent when the turn needed it
+- turn recall: turns that got every tool they need (a miss means the model
+  cannot call the tool in that turn)
+- turns sent without any tool schema, and prompt tokens saved per turn
+  (exact with tiktoken installed, else ~4 characters per token)
+- classifier latency per turn, and the one-off training time
+
+    python bench/intent_eval.py
+    python bench/intent_eval.py --threshold 0.3 --data my_labeled_turns.jsonl
+    python bench/intent_eval.py --live 20     # also time real completions
+
+With --live N, the first N turns are sent to OPENAI_BASE_URL twice, with all
+tools and with the selected ones (CHAT_MODEL, non-streaming, max_tokens 16),
+and the mean latency and `usage.prompt_tokens` of both are compared.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from context_window import count_text_tokens  # noqa: E402
+from intent_classifier import IntentClassifier  # noqa: E402
+from payload_codec import PayloadTemplate  # noqa: E402
+from prompts import SYSTEM_PROMPT, TOOLS  # noqa: E402
+
+TOOL_NAMES = tuple(tool["function"]["name"] for tool in TOOLS)
+
+
+def load(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(classifier: IntentClassifier, rows: list, template: PayloadTemplate, repeat: int) -> dict:
+    counts = {name: {"tp": 0, "fp": 0, "fn": 0} for name in TOOL_NAMES}
+    complete = needing = without_tools = 0
+    all_tokens = count_text_tokens(template.tools_json().decode("utf-8"))
+    sent_tokens = 0
+    timings = []
+    for row in rows:
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}] + row["messages"]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            selected = classifier.select(messages)
+        timings.append((time.perf_counter() - started) / repeat)
+
+        needed = set(row["intents"])
+        for name in TOOL_NAMES:
+            if name in selected:
+                counts[name]["tp" if name in needed else "fp"] += 1
+            elif name in needed:
+                counts[name]["fn"] += 1
+        if needed:
+            needing += 1
+            complete += needed <= set(selected)
+        if not selected:
+            without_tools += 1
+        tools_json = template.tools_json(selected)
+        sent_tokens += count_text_tokens(tools_json.decode("utf-8")) if tools_json else 0
+
+    per_tool = {}
+    for name, c in counts.items():
+        precision = c["tp"] / (c["tp"] + c["fp"]) if c["tp"] + c["fp"] else None
+        recall = c["tp"] / (c["tp"] + c["fn"]) if c["tp"] + c["fn"] else None
+        per_tool[name] = dict(c, precision=precision, recall=recall)
+    timings.sort()
+    return {
+        "per_tool": per_tool,
+        "turn_recall": complete / needing if needing else None,
+        "turns_without_tools": without_tools / len(rows),
+        "tool_tokens_all": all_tokens,
+        "tool_tokens_sent_mean": sent_tokens / len(rows),
+        "tool_tokens_saved_mean": all_tokens - sent_tokens / len(rows),
+        "select_us_mean": statistics.mean(timings) * 1e6,
+        "select_us_p99": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6,
+    }
+
+
+def live(classifier: IntentClassifier, rows: list, template: PayloadTemplate, count: int) -> dict:
+    import httpx
+
+    base_url = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    headers = {"Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}", "Content-Type": "application/json"}
+    model = os.environ.get("CHAT_MODEL", "gpt-4o")
+    result = {"all": {"latency": [], "prompt_tokens": []}, "selected": {"latency": [], "prompt_tokens": []}}
+    with httpx.Client(timeout=60.0) as client:
+        for row in rows[:count]:
+            messages = [{"role": "system", "content": SYSTEM_PROMPT}] + row["messages"]
+            for variant, tools in (("all", None), ("selected", classifier.select(messages))):
+                body = json.loads(template.encode(model, messages, stream=False, tools=tools))
+                body["max_tokens"] = 16
+                started = time.perf_counter()
+                response = client.post(f"{base_url}/chat/completions", json=body, headers=headers)
+                response.raise_for_status()
+                result[variant]["latency"].append(time.perf_counter() - started)
+                usage = response.json().get("usage") or {}
+                if "prompt_tokens" in usage:
+                    result[variant]["prompt_tokens"].append(usage["prompt_tokens"])
+    return {
+        variant: {
+            "latency_ms_mean": statistics.mean(values["latency"]) * 1000,
+            "prompt_tokens_mean": statistics.mean(values["prompt_tokens"]) if values["prompt_tokens"] else None,
+        }
+        for variant, values in result.items()
+    }
+
+
+def fmt(value) -> str:
+    return "   -" if value is None else f"{value:.2f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=os.path.join(ROOT, "bench", "intent_eval.jsonl"))
+    parser.add_argument("--threshold", type=float, default=float(os.environ.get("INTENT_THRESHOLD", "0.5")))
+    parser.add_argument("--context-messages", type=int, default=int(os.environ.get("INTENT_CONTEXT_MESSAGES", "3")))
+    parser.add_argument("--repeat", type=int, default=20, help="select() calls per turn when timing")
+    parser.add_argument("--live", type=int, default=0, help="time N real completions with all/selected tools")
+    args = parser.parse_args()
+
+    rows = load(args.data)
+    template = PayloadTemplate(SYSTEM_PROMPT, TOOLS)
+    print(f"{len(rows)} labeled turns, {sum(1 for r in rows if r['intents'])} needing a tool")
+
+    keywords = IntentClassifier(TOOL_NAMES, args.threshold, args.context_messages)
+    keywords._trained = True  # keep the model out: keywords only
+    full = IntentClassifier(TOOL_NAMES, args.threshold, args.context_messages)
+    started = time.perf_counter()
+    full._model()
+    print(f"model training: {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    for name, classifier in (("keywords", keywords), ("keywords+model", full)):
+        result = evaluate(classifier, rows, template, args.repeat)
+        print(f"\n{name}")
+        print(f"  {'tool':<20}{'precision':>10}{'recall':>8}{'tp':>5}{'fp':>5}{'fn':>5}")
+        for tool, c in result["per_tool"].items():
+            print(f"  {tool:<20}{fmt(c['precision']):>10}{fmt(c['recall']):>8}{c['tp']:>5}{c['fp']:>5}{c['fn']:>5}")
+        print(
+            f"  turn recall {fmt(result['turn_recall'])}, "
+            f"{result['turns_without_tools']:.0%} of turns sent without tools"
+        )
+        print(
+            f"  tool schema tokens per turn: {result['tool_tokens_sent_mean']:.0f} of {result['tool_tokens_all']} "
+            f"({result['tool_tokens_saved_mean']:.0f} saved)"
+        )
+        print(f"  select(): {result['select_us_mean']:.0f}us mean, {result['select_us_p99']:.0f}us p99")
+
+    if args.live:
+        print(f"\nlive: {args.live} turns against {os.environ.get('OPENAI_BASE_URL', 'api.openai.com')}")
+        for variant, values in live(full, rows, template, args.live).items():
+            tokens = values["prompt_tokens_mean"]
+            print(
+                f"  {variant:<9} {values['latency_ms_mean']:.0f}ms mean, "
+                f"{'-' if tokens is None else f'{tokens:.0f}'} prompt tokens"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+"""
+Load test and latency benchmark for /chatkit and /api/chatkit/session.
+
+Starts the local stand-ins (stubs/openai_api.py, stubs/n8n_webhook.py) and
+the backend as uvicorn subprocesses, then drives the backend with many
+concurrent simulated ChatKit clients. Reports p50/p95/p99 time-to-first-byte,
+time-to-first-token, full-turn latency, requests/sec and the backend's RSS
+growth, and writes everything to a JSON file for comparison across commits.
+
+    python bench/loadtest.py --clients 50 --threads 2000 --turns 3
+    python bench/loadtest.py --compare bench/results/<earlier run>.json
+
+Stub behaviour (latency, jitter, tool-call rate, errors) is set with the
+STUB_* variables documented in the stub modules; they are passed through.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAQ_MESSAGES = [
+    "Vad kostar era tjänster?",
+    "Vilka tjänster erbjuder ZAAI?",
+    "Hur lång tid tar det att bygga en AI-assistent?",
+    "Kan ni integrera med vårt CRM?",
+    "Var finns ni?",
+    "Erbjuder ni support efter leverans?",
+]
+BOOKING_MESSAGE = "Jag vill boka ett möte, jag heter Test Testsson, 2026-03-15 kl 14:00"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "p50_ms": round(pick(50) * 1000, 2),
+        "p95_ms": round(pick(95) * 1000, 2),
+        "p99_ms": round(pick(99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+def read_rss_kb(pid: int) -> int:
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss // 1024
+    except ImportError:
+        pass
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def git_sha() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def start_server(app: str, port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    cmd = [
+        sys.executable, "-m", "uvicorn", app,
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+class Recorder:
+    def __init__(self):
+        self.ttfb: list = []
+        self.ttft: list = []
+        self.turn: list = []
+        self.session: list = []
+        self.errors: dict = {}
+        self.threads_done = 0
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def run_turn(client: httpx.AsyncClient, thread_id: str, text: str, rec: Recorder) -> None:
+    body = {
+        "type": "threads.add_user_message",
+        "params": {"thread_id": thread_id, "input": {"content": [{"type": "text", "text": text}]}},
+    }
+    start = time.perf_counter()
+    first_byte = first_token = None
+    async with client.stream("POST", "/chatkit", json=body) as resp:
+        if resp.status_code != 200:
+            rec.error(f"chatkit_http_{resp.status_code}")
+            await resp.aread()
+            return
+        async for line in resp.aiter_lines():
+            now = time.perf_counter()
+            if first_byte is None:
+                first_byte = now
+            if first_token is None and "thread.item.updated" in line:
+                first_token = now
+            if line == "data: [DONE]":
+                break
+    end = time.perf_counter()
+    rec.ttfb.append((first_byte or end) - start)
+    if first_token is not None:
+        rec.ttft.append(first_token - start)
+    rec.turn.append(end - start)
+
+
+async def simulated_client(client: httpx.AsyncClient, queue: asyncio.Queue, args, rec: Recorder) -> None:
+    while True:
+        try:
+            index = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            resp = await client.post("/chatkit", json={"type": "threads.create", "params": {}})
+            thread_id = resp.json().get("id") or f"bench_{index}"
+            thread_id = f"{thread_id}_{index}"  # unique even if ids collide
+            for turn in range(args.turns):
+                if random.random() < args.booking_rate:
+                    text = BOOKING_MESSAGE
+                else:
+                    text = FAQ_MESSAGES[(index + turn) % len(FAQ_MESSAGES)]
+                if args.unique:
+                    text = f"{text} (#{index}-{turn})"
+                await run_turn(client, thread_id, text, rec)
+            rec.threads_done += 1
+        except httpx.HTTPError as e:
+            rec.error(type(e).__name__)
+
+
+async def session_client(client: httpx.AsyncClient, count: int, args, rec: Recorder) -> None:
+    for i in range(count):
+        # a few device ids repeat, like refreshes and extra tabs
+        device = f"device_{random.randrange(max(1, args.sessions // 4))}" if i % 2 else None
+        start = time.perf_counter()
+        try:
+            resp = await client.post("/api/chatkit/session", json={"device_id": device} if device else {})
+            if resp.status_code != 200:
+                rec.error(f"session_http_{resp.status_code}")
+                continue
+        except httpx.HTTPError as e:
+            rec.error(type(e).__name__)
+            continue
+        rec.session.append(time.perf_counter() - start)
+
+
+async def sample_rss(pid: int, rec: Recorder, samples: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        samples.append({"t": round(time.monotonic(), 3), "threads": rec.threads_done, "rss_kb": read_rss_kb(pid)})
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args) -> dict:
+    procs = []
+    env = dict(os.environ)
+    tmpdir = tempfile.mkdtemp(prefix="chatkit-bench-")
+    pid = args.pid
+    base_url = args.url
+    try:
+        if not base_url:
+            openai_port, n8n_port, app_port = free_port(), free_port(), free_port()
+            procs.append(start_server("stubs.openai_api:app", openai_port, env))
+            procs.append(start_server("stubs.n8n_webhook:app", n8n_port, env))
+            env.update({
+                "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "sk-bench"),
+                "CHATKIT_WORKFLOW_ID": env.get("CHATKIT_WORKFLOW_ID", "wf_bench"),
+                "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+                "N8N_INTENT_WEBHOOK": f"http://127.0.0.1:{n8n_port}/webhook/zaai-chattwidget-action",
+                "N8N_OUTBOX_PATH": os.path.join(tmpdir, "outbox.db"),
+                "CONVERSATION_DB_PATH": os.path.join(tmpdir, "conversations.db"),
+                "USAGE_DB_PATH": os.path.join(tmpdir, "usage.db"),
+            })
+            # Every simulated client shares one IP, i.e. one device and IP budget and rate bucket
+            env.setdefault("USAGE_DEVICE_DAILY_TOKENS", "0")
+            env.setdefault("USAGE_IP_DAILY_TOKENS", "0")
+            env.setdefault("RATE_LIMIT_PER_MINUTE", "0")
+            env.setdefault("RATE_LIMIT_IP_PER_MINUTE", "0")
+            app_proc = start_server(args.app, app_port, env, workers=args.workers)
+            procs.append(app_proc)
+            pid = pid or app_proc.pid
+            base_url = f"http://127.0.0.1:{app_port}"
+            await wait_ready(f"http://127.0.0.1:{openai_port}/stats")
+            await wait_ready(f"http://127.0.0.1:{n8n_port}/received")
+        await wait_ready(f"{base_url}/health")
+
+        rec = Recorder()
+        limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+        timeout = httpx.Timeout(120.0)
+        rss_samples: list = []
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(pid, rec, rss_samples, stop)) if pid else None
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+            session_elapsed = 0.0
+            if args.sessions:
+                per_client = [args.sessions // args.clients + (i < args.sessions % args.clients) for i in range(args.clients)]
+                start = time.perf_counter()
+                await asyncio.gather(*(session_client(client, n, args, rec) for n in per_client if n))
+                session_elapsed = time.perf_counter() - start
+
+            queue: asyncio.Queue = asyncio.Queue()
+            for index in range(args.threads):
+                queue.put_nowait(index)
+            start = time.perf_counter()
+            await asyncio.gather(*(simulated_client(client, queue, args, rec) for _ in range(args.clients)))
+            chat_elapsed = time.perf_counter() - start
+
+        if sampler:
+            stop.set()
+            await sampler
+
+        rss = {}
+        if rss_samples:
+            rss_values = [s["rss_kb"] for s in rss_samples]
+            rss = {
+                "start_kb": rss_values[0],
+                "end_kb": rss_values[-1],
+                "peak_kb": max(rss_values),
+                "growth_kb": rss_values[-1] - rss_values[0],
+                "growth_bytes_per_thread": round((rss_values[-1] - rss_values[0]) * 1024 / max(rec.threads_done, 1), 1),
+                "samples": rss_samples,
+            }
+
+        return {
+            "meta": {
+                "git_sha": git_sha(),
+                "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("compare",)},
+                "stub_env": {k: v for k, v in os.environ.items() if k.startswith("STUB_")},
+            },
+            "session": {
+                "latency": percentiles(rec.session),
+                "requests_per_sec": round(len(rec.session) / session_elapsed, 2) if session_elapsed else None,
+            },
+            "chat": {
+                "threads": rec.threads_done,
+                "turns": len(rec.turn),
+                "ttfb": percentiles(rec.ttfb),
+                "ttft": percentiles(rec.ttft),
+                "turn_latency": percentiles(rec.turn),
+                "turns_per_sec": round(len(rec.turn) / chat_elapsed, 2) if chat_elapsed else None,
+            },
+            "errors": rec.errors,
+            "rss": rss,
+        }
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def summary_lines(result: dict) -> list:
+    chat, session = result["chat"], result["session"]
+    lines = [
+        f"commit {result['meta']['git_sha']}  {result['meta']['timestamp']}",
+        f"session   p50/p95/p99 {session['latency'].get('p50_ms')}/{session['latency'].get('p95_ms')}/"
+        f"{session['latency'].get('p99_ms')} ms  {session['requests_per_sec']} req/s",
+    ]
+    for name in ("ttfb", "ttft", "turn_latency"):
+        stats = chat[name]
+        lines.append(
+            f"{name:<13} p50/p95/p99 {stats.get('p50_ms')}/{stats.get('p95_ms')}/{stats.get('p99_ms')} ms"
+        )
+    lines.append(f"throughput {chat['turns_per_sec']} turns/s over {chat['threads']} threads")
+    if result["rss"]:
+        lines.append(
+            f"rss        {result['rss']['start_kb']} -> {result['rss']['end_kb']} kB "
+            f"({result['rss']['growth_bytes_per_thread']} B/thread)"
+        )
+    if result["errors"]:
+        lines.append(f"errors     {result['errors']}")
+    return lines
+
+
+def compare(result: dict, baseline: dict) -> list:
+    lines = [f"vs {baseline['meta']['git_sha']}:"]
+    for section, name, key in [
+        ("session", "latency", "p95_ms"),
+        ("chat", "ttfb", "p95_ms"),
+        ("chat", "ttft", "p95_ms"),
+        ("chat", "turn_latency", "p95_ms"),
+    ]:
+        new = result[section][name].get(key)
+        old = baseline[section][name].get(key)
+        if new is not None and old:
+            lines.append(f"  {section}.{name}.{key}: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+    new, old = result["chat"]["turns_per_sec"], baseline["chat"]["turns_per_sec"]
+    if new and old:
+        lines.append(f"  chat.turns_per_sec: {old} -> {new} ({(new - old) / old * 100:+.1f}%)")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50, help="concurrent simulated clients")
+    parser.add_argument("--threads", type=int, default=500, help="chat threads to create in total")
+    parser.add_argument("--turns", type=int, default=3, help="user messages per thread")
+    parser.add_argument("--sessions", type=int, default=200, help="session requests before the chat phase")
+    parser.add_argument("--booking-rate", type=float, default=0.1, help="share of turns that trigger a tool call")
+    parser.add_argument("--unique", action="store_true", help="make every message unique (defeats the FAQ cache)")
+    parser.add_argument("--app", default="server:app", help="ASGI app to benchmark")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the app")
+    parser.add_argument("--url", help="benchmark an already running backend instead of starting one")
+    parser.add_argument("--pid", type=int, help="backend pid for RSS sampling when using --url")
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"), help="directory for the JSON result")
+    parser.add_argument("--compare", help="earlier result JSON to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    result = asyncio.run(run(args))
+    print("\n".join(summary_lines(result)))
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(result, json.load(f))))
+
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    path = os.path.join(args.out, f"loadtest_{stamp}_{result['meta']['git_sha']}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    main()
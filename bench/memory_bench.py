@@ -0,0 +1,161 @@
+"""
+Memory benchmark for the in-process conversation store: bytes per thread and
+per message on a synthetic corpus, before (a dict + str per message in a
+deque) and after (MemoryStore: one packed uint32 per message for role code and
+size, and one UTF-8 buffer per thread).
+
+    python bench/memory_bench.py --threads 100000 --max-turns 5
+
+Also times the escalation transcript: `format_conversation` over the whole
+history on every call (before) against MemoryStore.transcript, which only
+formats messages added since the previous call (after).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict, deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conversation_store import MemoryStore, format_conversation  # noqa: E402
+
+WORDS = (
+    "hej vi erbjuder ai-lösningar chattbotar och automatisering för små och medelstora företag "
+    "vad kostar det att bygga en assistent som svarar på frågor dygnet runt år möte bokning "
+    "integration med ert crm tar oftast två till fyra veckor beroende på omfattning"
+).split()
+
+
+def sentence(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def corpus(threads: int, max_turns: int, seed: int):
+    """(thread_id, message) pairs; user ~5-20 words, assistant ~25-90 words."""
+    rng = random.Random(seed)
+    for index in range(threads):
+        thread_id = f"thread_{index}"
+        for _ in range(rng.randint(1, max_turns)):
+            yield thread_id, {"role": "user", "content": sentence(rng, 5, 20)}
+            yield thread_id, {"role": "assistant", "content": sentence(rng, 25, 90)}
+
+
+class DictThread:
+    """The previous MemoryStore thread: the appended dicts kept as they are."""
+
+    __slots__ = ("messages", "total", "summary", "last_access")
+
+    def __init__(self, max_messages: int, now: float):
+        self.messages = deque(maxlen=max_messages)
+        self.total = 0
+        self.summary = None
+        self.last_access = now
+
+
+def build_dicts(args) -> tuple:
+    threads = OrderedDict()
+    count = 0
+    content = 0
+    for thread_id, message in corpus(args.threads, args.max_turns, args.seed):
+        thread = threads.get(thread_id)
+        if thread is None:
+            thread = threads[thread_id] = DictThread(args.max_messages, time.monotonic())
+        thread.messages.append(message)
+        thread.total += 1
+        count += 1
+        content += len(message["content"].encode("utf-8"))
+    return threads, count, content
+
+
+def build_compact(args) -> tuple:
+    store = MemoryStore(max_threads=args.threads, max_messages=args.max_messages)
+    count = 0
+    content = 0
+
+    async def fill():
+        nonlocal count, content
+        for thread_id, message in corpus(args.threads, args.max_turns, args.seed):
+            await store.append(thread_id, message)
+            count += 1
+            content += len(message["content"].encode("utf-8"))
+
+    asyncio.run(fill())
+    return store, count, content
+
+
+def measure(build, args) -> tuple:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result, messages, content = build(args)
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del result
+    return used, messages, content, elapsed
+
+
+def transcript_timing(turns: int, max_messages: int) -> tuple:
+    """Mean µs per escalation when the transcript is needed after every turn."""
+    rng = random.Random(1)
+    messages = []
+    for _ in range(turns):
+        messages.append({"role": "user", "content": sentence(rng, 5, 20)})
+        messages.append({"role": "assistant", "content": sentence(rng, 25, 90)})
+
+    store = MemoryStore(max_messages=max_messages)
+    full = incremental = 0.0
+
+    async def run():
+        nonlocal full, incremental
+        history = deque(maxlen=max_messages)
+        for message in messages:
+            await store.append("t", message)
+            history.append(message)
+            started = time.perf_counter()
+            format_conversation(list(history))
+            full += time.perf_counter() - started
+            started = time.perf_counter()
+            await store.transcript("t")
+            incremental += time.perf_counter() - started
+
+    asyncio.run(run())
+    return full / len(messages) * 1e6, incremental / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=100_000)
+    parser.add_argument("--max-turns", type=int, default=5, help="user/assistant pairs per thread (1..N)")
+    parser.add_argument("--max-messages", type=int, default=50, help="CONVERSATION_MAX_MESSAGES")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads, 1-{args.max_turns} turns each")
+    print(f"{'variant':<18}{'total':>10}{'/thread':>10}{'/message':>10}{'overhead/msg':>14}{'build':>9}")
+    base = None
+    for name, build in (("before (dicts)", build_dicts), ("after (compact)", build_compact)):
+        used, messages, content, elapsed = measure(build, args)
+        per_message = used / messages
+        overhead = (used - content) / messages
+        line = (
+            f"{name:<18}{used / 2**20:>8.1f}MB{used / args.threads:>9.0f}B{per_message:>9.0f}B"
+            f"{overhead:>13.0f}B{elapsed:>8.1f}s"
+        )
+        if base is not None:
+            line += f"   {base / used:.2f}x smaller"
+        base = base or used
+        print(line)
+    print(f"(content: {content / messages:.0f} UTF-8 bytes per message on average)")
+
+    full, incremental = transcript_timing(turns=200, max_messages=args.max_messages)
+    print(f"transcript per escalation: {full:.1f}us full rebuild, {incremental:.1f}us incremental")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Microbenchmark: per-turn cost of encoding the OpenAI request body and the SSE
+frames, before (list concat + json.dumps of the whole payload and every
+event) and after (payload_codec: precomputed prefix + orjson/msgspec).
+
+    python bench/payload_bench.py --history 12 --tokens 40
+
+Reports CPU time per turn and the peak memory traced while encoding one
+turn, for the standard-library encoder and any fast encoder installed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("N8N_DISPATCH", "sync")
+
+import payload_codec  # noqa: E402
+from chatkit_api import item_delta_event, item_done_event  # noqa: E402
+from prompts import SYSTEM_PROMPT, TOOLS  # noqa: E402
+
+WORDS = "Hej! Vi erbjuder AI-lösningar, chattbotar och automatisering för små och medelstora företag.".split()
+
+
+def make_history(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"Fråga {i}: vad kostar en chattbot för en frisörsalong?"})
+        history.append({"role": "assistant", "content": " ".join(WORDS * 3)})
+    history.append({"role": "user", "content": "Kan ni hjälpa oss med bokningar också?"})
+    return history
+
+
+def old_turn(history: list, deltas: list, item_id: str) -> int:
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + history
+    payload = {"model": "gpt-4o", "messages": messages, "tools": TOOLS, "tool_choice": "auto"}
+    # httpx's json= encoding (0.28)
+    body = json.dumps(dict(payload, stream=True), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    size = len(body)
+    for delta in deltas:
+        size += len(f"data: {json.dumps(item_delta_event(item_id, delta))}\n\n".encode("utf-8"))
+    size += len(f"data: {json.dumps(item_done_event(item_id, ''.join(deltas)))}\n\n".encode("utf-8"))
+    return size
+
+
+def new_turn(template, history: list, deltas: list, item_id: str) -> int:
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + history
+    body = template.payload(messages).encode("gpt-4o", stream=True)
+    size = len(body)
+    for delta in deltas:
+        size += len(payload_codec.sse_frame(item_delta_event(item_id, delta)))
+    size += len(payload_codec.sse_frame(item_done_event(item_id, "".join(deltas))))
+    return size
+
+
+def measure(fn, iterations: int) -> tuple:
+    fn()  # warm up (and fill the template's prefix cache)
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    cpu_us = (time.process_time() - start) / iterations * 1e6
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return cpu_us, peak
+
+
+def encoders() -> dict:
+    stdlib = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+    found = {"json": lambda obj: stdlib.encode(obj).encode("utf-8")}
+    try:
+        import orjson
+        found["orjson"] = orjson.dumps
+    except ImportError:
+        pass
+    try:
+        import msgspec
+        found["msgspec"] = msgspec.json.Encoder().encode
+    except ImportError:
+        pass
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history", type=int, default=12, help="earlier user/assistant turn pairs")
+    parser.add_argument("--tokens", type=int, default=40, help="streamed deltas per reply")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    history = make_history(args.history)
+    deltas = [WORDS[i % len(WORDS)] + " " for i in range(args.tokens)]
+    item_id = "item_1700000000000"
+
+    print(f"history: {len(history)} messages, {args.tokens} deltas, {args.iterations} iterations")
+    print(f"{'variant':<16}{'cpu/turn':>12}{'peak mem':>12}{'bytes out':>12}")
+    base_cpu, base_peak = measure(lambda: old_turn(history, deltas, item_id), args.iterations)
+    size = old_turn(history, deltas, item_id)
+    print(f"{'before (json)':<16}{base_cpu:>10.1f}us{base_peak / 1024:>10.1f}KB{size:>12}")
+
+    for name, dumps in encoders().items():
+        payload_codec.dumps = dumps
+        template = payload_codec.PayloadTemplate(SYSTEM_PROMPT, TOOLS)
+        cpu, peak = measure(lambda: new_turn(template, history, deltas, item_id), args.iterations)
+        size = new_turn(template, history, deltas, item_id)
+        print(
+            f"{'after (' + name + ')':<16}{cpu:>10.1f}us{peak / 1024:>10.1f}KB{size:>12}"
+            f"   {base_cpu / cpu:.1f}x cpu, {base_peak / max(peak, 1):.1f}x peak"
+        )
+        first = template.encode("gpt-4o", [{"role": "system", "content": SYSTEM_PROMPT}] + history[:1])
+        second = template.encode("gpt-4o", [{"role": "system", "content": SYSTEM_PROMPT}] + history)
+        stable = template.prefix("gpt-4o", True, "auto")
+        assert first.startswith(stable) and second.startswith(stable), "prefix is not byte-stable"
+
+
+if __name__ == "__main__":
+    main()
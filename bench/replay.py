@@ -0,0 +1,362 @@
+"""
+Replay recorded conversations through the /chatkit pipeline.
+
+Every line of the input JSONL is one conversation, either as recorded
+messages or as the user's turns only:
+
+    {"id": "c1", "messages": [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]}
+    {"id": "c2", "turns": ["Vad kostar en chattbot?", "Kan jag boka en demo?"]}
+
+Backends:
+- live (default): each conversation runs turn by turn through
+  ChatService.run_turn, the code behind /chatkit (history store, context
+  window, tool selection, resilient upstream, tool routing), with its own
+  replies as the history. --concurrency conversations run at once on a pool
+  of asyncio workers. Tool calls are not sent to n8n: they get the
+  acknowledgement the outbox would show and are listed in the output.
+- batch: one request per user turn, built the same way but with the recorded
+  assistant replies as history, in the OpenAI Batch API format. The file is
+  uploaded, the batch polled until done and its results mapped to the same
+  output lines (--batch-input only writes the file). Half the price, but it
+  takes up to 24h and tool calls get no follow-up completion.
+
+--stub starts stubs/openai_api.py on a free port and points OPENAI_BASE_URL
+at it, for offline runs (it implements the Batch API too).
+
+The output has one JSON line per turn, written as soon as the turn is done:
+conversation, turn, user, reply, recorded (the recorded reply, if any),
+source, tools_sent, tool_calls, model, usage, latency_ms, ttft_ms, error.
+A summary goes to stderr.
+
+    python bench/replay.py conversations.jsonl --stub --out results.jsonl
+    CHAT_MODEL=gpt-4o-mini python bench/replay.py conversations.jsonl --concurrency 32 --out mini.jsonl
+    python bench/replay.py conversations.jsonl --backend batch --out batch.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from loadtest import ROOT, free_port, percentiles, start_server, wait_ready
+
+sys.path.insert(0, ROOT)
+
+
+def load_conversations(path: str) -> list:
+    conversations = []
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            messages = row.get("messages") or [{"role": "user", "content": text} for text in row.get("turns", [])]
+            conversations.append({"id": str(row.get("id", index)), "messages": messages})
+    return conversations
+
+
+def user_turns(messages: list) -> list:
+    """[(user text, recorded reply or None, messages before this turn), ...]"""
+    turns = []
+    for index, message in enumerate(messages):
+        if message.get("role") != "user":
+            continue
+        recorded = next(
+            (m.get("content") for m in messages[index + 1:index + 2] if m.get("role") == "assistant"), None
+        )
+        turns.append((message.get("content") or "", recorded, messages[:index]))
+    return turns
+
+
+class Summary:
+    def __init__(self):
+        self.turns = 0
+        self.errors = 0
+        self.latency: list = []
+        self.ttft: list = []
+        self.sources: dict = {}
+        self.tool_calls = 0
+        self.usage: dict = {}
+
+    def add(self, row: dict) -> None:
+        self.turns += 1
+        self.errors += row["error"] is not None
+        if row["latency_ms"] is not None:
+            self.latency.append(row["latency_ms"] / 1000)
+        if row["ttft_ms"] is not None:
+            self.ttft.append(row["ttft_ms"] / 1000)
+        self.sources[row["source"]] = self.sources.get(row["source"], 0) + 1
+        self.tool_calls += len(row["tool_calls"])
+        for key, value in (row["usage"] or {}).items():
+            self.usage[key] = self.usage.get(key, 0) + value
+
+    def lines(self, elapsed: float) -> list:
+        lines = [
+            f"{self.turns} turns in {elapsed:.1f}s ({self.turns / elapsed if elapsed else 0:.1f}/s), "
+            f"{self.errors} errors, {self.tool_calls} tool calls, sources {self.sources}",
+            f"tokens {self.usage}",
+        ]
+        for name, values in (("latency", self.latency), ("ttft", self.ttft)):
+            if values:
+                p = percentiles(values)
+                lines.append(f"{name}: p50 {p['p50_ms']}ms p95 {p['p95_ms']}ms p99 {p['p99_ms']}ms")
+        return lines
+
+
+def write(out, summary: Summary, row: dict) -> None:
+    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    out.flush()
+    summary.add(row)
+
+
+def create_service():
+    """ChatService whose tool calls are recorded instead of sent to n8n."""
+    from chatkit_api import ChatService
+    from prompts import INTENT_ACKS
+    from settings import load_settings
+
+    class ReplayService(ChatService):
+        def __init__(self, settings):
+            super().__init__(settings)
+            self.tool_log: dict = {}  # thread_id -> [{"name", "arguments"}]
+
+        async def run_tool_call(self, tool_call: dict, thread_id: str, conv_text: str) -> str:
+            intent = tool_call["function"]["name"]
+            self.tool_log.setdefault(thread_id, []).append(
+                {"name": intent, "arguments": json.loads(tool_call["function"]["arguments"] or "{}")}
+            )
+            return INTENT_ACKS.get(intent, "Tack! Din förfrågan är mottagen.")
+
+    return ReplayService(load_settings())
+
+
+async def replay_conversation(service, conversation: dict, out, summary: Summary) -> None:
+    from chatkit_api import TurnState
+
+    thread_id = f"replay_{conversation['id']}"
+    for number, (text, recorded, _) in enumerate(user_turns(conversation["messages"]), 1):
+        row = {"conversation": conversation["id"], "turn": number, "user": text, "recorded": recorded}
+        turn = TurnState(f"item_{conversation['id']}_{number}", abandoned=lambda: False)
+        started = time.perf_counter()
+        ttft = None
+        error = None
+        try:
+            await service.conversation_store.append(thread_id, {"role": "user", "content": text})
+            async for _ in service.run_turn(thread_id, text, turn):
+                if ttft is None and turn.parts:
+                    ttft = time.perf_counter() - started
+        except Exception as e:
+            error = repr(e)
+        latency = time.perf_counter() - started
+        if error is None and turn.source == "fallback":
+            error = "no model answered (fallback reply)"
+        elif error is None and turn.source == "rejected":
+            error = "no upstream slot (admission control)"
+        row.update(
+            reply=turn.reply,
+            source=turn.source,
+            tools_sent=list(turn.tools) if turn.tools is not None else None,
+            tool_calls=service.tool_log.pop(thread_id, []),
+            model=turn.model,
+            usage=turn.usage or None,
+            latency_ms=round(latency * 1000, 1),
+            ttft_ms=round(ttft * 1000, 1) if ttft is not None else None,
+            error=error,
+        )
+        write(out, summary, row)
+
+
+async def run_live(args, conversations: list, out, summary: Summary) -> None:
+    import http_pool
+
+    service = create_service()
+    queue: asyncio.Queue = asyncio.Queue()
+    for conversation in conversations:
+        queue.put_nowait(conversation)
+
+    async def worker():
+        while True:
+            try:
+                conversation = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await replay_conversation(service, conversation, out, summary)
+
+    async with http_pool.lifespan(None):
+        await service.start()
+        try:
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        finally:
+            await service.close()
+
+
+async def build_batch(service, conversations: list) -> tuple:
+    """Batch API request lines, and custom_id -> (conversation, turn, user, recorded)."""
+    from payload_codec import loads
+    from prompts import SYSTEM_PROMPT
+
+    model = service.settings.chat_model
+    lines, turns = [], {}
+    for conversation in conversations:
+        for number, (text, recorded, before) in enumerate(user_turns(conversation["messages"]), 1):
+            thread_id = f"replay_{conversation['id']}_{number}"
+            for message in before + [{"role": "user", "content": text}]:
+                if message.get("role") in ("user", "assistant") and message.get("content"):
+                    await service.conversation_store.append(thread_id, message)
+            history = await service.conversation_store.get(thread_id)
+            messages = await service.context_builder.build(thread_id, SYSTEM_PROMPT, history)
+            tools = service.intent_classifier.select(messages) if service.intent_classifier is not None else None
+            custom_id = f"{conversation['id']}/{number}"
+            lines.append({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": loads(service.chat_payload.payload(messages, tools=tools).encode(model, stream=False)),
+            })
+            turns[custom_id] = (conversation["id"], number, text, recorded, tools)
+    return lines, turns
+
+
+async def submit_batch(args, lines: list) -> tuple:
+    """Upload the lines, create the batch, wait for it; (batch, custom_id -> result line)."""
+    import httpx
+
+    import openai_stream
+
+    base_url = openai_stream.OPENAI_BASE_URL
+    headers = {"Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}"}
+    data = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+    async with httpx.AsyncClient(timeout=120.0, headers=headers) as client:
+        upload = await client.post(
+            f"{base_url}/files", files={"file": ("replay.jsonl", data, "application/jsonl")}, data={"purpose": "batch"}
+        )
+        upload.raise_for_status()
+        response = await client.post(f"{base_url}/batches", json={
+            "input_file_id": upload.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        })
+        response.raise_for_status()
+        batch = response.json()
+        print(f"batch {batch['id']}: {len(lines)} requests submitted", file=sys.stderr)
+        while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(args.poll)
+            response = await client.get(f"{base_url}/batches/{batch['id']}")
+            response.raise_for_status()
+            batch = response.json()
+            print(f"batch {batch['id']}: {batch['status']} {batch.get('request_counts')}", file=sys.stderr)
+
+        results = {}
+        for key in ("output_file_id", "error_file_id"):
+            if batch.get(key):
+                response = await client.get(f"{base_url}/files/{batch[key]}/content")
+                response.raise_for_status()
+                for line in response.text.splitlines():
+                    if line.strip():
+                        result = json.loads(line)
+                        results[result["custom_id"]] = result
+    return batch, results
+
+
+async def run_batch(args, conversations: list, out, summary: Summary) -> None:
+    import http_pool
+
+    service = create_service()
+    async with http_pool.lifespan(None):
+        # Only the store and context window are used; nothing is started in the background
+        lines, turns = await build_batch(service, conversations)
+    if args.batch_input:
+        with open(args.batch_input, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        print(f"wrote {len(lines)} Batch API requests to {args.batch_input}", file=sys.stderr)
+        return
+
+    batch, results = await submit_batch(args, lines)
+    for custom_id, (conversation, number, text, recorded, tools) in turns.items():
+        result = results.get(custom_id) or {}
+        response = result.get("response") or {}
+        body = response.get("body") or {}
+        message = ((body.get("choices") or [{}])[0]).get("message") or {}
+        error = result.get("error")
+        if error is None and response.get("status_code") != 200:
+            error = body.get("error") or f"no result (batch {batch['status']})"
+        calls = message.get("tool_calls") or []
+        write(out, summary, {
+            "conversation": conversation,
+            "turn": number,
+            "user": text,
+            "recorded": recorded,
+            "reply": message.get("content") or "",
+            "source": "tool" if calls else "model",
+            "tools_sent": list(tools) if tools is not None else None,
+            "tool_calls": [
+                {"name": call["function"]["name"], "arguments": json.loads(call["function"]["arguments"] or "{}")}
+                for call in calls
+            ],
+            "model": body.get("model"),
+            "usage": body.get("usage"),
+            "latency_ms": None,
+            "ttft_ms": None,
+            "error": json.dumps(error, ensure_ascii=False) if isinstance(error, dict) else error,
+        })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL of recorded conversations")
+    parser.add_argument("--out", default="-", help="JSONL results (default: stdout)")
+    parser.add_argument("--backend", choices=("live", "batch"), default="live")
+    parser.add_argument("--concurrency", type=int, default=8, help="conversations replayed at once (live)")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N conversations")
+    parser.add_argument("--stub", action="store_true", help="run against a local stubs/openai_api.py")
+    parser.add_argument("--faq-cache", action="store_true", help="let repeated questions hit the FAQ cache")
+    parser.add_argument("--batch-input", help="batch: only write the Batch API input file here")
+    parser.add_argument("--poll", type=float, default=30.0, help="batch: seconds between status checks")
+    args = parser.parse_args()
+
+    conversations = load_conversations(args.input)
+    if args.limit:
+        conversations = conversations[:args.limit]
+
+    # Read when the pipeline modules are imported, so set before create_service()
+    os.environ["CONVERSATION_STORE"] = "memory"  # never write replayed turns into a shared store
+    os.environ["N8N_DISPATCH"] = "sync"  # no outbox; tool calls are recorded, not sent
+    os.environ["FAQ_CACHE_ENABLED"] = "1" if args.faq_cache else "0"
+    os.environ["USAGE_ACCOUNTING"] = "0"  # replays neither count against budgets nor are held to them
+    os.environ.setdefault("UPSTREAM_MAX_CONCURRENCY", str(args.concurrency))
+    os.environ.setdefault("UPSTREAM_MAX_QUEUED", str(args.concurrency))
+    os.environ.setdefault("UPSTREAM_QUEUE_TIMEOUT", "300")
+    stub = None
+    if args.stub:
+        port = free_port()
+        stub = start_server("stubs.openai_api:app", port, dict(os.environ))
+        os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+        os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+        os.environ.setdefault("SUMMARY_MODEL", "")
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise SystemExit("OPENAI_API_KEY is not set (use --stub for an offline run)")
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    summary = Summary()
+    runner = run_batch if args.backend == "batch" else run_live
+    started = time.perf_counter()
+    try:
+        if stub is not None:
+            asyncio.run(wait_ready(f"{os.environ['OPENAI_BASE_URL'].rsplit('/v1', 1)[0]}/stats"))
+        asyncio.run(runner(args, conversations, out, summary))
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+    if args.batch_input:
+        return
+    for line in summary.lines(time.perf_counter() - started):
+        print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,642 @@
+"""
+/chatkit: the ChatKit custom backend.
+
+- FAQ / general questions: answered directly by OpenAI with function tools
+- Booking / cancellation / rebooking / escalation: detected via tool_calls,
+  routed to n8n
+- Turns run in the background and stream through sse_stream, so a client
+  that reconnects (`threads.resume`, or a repeat without input carrying
+  `Last-Event-ID`) resumes the turn instead of rerunning it
+
+`ChatService` owns the per-process state behind the endpoint (history store,
+admission control, FAQ cache, intent outbox, resilient upstream, usage
+ledger) and is
+built by `app_factory.create_app` only when the router is enabled.
+"""
+import asyncio
+import json
+import time
+from contextlib import aclosing
+from typing import Callable, Optional
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import http_pool
+import metrics
+import openai_stream
+from admission import Rejected, client_ip, client_key, create_admission
+from cluster import FORWARDED_HEADER, FORWARDS, create_cluster
+from context_window import count_text_tokens, create_context_builder
+from conversation_store import create_store
+from faq_cache import create_faq_cache, is_cacheable, prompt_version
+from intent_classifier import create_intent_classifier
+from intent_outbox import create_outbox, idempotency_key
+from payload_codec import ChatPayload, PayloadTemplate, sse_frame
+from prompts import BUSY_REPLY, FALLBACK_REPLY, INTENT_ACKS, SYSTEM_PROMPT, TOOL_ERROR_REPLY, TOOLS
+from resilience import create_resilient_chat
+from settings import Settings
+from sse_stream import RESUMES, create_streams
+from usage_ledger import create_usage_ledger
+
+
+def sse_event(event: dict) -> bytes:
+    return sse_frame(event)
+
+
+def item_added_event(item_id: str) -> dict:
+    return {"type": "thread.item.added", "item": {"id": item_id, "type": "message", "role": "assistant", "status": "in_progress", "content": []}}
+
+
+def item_delta_event(item_id: str, delta: str) -> dict:
+    return {"type": "thread.item.updated", "item": {"id": item_id, "delta": {"content": [{"type": "output_text", "output_index": 0, "delta": delta}]}}}
+
+
+def error_event(rejected: Rejected) -> dict:
+    return {
+        "type": "error",
+        "code": rejected.reason,
+        "message": BUSY_REPLY,
+        "allow_retry": True,
+        "retry_after": rejected.retry_after,
+    }
+
+
+def item_done_event(item_id: str, text: str) -> dict:
+    return {"type": "thread.item.done", "item": {"id": item_id, "type": "message", "role": "assistant", "status": "completed", "content": [{"type": "output_text", "text": text}]}}
+
+
+class TurnState:
+    """Text and tool calls produced by one assistant turn while it streams."""
+
+    def __init__(self, item_id: str, abandoned: Callable[[], bool]):
+        self.item_id = item_id
+        self.abandoned = abandoned  # true once no client has followed the turn for a while
+        self.parts = []
+        self.reply_start = 0  # parts before this index preceded the tool calls
+        self.tool_calls = openai_stream.ToolCallBuffer()
+        self.finish_reason = None
+        self.disconnected = False
+        self.source = "model"  # how the turn was answered: model, cache, tool or fallback
+        self.tools = None  # tool schemas sent (None: all)
+        self.usage = {}  # tokens summed over the turn's completions
+        self.model = None  # model that answered, as reported with the usage
+        self.models = None  # model chain when a usage budget holds the turn to a cheaper model
+        self.chain_model = None  # model of the chain that answered the last completion
+        self.side_usage = []  # (model, usage) of other calls made for the turn, e.g. summaries
+
+    def add_usage(self, usage: dict, model) -> None:
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            self.usage[key] = self.usage.get(key, 0) + (usage.get(key) or 0)
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        if cached:
+            self.usage["cached_tokens"] = self.usage.get("cached_tokens", 0) + cached
+        self.model = model or self.model
+
+    def add_side_usage(self, model: str, usage: dict) -> None:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        self.side_usage.append((model, {
+            "prompt_tokens": usage.get("prompt_tokens") or 0,
+            "completion_tokens": usage.get("completion_tokens") or 0,
+            "cached_tokens": cached,
+        }))
+
+    def set_chain_model(self, model: str) -> None:
+        self.chain_model = model
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def reply(self) -> str:
+        return "".join(self.parts[self.reply_start:])
+
+
+def sse_response(frames) -> StreamingResponse:
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        # Keep proxies (Render, Framer) from buffering the token stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class ChatService:
+    def __init__(self, settings: Settings):
+        self.settings = settings
+
+        # Conversation history: thread_id → recent messages (backend set by CONVERSATION_STORE)
+        self.conversation_store = create_store()
+
+        # Per-thread turn serialization, global OpenAI concurrency cap and per-client rate limit
+        self.admission = create_admission()
+
+        # Thread/item IDs and, with CLUSTER_NODES, forwarding turns to the worker owning the thread
+        self.cluster = create_cluster()
+
+        # Running and recently finished turns, replayable after a reconnect (SSE_* settings)
+        self.streams = create_streams(self.cluster.ids.next_int)
+
+        # Chat completions go through CHAT_MODEL, then CHAT_MODEL_FALLBACKS, with adaptive
+        # first-token timeouts, a circuit breaker per model and optional hedging
+        self.chat_upstream = create_resilient_chat(
+            settings.chat_model, http_pool.get_client, http_pool.OPENAI_TIMEOUT
+        )
+
+        # Intents are queued in a local outbox and delivered in the background
+        # (N8N_DISPATCH=sync posts inline and waits for n8n's reply instead)
+        self.intent_outbox = create_outbox(
+            settings.n8n_intent_webhook, http_pool.get_client, http_pool.N8N_TIMEOUT
+        )
+
+        # Token-budgeted prompt: recent turns verbatim, older turns folded into a summary
+        self.context_builder = create_context_builder(
+            self.conversation_store,
+            api_key=settings.openai_api_key,
+            get_client=http_pool.get_client,
+            timeout=http_pool.OPENAI_TIMEOUT,
+            reserved_tokens=count_text_tokens(json.dumps(TOOLS, ensure_ascii=False)),
+        )
+
+        # Cached answers for repeated FAQ questions; invalidated when prompt, tools or model change
+        self.faq_cache = create_faq_cache(prompt_version(SYSTEM_PROMPT, json.dumps(TOOLS), settings.chat_model))
+
+        # Tools and system prompt are serialized once; every request body starts with
+        # the same bytes, which keeps OpenAI's prompt cache hitting
+        self.chat_payload = PayloadTemplate(SYSTEM_PROMPT, TOOLS)
+
+        # Only the tool schemas a turn may need are sent (none for plain FAQ turns)
+        self.intent_classifier = create_intent_classifier(TOOLS)
+
+        # Tokens and cost per turn, thread, device and day (batched to SQLite), and the budgets on them
+        self.usage = create_usage_ledger(settings.chat_model)
+
+        self._started = False
+        self._register_gauges()
+
+    def _register_gauges(self) -> None:
+        # Scrape-time gauges for the shared state behind the pipeline
+        metrics.registry.gauge(
+            "chatkit_history_threads", "Threads held by the conversation store", self.conversation_store.size
+        )
+        metrics.registry.gauge(
+            "chatkit_admission", "Busy threads and queued/active upstream calls", self.admission.snapshot
+        )
+        metrics.registry.gauge(
+            "chatkit_circuit_open", "1 while a model's circuit breaker is open or probing",
+            self.chat_upstream.open_circuits, label="model"
+        )
+        metrics.registry.gauge(
+            "chatkit_sse_streams", "Buffered turn streams and their subscribers", self.streams.snapshot
+        )
+        if self.faq_cache is not None:
+            metrics.registry.gauge("chatkit_faq_cache", "FAQ answer cache counters", self.faq_cache.stats)
+        if self.intent_outbox is not None:
+            metrics.registry.gauge(
+                "chatkit_intent_outbox", "n8n intents by outbox status", self.intent_outbox.stats, label="status"
+            )
+        if self.usage is not None:
+            metrics.registry.gauge("chatkit_usage_ledger", "Unflushed turns and budget state held", self.usage.stats)
+
+    async def start(self) -> None:
+        self._started = True
+        await self.conversation_store.start()
+        if self.intent_outbox is not None:
+            await self.intent_outbox.start()
+        if self.intent_classifier is not None:
+            await self.intent_classifier.start()
+        if self.usage is not None:
+            await self.usage.start()
+
+    async def close(self) -> None:
+        self._started = False
+        await self.streams.close()
+        if self.intent_outbox is not None:
+            await self.intent_outbox.close()
+        if self.usage is not None:
+            await self.usage.close()
+        await self.conversation_store.close()
+
+    async def health(self) -> dict:
+        return {
+            "faq_cache": self.faq_cache.stats() if self.faq_cache is not None else None,
+            "intent_outbox": await self.intent_outbox.stats() if self.intent_outbox is not None else None,
+            "admission": self.admission.snapshot(),
+            "circuits": self.chat_upstream.snapshot(),
+            "cluster": self.cluster.snapshot(),
+            "sse": self.streams.snapshot(),
+            "usage": self.usage.stats() if self.usage is not None else None,
+        }
+
+    def openai_headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.settings.openai_api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def stream_completion(self, payload: ChatPayload, turn: TurnState):
+        """Run one chat completion, yielding an SSE frame per content delta."""
+        turn.tool_calls = openai_stream.ToolCallBuffer()
+        turn.finish_reason = None
+        choices = self.chat_upstream.stream(
+            self.openai_headers(), payload, stream=self.settings.openai_stream, models=turn.models,
+            on_model=turn.set_chain_model,
+        )
+        first_token = True
+        # Waits for a free upstream slot (bounded queue, see admission.py)
+        async with self.admission.upstream.slot():
+            with metrics.upstream("openai", stage="openai_total") as call:
+                # aclosing() closes the upstream request if we stop early
+                async with aclosing(choices):
+                    async for choice in choices:
+                        if first_token:
+                            metrics.observe("openai_ttft", time.perf_counter() - call.start)
+                            first_token = False
+                        if turn.abandoned():
+                            metrics.ABORTED_COMPLETIONS.inc()
+                            turn.disconnected = True
+                            return
+                        if choice.get("usage"):
+                            turn.add_usage(choice["usage"], choice.get("model"))
+                        delta = choice.get("delta") or {}
+                        if delta.get("content"):
+                            turn.parts.append(delta["content"])
+                            yield sse_event(item_delta_event(turn.item_id, delta["content"]))
+                        if delta.get("tool_calls"):
+                            turn.tool_calls.add(delta["tool_calls"])
+                        if choice.get("finish_reason"):
+                            turn.finish_reason = choice["finish_reason"]
+
+    async def run_tool_call(self, tool_call: dict, thread_id: str, conv_text: str) -> str:
+        """Send one intent to n8n and return the text result for the model/user."""
+        intent = tool_call["function"]["name"]
+        tool_args = json.loads(tool_call["function"]["arguments"] or "{}")
+
+        print(f"Tool call: {intent}, args: {tool_args}")
+        metrics.INTENTS.inc(intent=intent)
+
+        n8n_payload = {
+            "intent": intent,
+            "thread_id": thread_id,
+            "data": tool_args,
+            "konversation": conv_text
+        }
+        if self.intent_outbox is not None:
+            key = idempotency_key(thread_id, tool_call["id"])
+            await self.intent_outbox.enqueue(key, dict(n8n_payload, idempotency_key=key))
+            return INTENT_ACKS.get(intent, "Tack! Din förfrågan är mottagen.")
+
+        with metrics.upstream("n8n", stage="n8n"):
+            n8n_resp = await http_pool.get_client().post(
+                self.settings.n8n_intent_webhook,
+                json=n8n_payload,
+                timeout=http_pool.N8N_TIMEOUT
+            )
+            n8n_resp.raise_for_status()
+        n8n_data = n8n_resp.json()
+        return (
+            n8n_data.get("response")
+            or n8n_data.get("output")
+            or n8n_data.get("text")
+            or "Åtgärden genomfördes."
+        )
+
+    async def run_tool_calls(self, tool_calls: list, thread_id: str, item_id: str) -> list:
+        """
+        Run every tool call of one assistant turn concurrently, each with its own
+        timeout, and return the matching `tool` role messages (in call order).
+        """
+        started = time.perf_counter()
+        conv_text = await self.conversation_store.transcript(thread_id)
+        for index, tool_call in enumerate(tool_calls):
+            tool_call["id"] = tool_call["id"] or f"call_{item_id}_{index}"
+
+        results = await asyncio.gather(
+            *(
+                asyncio.wait_for(
+                    self.run_tool_call(tool_call, thread_id, conv_text), self.settings.tool_call_timeout
+                )
+                for tool_call in tool_calls
+            ),
+            return_exceptions=True,
+        )
+
+        tool_messages = []
+        for tool_call, result in zip(tool_calls, results):
+            if isinstance(result, BaseException):
+                print(f"ERROR: tool call {tool_call['function']['name']} failed: {result!r}")
+                metrics.record_error(result, "tool_routing")
+                result = TOOL_ERROR_REPLY
+            tool_messages.append({"role": "tool", "tool_call_id": tool_call["id"], "content": result})
+        metrics.observe("tool_routing", time.perf_counter() - started)
+        return tool_messages
+
+    async def stream_tool_followup(self, payload: ChatPayload, tool_turn: list, turn: TurnState):
+        """
+        Phrase the final answer from the tool results with a second streamed
+        completion. Without TOOL_FOLLOWUP (or if it fails) the tool results are
+        shown as they are.
+        """
+        if self.settings.tool_followup:
+            followup = payload.followup(tool_turn)
+            try:
+                async for frame in self.stream_completion(followup, turn):
+                    yield frame
+                if turn.reply or turn.disconnected:
+                    return
+            except Exception as e:
+                print(f"WARNING: tool follow-up completion failed: {e}")
+                metrics.record_error(e, "tool_followup")
+
+        text = "\n\n".join(m["content"] for m in tool_turn if m["role"] == "tool")
+        turn.parts.append(text)
+        yield sse_event(item_delta_event(turn.item_id, text))
+
+    async def chatkit_handler(self, request: Request):
+        """
+        ChatKit custom backend.
+        - FAQ / general questions: answered directly by OpenAI (CHAT_MODEL) with function tools
+        - Booking / cancellation / rebooking / escalation: detected via tool_calls, routed to n8n
+        """
+        started = time.perf_counter()
+        if not self._started:
+            # No lifespan hook (e.g. serverless): start the store and outbox on first use
+            await self.start()
+        raw = await request.body()
+        body = json.loads(raw)
+        req_type = body.get("type", "")
+        params = body.get("params", {})
+
+        if req_type == "threads.create":
+            thread_id = self.cluster.new_thread_id()
+            return JSONResponse({
+                "id": thread_id,
+                "object": "chatkit.thread",
+                "created_at": int(time.time()),
+                "metadata": {},
+            })
+
+        if req_type == "threads.resume":
+            thread_id = params.get("thread_id")
+            if not thread_id:
+                raise HTTPException(status_code=400, detail="thread_id required")
+            response = await self.route(request, raw, thread_id)
+            if response is not None:
+                return response
+            return self.resume(thread_id, request.headers.get("last-event-id") or params.get("last_event_id"))
+
+        if req_type == "threads.add_user_message":
+            thread_id = params.get("thread_id") or self.cluster.new_thread_id()
+            response = await self.route(request, raw, thread_id)
+            if response is not None:
+                return response
+            content_list = params.get("input", {}).get("content", [])
+            user_message = " ".join(
+                c.get("text", "") for c in content_list if c.get("type") == "text"
+            )
+            if "last-event-id" in request.headers and not user_message.strip():
+                # A reconnect without new input; a message with input is always a new turn
+                return self.resume(thread_id, request.headers["last-event-id"])
+            metrics.observe("request_parse", time.perf_counter() - started)
+            return await self.add_user_message(request, params, thread_id, user_message, started)
+
+        return JSONResponse({})
+
+    async def route(self, request: Request, body: bytes, thread_id: str):
+        """The owner's response when another worker owns `thread_id`, else None (serve it here)."""
+        owner_url = self.cluster.url_for(thread_id)
+        if owner_url is None or FORWARDED_HEADER in request.headers:
+            return None
+        return await self.forward(request, body, owner_url)
+
+    async def forward(self, request: Request, body: bytes, url: str):
+        """Relay a turn to the worker owning its thread; None if that worker is unreachable."""
+        headers = {"content-type": "application/json", FORWARDED_HEADER: str(self.cluster.worker_id)}
+        for name in ("x-device-id", "last-event-id"):
+            if name in request.headers:
+                headers[name] = request.headers[name]
+        # Append the peer, like any proxy; the owner trusts this worker's hop via TRUSTED_PROXIES
+        hops = [request.headers.get("x-forwarded-for"), request.client.host if request.client else None]
+        forwarded_for = ", ".join(hop for hop in hops if hop)
+        if forwarded_for:
+            headers["x-forwarded-for"] = forwarded_for
+
+        client = http_pool.get_client()
+        upstream = client.build_request(
+            "POST", f"{url}/chatkit", content=body, headers=headers, timeout=http_pool.OPENAI_TIMEOUT
+        )
+        try:
+            response = await client.send(upstream, stream=True)
+        except httpx.TransportError as e:
+            print(f"WARNING: thread owner {url} unreachable, serving the turn here: {e!r}")
+            FORWARDS.inc(result="fallback")
+            return None
+        FORWARDS.inc(result="ok")
+
+        async def relay():
+            # Closing the upstream response also tells the owner the client left
+            try:
+                async for chunk in response.aiter_raw():
+                    yield chunk
+            finally:
+                await response.aclose()
+
+        passthrough = ("content-type", "cache-control", "x-accel-buffering", "retry-after")
+        return StreamingResponse(
+            relay(),
+            status_code=response.status_code,
+            headers={k: v for k, v in response.headers.items() if k in passthrough},
+        )
+
+    def resume(self, thread_id: str, last_event_id: Optional[str]):
+        """
+        Continue a thread's latest turn after `last_event_id` (None: from the
+        start) without running it again. An id from any other turn, or one
+        that no longer is buffered, is answered with 410.
+        """
+        after = None
+        if last_event_id is not None:
+            try:
+                after = int(last_event_id)
+            except ValueError:
+                after = -1  # matches no turn
+        stream = self.streams.get(thread_id)
+        if (
+            stream is None
+            or (after is not None and not stream.contains(after))
+            or not stream.can_replay(after)
+        ):
+            RESUMES.inc(result="expired")
+            raise HTTPException(status_code=410, detail="stream_expired")
+        RESUMES.inc(result="live" if not stream.finished else "replayed")
+        return sse_response(stream.frames(after))
+
+    async def run_turn(self, thread_id: str, user_message: str, turn: TurnState):
+        """
+        Answer the user message just appended to `thread_id`, yielding SSE frames
+        and appending the reply to the history. Shared by /chatkit and bench/replay.py.
+        """
+        conversation_store = self.conversation_store
+        faq_cache = self.faq_cache
+        item_id = turn.item_id
+        completed = False
+        cacheable = False
+        rejected = None
+        metrics.start_turn()
+
+        yield sse_event(item_added_event(item_id))
+
+        try:
+            history = await conversation_store.get(thread_id)
+            cacheable = faq_cache is not None and is_cacheable(history, user_message)
+            if faq_cache is not None and not cacheable:
+                faq_cache.record_bypass()
+            cached_reply = faq_cache.get(user_message) if cacheable else None
+
+            if cached_reply is not None:
+                # Known FAQ – answer from cache without calling OpenAI
+                turn.source = "cache"
+                metrics.mark("history_build")
+                turn.parts.append(cached_reply)
+                yield sse_event(item_delta_event(item_id, cached_reply))
+            else:
+                messages = await self.context_builder.build(
+                    thread_id, SYSTEM_PROMPT, history, on_usage=turn.add_side_usage
+                )
+                metrics.mark("history_build")
+                tools = None
+                if self.intent_classifier is not None:
+                    tools = self.intent_classifier.select(messages)
+                    metrics.mark("intent_classify")
+                    selection = "all" if len(tools) == len(TOOLS) else "subset" if tools else "none"
+                    metrics.TOOL_SELECTIONS.inc(tools=selection)
+                turn.tools = tools
+                payload = self.chat_payload.payload(messages, tools=tools)
+                async for frame in self.stream_completion(payload, turn):
+                    yield frame
+                if turn.disconnected:
+                    return
+
+                if turn.finish_reason == "tool_calls" and turn.tool_calls:
+                    # Specific intents detected – route all of them to n8n concurrently
+                    turn.source = "tool"
+                    tool_calls = turn.tool_calls.calls()
+                    tool_messages = await self.run_tool_calls(tool_calls, thread_id, item_id)
+                    tool_turn = [
+                        {"role": "assistant", "content": turn.text or None, "tool_calls": tool_calls}
+                    ] + tool_messages
+                    for message in tool_turn:
+                        await conversation_store.append(thread_id, message)
+                    turn.reply_start = len(turn.parts)
+
+                    async for frame in self.stream_tool_followup(payload, tool_turn, turn):
+                        yield frame
+                    if turn.disconnected:
+                        return
+                elif cacheable and turn.finish_reason == "stop" and turn.chain_model == self.settings.chat_model:
+                    # Only CHAT_MODEL's answers: the cache is versioned by it, not by fallbacks or downgrades
+                    faq_cache.put(user_message, turn.text)
+
+            completed = True
+
+        except Rejected as e:
+            # No upstream slot: the response is already streaming, so the 503 and
+            # its Retry-After go out as an error event instead of an apology
+            rejected = e
+        except Exception as e:
+            print(f"Error in chatkit handler: {e}")
+            metrics.record_error(e, "turn")
+            import traceback
+            traceback.print_exc()
+
+        if rejected is not None and not turn.parts:
+            turn.source = "rejected"
+            metrics.TURNS.inc(source=turn.source)
+            yield sse_event(error_event(rejected))
+            yield "data: [DONE]\n\n"
+            return
+        if not turn.parts and cacheable and not turn.disconnected:
+            # No model answered – a close cached FAQ answer beats an apology
+            cached_reply = faq_cache.get_fallback(user_message)
+            if cached_reply is not None:
+                turn.source = "cache_fallback"
+                turn.parts.append(cached_reply)
+                yield sse_event(item_delta_event(item_id, cached_reply))
+        if not turn.parts:
+            turn.source = "fallback"
+            turn.parts.append(FALLBACK_REPLY)
+            yield sse_event(item_delta_event(item_id, FALLBACK_REPLY))
+        if completed:
+            await conversation_store.append(thread_id, {"role": "assistant", "content": turn.reply})
+
+        metrics.TURNS.inc(source=turn.source)
+        yield sse_event(item_done_event(item_id, turn.text))
+        yield "data: [DONE]\n\n"
+
+    async def add_user_message(self, request: Request, params: dict, thread_id: str, user_message: str, started: float):
+        conversation_store = self.conversation_store
+        admission = self.admission
+
+        # One turn per thread at a time; shed with 429/503 + Retry-After when full
+        device_id = request.headers.get("x-device-id") or (params.get("metadata") or {}).get("device_id")
+        ip = client_ip(request.headers, request.client.host if request.client else None, admission.trusted_proxies)
+        client = client_key(ip, device_id)
+        try:
+            await admission.admit(thread_id, client, ip)
+        except Rejected as e:
+            print(f"Rejected turn for {thread_id} ({client}): {e.reason}")
+            raise HTTPException(status_code=e.status_code, detail=e.reason, headers=e.headers())
+        admitted = time.perf_counter()
+
+        def release_thread():
+            admission.release(thread_id, time.perf_counter() - admitted)
+
+        try:
+            # Only admitted turns are checked, so a shed turn never draws on a budget.
+            # A thread, device or IP over its usage budget runs on a cheaper model, or not at all
+            held_to = await self.usage.check(thread_id, client, ip) if self.usage is not None else None
+        except Rejected as e:
+            admission.release(thread_id)
+            print(f"Rejected turn for {thread_id} ({client}): {e.reason}")
+            raise HTTPException(status_code=e.status_code, detail=e.reason, headers=e.headers())
+        except Exception:
+            admission.release(thread_id)
+            raise
+
+        try:
+            await conversation_store.append(thread_id, {"role": "user", "content": user_message})
+            stream = self.streams.open(thread_id)
+            # The turn runs on its own; this response (and any resumed one) follows it
+            turn = TurnState(self.cluster.new_item_id(), stream.abandoned)
+        except Exception:
+            release_thread()
+            raise
+        if held_to is not None:
+            print(f"Usage budget exceeded for {thread_id} ({client}), answering with {held_to}")
+            turn.models = self.chat_upstream.chain_from(held_to)
+
+        def finish_turn():
+            release_thread()
+            if self.usage is not None:
+                self.usage.record(thread_id, client, ip, turn.model, turn.usage, turn.source)
+                for model, usage in turn.side_usage:
+                    self.usage.record(thread_id, client, ip, model, usage, "summary", turns=0)
+
+        try:
+            frames = metrics.track_turn(self.run_turn(thread_id, user_message, turn), started)
+            stream.start(frames, on_done=finish_turn)  # from here on finish_turn releases the thread
+        except Exception:
+            release_thread()
+            raise
+        return sse_response(stream.frames())
+
+    def router(self) -> APIRouter:
+        router = APIRouter()
+        router.add_api_route("/chatkit", self.chatkit_handler, methods=["POST"])
+        if self.usage is not None and self.usage.api_token:
+            router.include_router(self.usage.router())
+        if self.intent_outbox is not None and self.intent_outbox.api_token:
+            router.include_router(self.intent_outbox.router())
+        return router
@@ -0,0 +1,188 @@
+"""
+Scale-out support: collision-free sortable IDs and sticky thread routing.
+
+IDs are 63-bit Snowflake-style integers (milliseconds since 2024-01-01,
+10-bit worker id, 12-bit per-millisecond sequence) written as 13 Crockford
+base32 characters after the prefix, e.g. `thread_0d3kq8v1r0k2m`. They sort
+by creation time and never collide across workers with distinct WORKER_IDs.
+Without WORKER_ID the worker id is random and each millisecond's sequence
+starts at a random offset, so replicas that were never told apart (several
+containers of one image) collide only if both draw the same worker id and
+the same sequence in the same millisecond.
+
+Every thread is owned by one worker: the worker encoded in its ID when that
+worker is in CLUSTER_NODES, otherwise the one a consistent-hash ring picks
+(client-chosen or older IDs). A worker receiving a turn for a thread it does
+not own forwards the request to the owner; if the owner is unreachable it
+serves the turn itself, which keeps the history only with a shared store
+(CONVERSATION_STORE=redis).
+"""
+import bisect
+import hashlib
+import os
+import secrets
+import threading
+import time
+from typing import Optional
+
+import metrics
+
+ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"  # Crockford base32, lower case
+_DIGITS = {c: i for i, c in enumerate(ALPHABET)}
+ID_LENGTH = 13
+
+EPOCH_MS = 1_704_067_200_000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Set on forwarded turns so the receiving worker never forwards them again
+FORWARDED_HEADER = "x-chatkit-forwarded"
+
+FORWARDS = metrics.registry.counter(
+    "chatkit_cluster_forwards_total", "Turns forwarded to the worker owning the thread"
+)
+
+
+def encode(value: int) -> str:
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(text: str) -> Optional[int]:
+    if len(text) != ID_LENGTH:
+        return None
+    value = 0
+    for char in text:
+        digit = _DIGITS.get(char)
+        if digit is None:
+            return None
+        value = value * 32 + digit
+    return value
+
+
+class IdGenerator:
+    def __init__(self, worker_id: int, random_sequence: bool = False):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker id must be between 0 and {MAX_WORKER_ID}, got {worker_id}")
+        self.worker_id = worker_id
+        self.random_sequence = random_sequence
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def _first_sequence(self) -> int:
+        # Random in the lower half, so a millisecond still has 2048+ IDs in order
+        return secrets.randbelow(1 << (SEQUENCE_BITS - 1)) if self.random_sequence else 0
+
+    def next_int(self) -> int:
+        with self._lock:
+            # Never step back in time, even if the wall clock does
+            now = max(int(time.time() * 1000) - EPOCH_MS, self._last_ms)
+            if now == self._last_ms:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    # Out of IDs in this millisecond: borrow the next one
+                    now += 1
+                    self._sequence = self._first_sequence()
+            else:
+                self._sequence = self._first_sequence()
+            self._last_ms = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}_{encode(self.next_int())}"
+
+
+def worker_of(id_: str) -> Optional[int]:
+    """Worker id encoded in an ID from IdGenerator, None for any other string."""
+    value = decode(id_.rpartition("_")[2])
+    if value is None:
+        return None
+    return (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing with `vnodes` points per node."""
+
+    def __init__(self, nodes, vnodes: int = 64):
+        self._points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._keys = [point for point, _ in self._points]
+
+    def node_for(self, key: str):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._points)
+        return self._points[index][1]
+
+
+class Cluster:
+    def __init__(self, worker_id: int, nodes: Optional[dict] = None, random_sequence: bool = False):
+        self.worker_id = worker_id
+        self.nodes = nodes or {}  # worker id -> base URL
+        self.ids = IdGenerator(worker_id, random_sequence)
+        self.ring = HashRing(sorted(self.nodes))
+
+    @property
+    def enabled(self) -> bool:
+        return len(self.nodes) > 1
+
+    def new_thread_id(self) -> str:
+        return self.ids.new_id("thread")
+
+    def new_item_id(self) -> str:
+        return self.ids.new_id("item")
+
+    def owner(self, thread_id: str) -> int:
+        """Worker that owns `thread_id` (this worker when not clustered)."""
+        if not self.enabled:
+            return self.worker_id
+        worker = worker_of(thread_id)
+        if worker in self.nodes:
+            return worker
+        return self.ring.node_for(thread_id)
+
+    def url_for(self, thread_id: str) -> Optional[str]:
+        """Base URL to forward `thread_id` to, None when this worker owns it."""
+        owner = self.owner(thread_id)
+        return None if owner == self.worker_id else self.nodes[owner]
+
+    def snapshot(self) -> dict:
+        return {"worker_id": self.worker_id, "nodes": len(self.nodes)}
+
+
+def parse_nodes(value: str) -> dict:
+    """'0=http://10.0.0.1:8000,1=http://10.0.0.2:8000' -> {0: url, 1: url}"""
+    nodes = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        worker, _, url = item.partition("=")
+        nodes[int(worker)] = url.strip().rstrip("/")
+    return nodes
+
+
+def create_cluster() -> Cluster:
+    """Build from WORKER_ID (default: random) and CLUSTER_NODES."""
+    worker_id = os.environ.get("WORKER_ID")
+    nodes = parse_nodes(os.environ.get("CLUSTER_NODES", ""))
+    if worker_id is None:
+        if len(nodes) > 1:
+            raise ValueError("CLUSTER_NODES is set but WORKER_ID is not.")
+        # Nothing tells replicas or `--workers` processes apart (pids repeat
+        # across containers): draw the worker id and randomize the sequence
+        worker_id = secrets.randbelow(MAX_WORKER_ID + 1)
+        print(f"WORKER_ID is not set, using random worker id {worker_id}")
+        return Cluster(worker_id, nodes, random_sequence=True)
+    worker_id = int(worker_id)
+    if nodes and worker_id not in nodes:
+        raise ValueError(f"WORKER_ID={worker_id} is not listed in CLUSTER_NODES.")
+    return Cluster(worker_id, nodes)
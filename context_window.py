@@ -0,0 +1,242 @@
+"""
+Token-budgeted prompt construction for the /chatkit handler.
+
+The prompt is: system prompt + rolling summary + the thread's messages that
+the summary does not cover yet. The last `keep_turns` user turns are always
+sent verbatim. When the prompt would exceed `max_prompt_tokens`, the older
+uncovered messages are folded into the summary (one summarizer call), so the
+summary only changes when the budget is actually exceeded, or when the store
+is about to trim messages (it keeps `max_messages` per thread) that the
+summary does not cover yet.
+
+Token counts are cached per message content hash, so a turn only tokenizes
+the messages that are new since the previous turn.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from openai_stream import OPENAI_CHAT_URL
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Messages a turn can append before the next build: the reply, tool calls and
+# their results, and the next user message
+EVICTION_HEADROOM = 8
+
+SUMMARY_PROMPT = (
+    "Sammanfatta konversationen mellan kunden och ZAAI:s AI-receptionist kortfattat på svenska. "
+    "Behåll alla konkreta uppgifter (namn, e-post, datum, tider, önskemål, bokningar och "
+    "ärenden) så att samtalet kan fortsätta utan den ursprungliga texten."
+)
+
+
+def _load_encoder():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+# Loaded on the first count: tiktoken and its BPE ranks are slow to import,
+# and processes that never build a prompt (sessions only) should not pay for it
+_encoder = None
+_encoder_loaded = False
+
+
+def count_text_tokens(text: str) -> int:
+    """Exact count with tiktoken when installed, else a ~4 chars/token estimate."""
+    global _encoder, _encoder_loaded
+    if not text:
+        return 0
+    if not _encoder_loaded:
+        _encoder = _load_encoder()
+        _encoder_loaded = True
+    if _encoder is not None:
+        return len(_encoder.encode(text))
+    return len(text) // 4 + 1
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content")
+    if not isinstance(content, str) or "tool_calls" in message:
+        content = json.dumps(
+            {k: v for k, v in message.items() if k != "role"}, ensure_ascii=False, sort_keys=True
+        )
+    return content
+
+
+class TokenCounter:
+    """Per-message token counts, cached by (role, content hash) with LRU eviction."""
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._cache: OrderedDict = OrderedDict()
+
+    def message_tokens(self, message: dict) -> int:
+        text = _message_text(message)
+        # A 16-byte digest instead of the text, so the cache does not hold every message
+        key = (message.get("role"), hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+        tokens = self._cache.get(key)
+        if tokens is not None:
+            self._cache.move_to_end(key)
+            return tokens
+        tokens = count_text_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        self._cache[key] = tokens
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return tokens
+
+    def messages_tokens(self, messages: list) -> int:
+        return sum(self.message_tokens(m) for m in messages)
+
+
+# summarizer(previous_summary, messages_to_fold, on_usage) -> new summary text;
+# on_usage(model, usage), when given, receives the tokens the call used
+Summarizer = Callable[[Optional[str], list, Optional[Callable[[str, dict], None]]], Awaitable[str]]
+
+
+class OpenAISummarizer:
+    """Folds messages into the running summary with a cheap chat model."""
+
+    def __init__(self, api_key: str, get_client: Callable[[], httpx.AsyncClient], model: str, timeout):
+        self.api_key = api_key
+        self.get_client = get_client
+        self.model = model
+        self.timeout = timeout
+
+    async def __call__(self, previous: Optional[str], messages: list, on_usage=None) -> str:
+        transcript = "\n".join(
+            f"{'Kund' if m.get('role') == 'user' else 'AI'}: {m.get('content') or ''}"
+            for m in messages
+            if m.get("role") in ("user", "assistant")
+        )
+        if previous:
+            transcript = f"Tidigare sammanfattning:\n{previous}\n\nNya meddelanden:\n{transcript}"
+        resp = await self.get_client().post(
+            OPENAI_CHAT_URL,
+            headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+            json={
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": transcript},
+                ],
+            },
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        data = resp.json()
+        if on_usage is not None and data.get("usage"):
+            on_usage(data.get("model") or self.model, data["usage"])
+        return data["choices"][0]["message"]["content"].strip()
+
+
+class ContextBuilder:
+    def __init__(
+        self,
+        store,
+        summarizer: Optional[Summarizer],
+        max_prompt_tokens: int = 6000,
+        keep_turns: int = 6,
+        reserved_tokens: int = 0,
+    ):
+        """
+        store: ConversationStore holding messages and the rolling summary
+        reserved_tokens: fixed prompt cost outside the messages (e.g. tool schemas)
+        """
+        self.store = store
+        self.summarizer = summarizer
+        self.max_prompt_tokens = max_prompt_tokens
+        self.keep_turns = keep_turns
+        self.reserved_tokens = reserved_tokens
+        self.counter = TokenCounter()
+
+    def _verbatim_start(self, messages: list) -> int:
+        """Index of the first message of the last `keep_turns` user turns."""
+        seen = 0
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index].get("role") == "user":
+                seen += 1
+                if seen == self.keep_turns:
+                    return index
+        return 0
+
+    @staticmethod
+    def _summary_message(text: str) -> dict:
+        return {"role": "system", "content": f"Sammanfattning av tidigare konversation:\n{text}"}
+
+    async def build(self, thread_id: str, system_prompt: str, history: list, on_usage=None) -> list:
+        """
+        Return the message list to send for this turn, folding old turns if
+        over budget or about to be trimmed by the store. `on_usage(model, usage)`
+        receives a summarizer call's tokens.
+        """
+        total = await self.store.count(thread_id)
+        offset = max(total - len(history), 0)  # absolute index of history[0]
+        summary = await self.store.get_summary(thread_id)
+        covered = summary["covered"] if summary else 0
+        uncovered = history[max(covered - offset, 0):]
+        while uncovered and uncovered[0].get("role") == "tool":
+            uncovered = uncovered[1:]  # the assistant tool call was trimmed away
+
+        prefix = [{"role": "system", "content": system_prompt}]
+        if summary:
+            prefix.append(self._summary_message(summary["text"]))
+        start = offset + len(history) - len(uncovered)  # absolute index of uncovered[0]
+        # Uncovered messages the store may have trimmed by the next build
+        evicting = total + EVICTION_HEADROOM - self.store.max_messages - start
+        budget = self.max_prompt_tokens - self.reserved_tokens
+        tokens = self.counter.messages_tokens(prefix) + self.counter.messages_tokens(uncovered)
+        if tokens <= budget and (evicting <= 0 or self.summarizer is None):
+            return prefix + uncovered
+
+        split = min(max(self._verbatim_start(uncovered), evicting), len(uncovered) - 1)
+        while 0 < split < len(uncovered) - 1 and uncovered[split].get("role") == "tool":
+            split += 1  # fold tool results along with their assistant tool call
+        if split > 0 and self.summarizer is not None:
+            try:
+                text = await self.summarizer(summary["text"] if summary else None, uncovered[:split], on_usage)
+                covered = start + split
+                summary = {"text": text, "covered": covered}
+                await self.store.set_summary(thread_id, summary)
+                prefix = [prefix[0], self._summary_message(text)]
+                uncovered = uncovered[split:]
+            except Exception as e:
+                print(f"WARNING: history summarization failed for {thread_id}: {e}")
+
+        # Still over budget (or summarizing failed): drop the oldest messages,
+        # always keeping the latest user message.
+        used = self.counter.messages_tokens(prefix)
+        kept = []
+        for message in reversed(uncovered):
+            cost = self.counter.message_tokens(message)
+            if kept and used + cost > budget:
+                break
+            kept.append(message)
+            used += cost
+        kept.reverse()
+        while kept and kept[0].get("role") == "tool":
+            kept.pop(0)  # a tool result is invalid without its assistant tool call
+        return prefix + kept
+
+
+def create_context_builder(store, api_key: str, get_client, timeout, reserved_tokens: int = 0) -> ContextBuilder:
+    """Build a ContextBuilder from MAX_PROMPT_TOKENS, CONTEXT_KEEP_TURNS and SUMMARY_MODEL."""
+    model = os.environ.get("SUMMARY_MODEL", "gpt-4o-mini")
+    summarizer = OpenAISummarizer(api_key, get_client, model, timeout) if model else None
+    return ContextBuilder(
+        store,
+        summarizer,
+        max_prompt_tokens=int(os.environ.get("MAX_PROMPT_TOKENS", "6000")),
+        keep_turns=int(os.environ.get("CONTEXT_KEEP_TURNS", "6")),
+        reserved_tokens=reserved_tokens,
+    )
@@ -0,0 +1,597 @@
+"""
+Pluggable conversation history storage for the /chatkit handler.
+
+Backends:
+- MemoryStore: in-process LRU with per-thread TTL and size caps
+- SQLiteStore: WAL-mode SQLite file with batched, off-loop writes
+- RedisStore: any Redis-compatible server (Redis, Valkey, KeyDB)
+
+Every backend appends in O(1) and only ever returns the last
+`max_messages` messages of a thread, so reads stay bounded.
+Pick one with CONVERSATION_STORE=memory|sqlite|redis.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+# Longest transcript kept per thread; older lines are dropped first
+TRANSCRIPT_MAX_CHARS = _env_int("TRANSCRIPT_MAX_CHARS", 32_000)
+
+
+def format_conversation(messages: list) -> str:
+    """Format conversation history as readable text for n8n escalation emails."""
+    lines = []
+    for msg in messages:
+        if msg["role"] not in ("user", "assistant") or not msg.get("content"):
+            continue
+        role = "Kund" if msg["role"] == "user" else "AI"
+        content = msg.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(
+                c.get("text", "") for c in content if isinstance(c, dict)
+            )
+        lines.append(f"{role}: {content}")
+    return "\n".join(lines)
+
+
+class ConversationStore:
+    """Interface shared by all history backends."""
+
+    def __init__(self, max_messages: int = 50):
+        self.max_messages = max_messages
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def append(self, thread_id: str, message: dict) -> None:
+        raise NotImplementedError
+
+    async def get(self, thread_id: str, limit: Optional[int] = None) -> list:
+        """Return the last `limit` (default `max_messages`) messages, oldest first."""
+        raise NotImplementedError
+
+    async def count(self, thread_id: str) -> int:
+        """Total messages ever appended to the thread (including trimmed ones)."""
+        raise NotImplementedError
+
+    async def get_summary(self, thread_id: str) -> Optional[dict]:
+        """Rolling summary `{"text": str, "covered": int}` of the first `covered` messages."""
+        raise NotImplementedError
+
+    async def set_summary(self, thread_id: str, summary: dict) -> None:
+        raise NotImplementedError
+
+    async def size(self) -> int:
+        """Number of threads currently held (best effort for remote stores); read on every /metrics scrape."""
+        raise NotImplementedError
+
+    async def transcript(self, thread_id: str) -> str:
+        """The thread as readable text (see `format_conversation`)."""
+        return format_conversation(await self.get(thread_id))
+
+    def _limit(self, limit: Optional[int]) -> int:
+        return min(limit or self.max_messages, self.max_messages)
+
+
+# Roles are stored as small codes; the first few are fixed, others are added on first use
+_ROLES = ["system", "user", "assistant", "tool"]
+_ROLE_CODES = {role: code for code, role in enumerate(_ROLES)}
+_ROLE_BITS = 4
+_NO_CONTENT = (1 << (32 - _ROLE_BITS)) - 1  # size field value for content=None
+MAX_CONTENT_BYTES = _NO_CONTENT - 1  # largest content the size field can hold (~256 MiB)
+
+
+def _role_code(role: str) -> int:
+    code = _ROLE_CODES.get(role)
+    if code is None:
+        if len(_ROLES) >= 1 << _ROLE_BITS:
+            raise ValueError(f"too many distinct message roles, cannot store {role!r}")
+        code = _ROLE_CODES[sys.intern(role)] = len(_ROLES)
+        _ROLES.append(sys.intern(role))
+    return code
+
+
+class _MemoryThread:
+    """
+    Compact thread record. Instead of a dict and a str per message it keeps
+    one uint32 per message (content size << 4 | role code) and all contents
+    back to back in one UTF-8 bytearray; the rare extra keys (tool_calls,
+    tool_call_id) go in `extras`, keyed by message number. Contents over
+    MAX_CONTENT_BYTES are rejected, since their size would not fit.
+    """
+
+    __slots__ = ("meta", "buffer", "head", "extras", "total", "summary", "last_access", "transcript", "transcript_total")
+
+    def __init__(self, now: float):
+        self.meta = array("I")
+        self.buffer = bytearray()  # grown in place; `+=` on bytes would copy it per message
+        self.head = 0  # buffer offset where the oldest kept message's content starts
+        self.extras: Optional[dict] = None
+        self.total = 0
+        self.summary: Optional[dict] = None
+        self.last_access = now
+        self.transcript = ""
+        self.transcript_total = 0  # messages already formatted into `transcript`
+
+    def append(self, message: dict, max_messages: int) -> None:
+        # Everything that can raise comes before the buffer is touched
+        code = _role_code(message["role"])
+        content = message.get("content")
+        extra = {k: v for k, v in message.items() if k not in ("role", "content")}
+        size = _NO_CONTENT
+        if isinstance(content, str):
+            data = content.encode("utf-8")
+            if len(data) > MAX_CONTENT_BYTES:
+                raise ValueError(
+                    f"message content is {len(data)} bytes, the memory store holds at most {MAX_CONTENT_BYTES}"
+                )
+            self.buffer.extend(data)
+            size = len(data)
+        elif content is not None:
+            extra["content"] = content
+        if extra:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[self.total] = extra
+        self.meta.append(size << _ROLE_BITS | code)
+        self.total += 1
+
+        if len(self.meta) > max_messages:
+            dropped = len(self.meta) - max_messages
+            first = self.total - len(self.meta)
+            for entry in self.meta[:dropped]:
+                size = entry >> _ROLE_BITS
+                self.head += 0 if size == _NO_CONTENT else size
+            del self.meta[:dropped]
+            if self.extras:
+                for number in range(first, first + dropped):
+                    self.extras.pop(number, None)
+        # Drop trimmed contents once they outweigh the kept ones (amortized O(1))
+        if self.head * 2 > len(self.buffer):
+            del self.buffer[:self.head]
+            self.head = 0
+
+    def messages(self, limit: int) -> list:
+        skip = len(self.meta) - limit
+        first = self.total - len(self.meta)
+        offset = self.head
+        messages = []
+        for index, entry in enumerate(self.meta):
+            size = entry >> _ROLE_BITS
+            content = None
+            if size != _NO_CONTENT:
+                if index >= skip:
+                    content = self.buffer[offset:offset + size].decode("utf-8")
+                offset += size
+            if index < skip:
+                continue
+            message = {"role": _ROLES[entry & ((1 << _ROLE_BITS) - 1)], "content": content}
+            if self.extras and first + index in self.extras:
+                message.update(self.extras[first + index])
+            messages.append(message)
+        return messages
+
+    def format(self) -> str:
+        """Transcript of the thread, formatting only messages added since the last call."""
+        new = self.total - self.transcript_total
+        if new:
+            lines = format_conversation(self.messages(min(new, len(self.meta))))
+            if lines:
+                self.transcript = f"{self.transcript}\n{lines}" if self.transcript else lines
+            if len(self.transcript) > TRANSCRIPT_MAX_CHARS:
+                cut = self.transcript.find("\n", len(self.transcript) - TRANSCRIPT_MAX_CHARS)
+                self.transcript = self.transcript[cut + 1:] if cut >= 0 else ""
+            self.transcript_total = self.total
+        return self.transcript
+
+
+class MemoryStore(ConversationStore):
+    """In-process store: LRU eviction past `max_threads`, idle threads expire after `ttl`."""
+
+    def __init__(self, max_threads: int = 10_000, max_messages: int = 50, ttl: float = 24 * 3600):
+        super().__init__(max_messages)
+        self.max_threads = max_threads
+        self.ttl = ttl
+        # thread_id -> _MemoryThread; ordered by last access
+        self._threads: OrderedDict = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        while self._threads:
+            oldest = next(iter(self._threads.values()))
+            if now - oldest.last_access < self.ttl and len(self._threads) <= self.max_threads:
+                break
+            self._threads.popitem(last=False)
+
+    def _touch(self, thread_id: str, now: float) -> Optional[_MemoryThread]:
+        thread = self._threads.get(thread_id)
+        if thread is None:
+            return None
+        if now - thread.last_access >= self.ttl:
+            del self._threads[thread_id]
+            return None
+        thread.last_access = now
+        self._threads.move_to_end(thread_id)
+        return thread
+
+    def _get_or_create(self, thread_id: str) -> _MemoryThread:
+        now = time.monotonic()
+        thread = self._touch(thread_id, now)
+        if thread is None:
+            thread = self._threads[thread_id] = _MemoryThread(now)
+            self._evict(now)
+        return thread
+
+    async def append(self, thread_id: str, message: dict) -> None:
+        self._get_or_create(thread_id).append(message, self.max_messages)
+
+    async def get(self, thread_id: str, limit: Optional[int] = None) -> list:
+        thread = self._touch(thread_id, time.monotonic())
+        if thread is None:
+            return []
+        return thread.messages(self._limit(limit))
+
+    async def count(self, thread_id: str) -> int:
+        thread = self._threads.get(thread_id)
+        return thread.total if thread else 0
+
+    async def get_summary(self, thread_id: str) -> Optional[dict]:
+        thread = self._threads.get(thread_id)
+        return thread.summary if thread else None
+
+    async def set_summary(self, thread_id: str, summary: dict) -> None:
+        self._get_or_create(thread_id).summary = summary
+
+    async def size(self) -> int:
+        return len(self._threads)
+
+    async def transcript(self, thread_id: str) -> str:
+        thread = self._touch(thread_id, time.monotonic())
+        return thread.format() if thread else ""
+
+
+class SQLiteStore(ConversationStore):
+    """
+    SQLite-backed store in WAL mode.
+
+    Appends are buffered and written in one transaction every
+    `flush_interval` seconds (or once `batch_size` messages are pending),
+    on a worker thread so the event loop never blocks on disk I/O.
+    Reads merge the on-disk tail with still-pending messages. Threads idle
+    for longer than `ttl` are deleted, checked every `prune_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_messages: int = 50,
+        batch_size: int = 100,
+        flush_interval: float = 0.5,
+        ttl: float = 24 * 3600,
+        prune_interval: float = 3600,
+    ):
+        super().__init__(max_messages)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self._pruned_at = 0.0
+        self._size = 0
+        self._size_at = float("-inf")
+        self._pending: list = []
+        self._lock = threading.Lock()
+        # Held while a batch is being written so reads never miss it
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._open()
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " thread_id TEXT NOT NULL,"
+            " message TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (thread_id, id)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " thread_id TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL)"
+        )
+        # One row per thread with its last write, for retention
+        created = not self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'threads'"
+        ).fetchone()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS threads ("
+            " thread_id TEXT PRIMARY KEY,"
+            " last_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_threads_last_at ON threads (last_at)")
+        if created:
+            # Files written before the table existed
+            self._conn.execute(
+                "INSERT OR IGNORE INTO threads (thread_id, last_at)"
+                " SELECT thread_id, MAX(created_at) FROM messages GROUP BY thread_id"
+            )
+
+    async def start(self) -> None:
+        if self._conn is None:
+            self._open()
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        with self._lock:
+            self._conn.close()
+            self._conn = None
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"ERROR: conversation store flush failed: {e}")
+            try:
+                await self._maybe_prune()
+            except Exception as e:
+                print(f"ERROR: conversation store pruning failed: {e}")
+
+    def _write_batch(self, batch: list) -> None:
+        last_at = {thread_id: created_at for thread_id, _, created_at in batch}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO messages (thread_id, message, created_at) VALUES (?, ?, ?)", batch
+            )
+            self._conn.executemany(
+                "INSERT INTO threads (thread_id, last_at) VALUES (?, ?)"
+                " ON CONFLICT (thread_id) DO UPDATE SET last_at = excluded.last_at",
+                last_at.items(),
+            )
+            self._conn.execute("COMMIT")
+
+    def _prune(self, before: float) -> int:
+        stale = "SELECT thread_id FROM threads WHERE last_at < ?"
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(f"DELETE FROM messages WHERE thread_id IN ({stale})", (before,))
+                self._conn.execute(f"DELETE FROM summaries WHERE thread_id IN ({stale})", (before,))
+                deleted = self._conn.execute("DELETE FROM threads WHERE last_at < ?", (before,)).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return deleted
+
+    async def _maybe_prune(self) -> None:
+        now = time.time()
+        if self.ttl <= 0 or now - self._pruned_at < self.prune_interval:
+            return
+        self._pruned_at = now
+        deleted = await asyncio.to_thread(self._prune, now - self.ttl)
+        if deleted:
+            print(f"Conversation store: deleted {deleted} threads idle for over {self.ttl:.0f}s")
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception:
+                # Keep the batch for the next attempt, ahead of newer appends
+                self._pending = batch + self._pending
+                raise
+
+    async def append(self, thread_id: str, message: dict) -> None:
+        self._pending.append((thread_id, json.dumps(message, ensure_ascii=False), time.time()))
+        if self._flusher is None:
+            # No lifespan hook (e.g. serverless): start flushing on first use
+            await self.start()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _read_tail(self, thread_id: str, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT message FROM messages WHERE thread_id = ? ORDER BY id DESC LIMIT ?",
+                (thread_id, limit),
+            ).fetchall()
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    async def get(self, thread_id: str, limit: Optional[int] = None) -> list:
+        limit = self._limit(limit)
+        async with self._flush_lock:
+            pending = [json.loads(m) for t, m, _ in self._pending if t == thread_id]
+            if len(pending) >= limit:
+                return pending[-limit:]
+            stored = await asyncio.to_thread(self._read_tail, thread_id, limit - len(pending))
+        return stored + pending
+
+    def _count_stored(self, thread_id: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE thread_id = ?", (thread_id,)
+            ).fetchone()[0]
+
+    async def count(self, thread_id: str) -> int:
+        async with self._flush_lock:
+            pending = sum(1 for t, _, _ in self._pending if t == thread_id)
+            return pending + await asyncio.to_thread(self._count_stored, thread_id)
+
+    def _read_summary(self, thread_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_summary(self, thread_id: str, summary: dict) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (thread_id, summary) VALUES (?, ?)",
+                (thread_id, json.dumps(summary, ensure_ascii=False)),
+            )
+
+    async def get_summary(self, thread_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._read_summary, thread_id)
+
+    async def set_summary(self, thread_id: str, summary: dict) -> None:
+        await asyncio.to_thread(self._write_summary, thread_id, summary)
+
+    def _count_threads(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+
+    async def size(self) -> int:
+        # Counted at most once a minute, however often /metrics is scraped
+        now = time.monotonic()
+        if now - self._size_at >= 60:
+            self._size = await asyncio.to_thread(self._count_threads)
+            self._size_at = now
+        return self._size
+
+
+class RedisStore(ConversationStore):
+    """
+    Redis-compatible store: one capped list per thread.
+
+    append is RPUSH + LTRIM + INCR + EXPIRE in a single pipeline round trip,
+    so lists never grow past `max_messages` and idle threads expire after `ttl`.
+    A sorted set of thread ids by last append backs `size()`, so it never
+    scans the keyspace.
+    """
+
+    def __init__(self, url: str, max_messages: int = 50, ttl: int = 24 * 3600, prefix: str = "chatkit:"):
+        super().__init__(max_messages)
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise ImportError(
+                "CONVERSATION_STORE=redis requires the 'redis' package (pip install redis)"
+            ) from e
+        self.ttl = ttl
+        self.prefix = prefix
+        self._threads_key = f"{prefix}threads"
+        self._appends = 0
+        self._redis = redis.from_url(url)
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+    def _key(self, kind: str, thread_id: str) -> str:
+        return f"{self.prefix}{kind}:{thread_id}"
+
+    async def append(self, thread_id: str, message: dict) -> None:
+        key = self._key("thread", thread_id)
+        count_key = self._key("count", thread_id)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, json.dumps(message, ensure_ascii=False))
+            pipe.ltrim(key, -self.max_messages, -1)
+            pipe.incr(count_key)
+            pipe.expire(key, self.ttl)
+            pipe.expire(count_key, self.ttl)
+            pipe.zadd(self._threads_key, {thread_id: time.time()})
+            self._appends += 1
+            if self._appends % 1000 == 0:
+                # Keeps the index bounded even when size() is never called
+                pipe.zremrangebyscore(self._threads_key, "-inf", time.time() - self.ttl)
+            await pipe.execute()
+
+    async def get(self, thread_id: str, limit: Optional[int] = None) -> list:
+        raw = await self._redis.lrange(self._key("thread", thread_id), -self._limit(limit), -1)
+        return [json.loads(item) for item in raw]
+
+    async def count(self, thread_id: str) -> int:
+        return int(await self._redis.get(self._key("count", thread_id)) or 0)
+
+    async def get_summary(self, thread_id: str) -> Optional[dict]:
+        raw = await self._redis.get(self._key("summary", thread_id))
+        return json.loads(raw) if raw else None
+
+    async def set_summary(self, thread_id: str, summary: dict) -> None:
+        await self._redis.set(
+            self._key("summary", thread_id), json.dumps(summary, ensure_ascii=False), ex=self.ttl
+        )
+
+    async def size(self) -> int:
+        # Threads that have expired since the last call leave the index first
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(self._threads_key, "-inf", time.time() - self.ttl)
+            pipe.zcard(self._threads_key)
+            _, count = await pipe.execute()
+        return count
+
+
+def create_store() -> ConversationStore:
+    """Build the store selected by CONVERSATION_STORE (default: memory)."""
+    backend = os.environ.get("CONVERSATION_STORE", "memory").lower()
+    max_messages = _env_int("CONVERSATION_MAX_MESSAGES", 50)
+    ttl = _env_float("CONVERSATION_TTL", 24 * 3600)
+
+    if backend == "memory":
+        return MemoryStore(
+            max_threads=_env_int("CONVERSATION_MAX_THREADS", 10_000),
+            max_messages=max_messages,
+            ttl=ttl,
+        )
+    if backend == "sqlite":
+        return SQLiteStore(
+            path=os.environ.get("CONVERSATION_DB_PATH", "conversations.db"),
+            max_messages=max_messages,
+            batch_size=_env_int("CONVERSATION_BATCH_SIZE", 100),
+            flush_interval=_env_float("CONVERSATION_FLUSH_INTERVAL", 0.5),
+            ttl=ttl,
+        )
+    if backend == "redis":
+        url = os.environ.get("REDIS_URL")
+        if not url:
+            raise ValueError("CONVERSATION_STORE=redis requires REDIS_URL to be set.")
+        return RedisStore(url=url, max_messages=max_messages, ttl=int(ttl))
+    raise ValueError(f"Unknown CONVERSATION_STORE: {backend!r} (expected memory, sqlite or redis)")
@@ -0,0 +1,209 @@
+"""
+Answer cache for plain FAQ questions opening a thread, checked before
+calling OpenAI.
+
+Two tiers, both scoped to one system prompt version:
+- exact: normalized user message -> answer
+- near-duplicate: cosine similarity over hashed character 3-gram vectors,
+  kept in a preallocated NumPy matrix (skipped if NumPy is not installed);
+  NumPy is imported and the matrix allocated on the first `put`
+
+Entries expire after `ttl` seconds and the least recently used entry is
+evicted once `max_entries` is reached.
+"""
+import hashlib
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+np = None
+_numpy_checked = False
+
+
+def _numpy():
+    """Import NumPy on first use; None when it is not installed."""
+    global np, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return np
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+# Turns touching bookings, escalation or contact details depend on the
+# conversation and must never be answered from (or stored in) the cache.
+BOOKING_CONTEXT = re.compile(
+    r"(av|om)?boka|bokning|möte|eskalera|människa|e-?post|@",
+    re.IGNORECASE,
+)
+
+
+def normalize(text: str) -> str:
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def prompt_version(*parts: str) -> str:
+    """Short stable hash of everything that shapes the answer (prompt, model)."""
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def is_cacheable(history: list, user_message: str) -> bool:
+    """
+    True for FAQ turns that open a thread (`history` holds only the new user
+    message) and touch no booking. The key is the message alone, so a
+    follow-up such as "Vad kostar den?" must not be answered from, or stored
+    for, another conversation.
+    """
+    if BOOKING_CONTEXT.search(user_message):
+        return False
+    earlier = history[:-1] if history and history[-1].get("role") == "user" else history
+    return not earlier
+
+
+class _Entry:
+    __slots__ = ("answer", "expires_at", "slot")
+
+    def __init__(self, answer: str, expires_at: float, slot: int):
+        self.answer = answer
+        self.expires_at = expires_at
+        self.slot = slot
+
+
+class FAQCache:
+    def __init__(
+        self,
+        version: str,
+        max_entries: int = 1000,
+        ttl: float = 6 * 3600,
+        similarity: float = 0.9,
+        dim: int = 1024,
+        fallback_similarity: Optional[float] = None,
+    ):
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.fallback_similarity = similarity if fallback_similarity is None else fallback_similarity
+        self.dim = dim
+        self._entries: OrderedDict = OrderedDict()  # normalized message -> _Entry
+        self._slot_keys: list = [None] * max_entries
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._matrix = None  # allocated by the first put()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def _vector(self, key: str):
+        padded = f" {key} "
+        grams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not grams:
+            return vector
+        indices = [zlib.crc32(gram.encode("utf-8")) % self.dim for gram in grams]
+        np.add.at(vector, indices, 1.0)
+        vector /= np.linalg.norm(vector)
+        return vector
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._slot_keys[entry.slot] = None
+        if self._matrix is not None:
+            self._matrix[entry.slot] = 0.0
+        self._free_slots.append(entry.slot)
+
+    def _lookup(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry.answer
+
+    def get(self, message: str, similarity: Optional[float] = None) -> Optional[str]:
+        key = normalize(message)
+        if not key:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+
+        answer = self._lookup(key, now)
+        if answer is not None:
+            self.exact_hits += 1
+            return answer
+
+        if self._matrix is not None and self._entries:
+            scores = self._matrix @ self._vector(key)
+            best = int(scores.argmax())
+            best_key = self._slot_keys[best]
+            threshold = self.similarity if similarity is None else similarity
+            if best_key is not None and scores[best] >= threshold:
+                answer = self._lookup(best_key, now)
+                if answer is not None:
+                    self.semantic_hits += 1
+                    return answer
+
+        self.misses += 1
+        return None
+
+    def get_fallback(self, message: str) -> Optional[str]:
+        """
+        Lookup for when the model is unavailable. As strict as `get()` unless
+        FAQ_FALLBACK_SIMILARITY is lowered: a nearby question ("Vad kostar en
+        röstbot?" for "... chatbot?") may carry a wrong price, worse than the apology.
+        """
+        return self.get(message, similarity=self.fallback_similarity)
+
+    def put(self, message: str, answer: str) -> None:
+        key = normalize(message)
+        if not key or not answer:
+            return
+        if key in self._entries:
+            self._remove(key)
+        if not self._free_slots:
+            self._remove(next(iter(self._entries)))
+        slot = self._free_slots.pop()
+        self._entries[key] = _Entry(answer, time.monotonic() + self.ttl, slot)
+        self._slot_keys[slot] = key
+        if self._matrix is None and _numpy() is not None:
+            self._matrix = np.zeros((self.max_entries, self.dim), dtype=np.float32)
+        if self._matrix is not None:
+            self._matrix[slot] = self._vector(key)
+
+    def record_bypass(self) -> None:
+        self.bypassed += 1
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+        }
+
+
+def create_faq_cache(version: str) -> Optional[FAQCache]:
+    """Build the cache from FAQ_CACHE_* settings; None when FAQ_CACHE_ENABLED=0."""
+    if os.environ.get("FAQ_CACHE_ENABLED", "1").lower() in ("0", "false", "no"):
+        return None
+    fallback_similarity = os.environ.get("FAQ_FALLBACK_SIMILARITY")
+    return FAQCache(
+        version,
+        max_entries=int(os.environ.get("FAQ_CACHE_SIZE", "1000")),
+        ttl=float(os.environ.get("FAQ_CACHE_TTL", str(6 * 3600))),
+        similarity=float(os.environ.get("FAQ_CACHE_SIMILARITY", "0.9")),
+        fallback_similarity=float(fallback_similarity) if fallback_similarity else None,
+    )
@@ -0,0 +1,86 @@
+"""
+Shared, app-scoped httpx connection pool for upstream calls (OpenAI, n8n).
+
+One AsyncClient is created in the FastAPI lifespan hook and reused by every
+handler, so chat turns no longer pay a new TCP+TLS handshake per request.
+When the lifespan hook does not run (e.g. a serverless wrapper), the client
+is created lazily on first use and then kept for the life of the process.
+"""
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def _http2_enabled() -> bool:
+    if os.environ.get("HTTP2_ENABLED", "1").lower() in ("0", "false", "no"):
+        return False
+    try:
+        import h2  # noqa: F401  (httpx only speaks HTTP/2 when h2 is installed)
+    except ImportError:
+        return False
+    return True
+
+
+CONNECT_TIMEOUT = _env_float("HTTP_CONNECT_TIMEOUT", 5.0)
+
+# Per-upstream timeouts. Pass these as `timeout=` on individual requests.
+OPENAI_TIMEOUT = httpx.Timeout(_env_float("OPENAI_TIMEOUT", 60.0), connect=CONNECT_TIMEOUT)
+SESSION_TIMEOUT = httpx.Timeout(_env_float("CHATKIT_SESSION_TIMEOUT", 30.0), connect=CONNECT_TIMEOUT)
+N8N_TIMEOUT = httpx.Timeout(_env_float("N8N_TIMEOUT", 60.0), connect=CONNECT_TIMEOUT)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_client() -> httpx.AsyncClient:
+    """Build a pooled AsyncClient from environment settings."""
+    limits = httpx.Limits(
+        max_connections=_env_int("HTTP_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=_env_int("HTTP_MAX_KEEPALIVE", 20),
+        keepalive_expiry=_env_float("HTTP_KEEPALIVE_EXPIRY", 30.0),
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        http2=_http2_enabled(),
+        timeout=OPENAI_TIMEOUT,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it if the lifespan hook never ran."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+async def startup() -> None:
+    get_client()
+
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """FastAPI lifespan hook: open the pool on startup, drain it on shutdown."""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
@@ -0,0 +1,209 @@
+"""
+Per-turn choice of the function tools sent to OpenAI.
+
+Most turns are plain FAQ questions, yet every request carried all four tool
+schemas (several hundred prompt tokens). `IntentClassifier.select()` looks at
+the latest user messages and the assistant's last reply and returns the
+names of the tools the turn may need, or () for none:
+
+- a keyword/regex pass per intent, which is cheap and favours recall
+- a one-vs-rest logistic regression over hashed character 3-5-grams, trained
+  with NumPy on intent_examples.jsonl in a worker thread when the service
+  starts (keywords only until then, or when NumPy is not installed)
+
+An intent is kept when either pass finds it in one of the last
+INTENT_CONTEXT_MESSAGES user messages, so a booking stays possible while the
+assistant collects the details. Tools called earlier in the prompt are kept
+as well. `bench/intent_eval.py` reports precision/recall and the savings.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import zlib
+from typing import Optional
+
+from faq_cache import _numpy, normalize
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_examples.jsonl")
+
+# Matched against normalized (lower case, no punctuation) text
+PATTERNS = {
+    "boka_tid": re.compile(
+        r"\bbok(a|ar|at|ade|as|ning)|\bmöte|\bdemo|\bträff|\bses\b|\bledig|\breserver|\bgenomgång"
+        r"|\bworkshop|\bpresentation|\brådgivning|\bsamtal"
+    ),
+    "avboka_tid": re.compile(
+        r"avbok|avbeställ|\bställ(a|er)? in|\bstryk|annuller|\bradera|\bta bort"
+        r"|\b(kan|hinner) (inte|tyvärr inte) (komma|delta|ses)|\binte komma"
+    ),
+    "omboka_tid": re.compile(
+        r"ombok|\bflytta|\bbyt(a|er)?\b|\bändra|\bannan (tid|dag)|\bny tid|\bnytt datum|\bskjut"
+        r"|senarelägg|tidigarelägg|\bistället"
+    ),
+    "eskalera_till_team": re.compile(
+        r"människa|\bperson\b|\bkontakt|\bhör av|\bring|\bmejl|\bmail|e ?post|\bklag|missnöjd|handläggare"
+        r"|\bchef|\bansvarig|kundtjänst|eskaler|vidare|specialist|\bexpert|\bteamet|\b0\d{2} ?\d{3}|\b46\d"
+    ),
+}
+
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.]+")  # checked on the raw text
+
+# A date or time on its own (e.g. answering "vilken dag passar?") may belong to any booking intent
+DATE_TIME = re.compile(
+    r"\bkl\b|\bklockan|\b\d{1,2} \d{2}\b|\b\d{4} \d{2} \d{2}\b|\bmåndag|\btisdag|\bonsdag|\btorsdag"
+    r"|\bfredag|\blördag|\bsöndag|\bimorgon|\bidag|\bnästa (vecka|månad)"
+    r"|\b\d{1,2} (jan|feb|mar|apr|maj|jun|jul|aug|sep|okt|nov|dec)"
+)
+BOOKING_TOOLS = ("boka_tid", "avboka_tid", "omboka_tid")
+
+
+def load_examples(path: str = EXAMPLES_PATH) -> list:
+    """[(text, [intent, ...]), ...] from a JSONL file of {"text", "intents"}."""
+    examples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["text"], row["intents"]))
+    return examples
+
+
+class IntentModel:
+    """One-vs-rest logistic regression over hashed character n-grams."""
+
+    def __init__(self, intents: tuple, dim: int = 4096, ngrams: tuple = (3, 4, 5)):
+        self.intents = intents
+        self.dim = dim
+        self.ngrams = ngrams
+        self.weights = None  # (dim, len(intents))
+        self.bias = None
+
+    def features(self, text: str) -> tuple:
+        """Hashed n-gram indices and their weights (L2-normalized counts)."""
+        np = _numpy()
+        padded = f" {normalize(text)} "
+        counts = {}
+        for n in self.ngrams:
+            for i in range(len(padded) - n + 1):
+                index = zlib.crc32(padded[i:i + n].encode("utf-8")) % self.dim
+                counts[index] = counts.get(index, 0) + 1
+        indices = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        norm = np.linalg.norm(values)
+        return indices, values / norm if norm else values
+
+    def fit(self, examples: list, epochs: int = 100, learning_rate: float = 6.0, l2: float = 1e-4) -> None:
+        """Full-batch gradient descent; positives are up-weighted to the share of negatives."""
+        np = _numpy()
+        x = np.zeros((len(examples), self.dim), dtype=np.float32)
+        y = np.zeros((len(examples), len(self.intents)), dtype=np.float32)
+        for row, (text, intents) in enumerate(examples):
+            indices, values = self.features(text)
+            x[row, indices] = values
+            for intent in intents:
+                y[row, self.intents.index(intent)] = 1.0
+        positives = y.sum(axis=0)
+        sample_weight = np.where(y == 1.0, (len(y) - positives) / np.maximum(positives, 1.0), 1.0)
+        sample_weight /= sample_weight.mean(axis=0) * len(y)
+        xt = np.ascontiguousarray(x.T)
+
+        self.weights = np.zeros((self.dim, len(self.intents)), dtype=np.float32)
+        self.bias = np.zeros(len(self.intents), dtype=np.float32)
+        for _ in range(epochs):
+            error = (1.0 / (1.0 + np.exp(-(x @ self.weights + self.bias))) - y) * sample_weight
+            self.weights -= learning_rate * (xt @ error + l2 * self.weights)
+            self.bias -= learning_rate * error.sum(axis=0)
+
+    def predict(self, text: str) -> dict:
+        """intent -> probability"""
+        np = _numpy()
+        indices, values = self.features(text)
+        scores = values @ self.weights[indices] + self.bias
+        return dict(zip(self.intents, (1.0 / (1.0 + np.exp(-scores))).tolist()))
+
+
+class IntentClassifier:
+    def __init__(
+        self,
+        tool_names: tuple,
+        threshold: float = 0.5,
+        context_messages: int = 3,
+        examples_path: str = EXAMPLES_PATH,
+    ):
+        self.tool_names = tool_names
+        self.threshold = threshold
+        self.context_messages = context_messages
+        self.examples_path = examples_path
+        self.model = None
+        self._trained = False
+        self._training = None
+
+    async def start(self) -> None:
+        """Train in a worker thread; select() uses the keywords only until it is done."""
+        if not self._trained:
+            self._trained = True
+            self._training = asyncio.create_task(asyncio.to_thread(self._train))
+
+    def _train(self) -> None:
+        if _numpy() is None:
+            return
+        started = time.perf_counter()
+        try:
+            model = IntentModel(self.tool_names)
+            model.fit(load_examples(self.examples_path))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"WARNING: intent classifier unavailable, using keywords only: {e!r}")
+            return
+        self.model = model
+        print(f"Intent classifier trained in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    def _model(self) -> Optional[IntentModel]:
+        """The trained model, training inline if start() was never called; None without NumPy."""
+        if not self._trained:
+            self._trained = True
+            self._train()
+        return self.model
+
+    def intents(self, text: str) -> set:
+        """Intents found in one user message."""
+        key = normalize(text)
+        found = {intent for intent, pattern in PATTERNS.items() if intent in self.tool_names and pattern.search(key)}
+        if EMAIL.search(text) and "eskalera_till_team" in self.tool_names:
+            found.add("eskalera_till_team")
+        model = self._model()
+        if model is not None and key:
+            found.update(intent for intent, p in model.predict(text).items() if p >= self.threshold)
+        if not found and DATE_TIME.search(key):
+            found.update(name for name in BOOKING_TOOLS if name in self.tool_names)
+        return found
+
+    def select(self, messages: list) -> tuple:
+        """Tool names for a turn whose prompt is `messages` (ending with the new user message)."""
+        found = set()
+        users = 0
+        for message in reversed(messages):
+            role = message.get("role")
+            for call in message.get("tool_calls") or ():
+                found.add(call["function"]["name"])
+            content = message.get("content")
+            if role == "user" and isinstance(content, str) and users < self.context_messages:
+                users += 1
+                found |= self.intents(content)
+            elif role == "assistant" and isinstance(content, str) and users <= 1:
+                # The reply just before this turn, e.g. "Vilket datum passar?"
+                key = normalize(content)
+                found.update(intent for intent, pattern in PATTERNS.items() if pattern.search(key))
+        return tuple(name for name in self.tool_names if name in found)
+
+
+def create_intent_classifier(tools: list) -> Optional[IntentClassifier]:
+    """Build from INTENT_CLASSIFIER (default on), INTENT_THRESHOLD and INTENT_CONTEXT_MESSAGES."""
+    if os.environ.get("INTENT_CLASSIFIER", "1").lower() in ("0", "false", "no"):
+        return None
+    return IntentClassifier(
+        tuple(tool["function"]["name"] for tool in tools),
+        threshold=float(os.environ.get("INTENT_THRESHOLD", "0.5")),
+        context_messages=int(os.environ.get("INTENT_CONTEXT_MESSAGES", "3")),
+    )
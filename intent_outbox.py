@@ -0,0 +1,329 @@
+"""
+Durable outbox for n8n intent webhooks (booking, cancellation, rebooking,
+escalation).
+
+The chat handler only persists the intent to a local SQLite table and
+acknowledges the user right away. A pool of background workers delivers
+queued intents to n8n:
+
+- at most `concurrency` deliveries in flight per process
+- exponential backoff with jitter between attempts
+- an `Idempotency-Key` header (thread_id + tool call id) so n8n can drop
+  duplicates when a delivery is retried
+- after `max_attempts` failures (or a non-retryable 4xx) the intent moves
+  to the dead-letter state, where it stays until requeued; each move is
+  logged and counted in `chatkit_intent_dead_letters_total`, and
+  `router()` lists and requeues them (mounted when N8N_OUTBOX_API_TOKEN is set)
+
+Claims use a lease, so rows held by a crashed worker become due again and
+several processes can share one outbox file. Delivered rows are deleted
+once they are older than `retention` seconds (checked hourly), so the table
+only holds recent history.
+"""
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+
+import httpx
+from fastapi import APIRouter, HTTPException, Request
+
+import metrics
+
+PENDING = "pending"
+INFLIGHT = "inflight"
+DELIVERED = "delivered"
+DEAD = "dead"
+
+DEAD_LETTERS = metrics.registry.counter(
+    "chatkit_intent_dead_letters_total", "n8n intents moved to the dead-letter queue, alert on any increase"
+)
+
+
+def idempotency_key(thread_id: str, tool_call_id: str) -> str:
+    return f"{thread_id}:{tool_call_id}"
+
+
+class IntentOutbox:
+    def __init__(
+        self,
+        path: str,
+        webhook_url: str,
+        get_client: Callable[[], httpx.AsyncClient],
+        timeout,
+        concurrency: int = 4,
+        max_attempts: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        lease: float = 120.0,
+        poll_interval: float = 1.0,
+        retention: float = 7 * 86400,
+        api_token: Optional[str] = None,
+    ):
+        self.path = path
+        self.webhook_url = webhook_url
+        self.get_client = get_client
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.api_token = api_token
+        self._pruned_at = 0.0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._workers: list = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._open()
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " idempotency_key TEXT NOT NULL UNIQUE,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " lease_until REAL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)"
+        )
+
+    # Lifecycle
+
+    async def start(self) -> None:
+        if self._conn is None:
+            self._open()
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    # Producer side
+
+    def _insert(self, key: str, payload: dict) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox"
+                " (idempotency_key, payload, status, next_attempt_at, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), PENDING, now, now, now),
+            )
+        return cursor.rowcount == 1
+
+    async def enqueue(self, key: str, payload: dict) -> bool:
+        """Persist an intent for delivery. Returns False if `key` was already queued."""
+        if not self._workers:
+            # No lifespan hook (e.g. serverless): start workers on first use
+            await self.start()
+        created = await asyncio.to_thread(self._insert, key, payload)
+        self._wakeup.set()
+        return created
+
+    # Worker side
+
+    def _claim(self) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE outbox SET status = ?, lease_until = ?, updated_at = ?"
+                " WHERE id = ("
+                "  SELECT id FROM outbox"
+                "  WHERE (status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_until < ?)"
+                "  ORDER BY next_attempt_at LIMIT 1)"
+                " RETURNING id, idempotency_key, payload, attempts",
+                (INFLIGHT, now + self.lease, now, PENDING, now, INFLIGHT, now),
+            ).fetchone()
+
+    def _finish(self, row_id: int, status: str, attempts: int, next_attempt_at: float, error: Optional[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?,"
+                " lease_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                (status, attempts, next_attempt_at, error, time.time(), row_id),
+            )
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.base_delay * (2 ** (attempts - 1)), self.max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _deliver(self, row: tuple) -> None:
+        row_id, key, payload, attempts = row
+        attempts += 1
+        try:
+            with metrics.upstream("n8n", stage="n8n"):
+                resp = await self.get_client().post(
+                    self.webhook_url,
+                    content=payload,
+                    headers={"Content-Type": "application/json", "Idempotency-Key": key},
+                    timeout=self.timeout,
+                )
+            if resp.status_code < 300:
+                print(f"n8n intent delivered: {key} (attempt {attempts})")
+                await asyncio.to_thread(self._finish, row_id, DELIVERED, attempts, time.time(), None)
+                return
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            metrics.ERRORS.inc(type=f"http_{resp.status_code}", stage="n8n")
+            retryable = resp.status_code >= 500 or resp.status_code in (408, 429)
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__}: {e}"
+            retryable = True
+
+        if retryable and attempts < self.max_attempts:
+            delay = self._backoff(attempts)
+            print(f"WARNING: n8n intent {key} failed ({error}), retrying in {delay:.1f}s")
+            await asyncio.to_thread(self._finish, row_id, PENDING, attempts, time.time() + delay, error)
+        else:
+            print(f"ERROR: n8n intent {key} moved to dead-letter queue after {attempts} attempts: {error}")
+            DEAD_LETTERS.inc(retryable=str(retryable).lower())
+            await asyncio.to_thread(self._finish, row_id, DEAD, attempts, time.time(), error)
+
+    def _prune(self, before: float) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM outbox WHERE status = ? AND updated_at < ?", (DELIVERED, before)
+            ).rowcount
+
+    async def _maybe_prune(self) -> None:
+        now = time.time()
+        if self.retention <= 0 or now - self._pruned_at < 3600:
+            return
+        self._pruned_at = now  # before the await, so only one worker prunes
+        deleted = await asyncio.to_thread(self._prune, now - self.retention)
+        if deleted:
+            print(f"n8n outbox: deleted {deleted} delivered intents older than {self.retention:.0f}s")
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                await self._maybe_prune()
+                row = await asyncio.to_thread(self._claim)
+                if row is not None:
+                    await self._deliver(row)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR: n8n outbox worker: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    # Inspection / dead-letter handling
+
+    def _stats(self) -> dict:
+        # One range count per status on idx_outbox_due (status first), not a table scan
+        with self._lock:
+            return {
+                status: self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (status,)).fetchone()[0]
+                for status in (PENDING, INFLIGHT, DELIVERED, DEAD)
+            }
+
+    async def stats(self) -> dict:
+        return await asyncio.to_thread(self._stats)
+
+    def _dead_letters(self, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idempotency_key, payload, attempts, last_error, updated_at"
+                " FROM outbox WHERE status = ? ORDER BY updated_at DESC LIMIT ?",
+                (DEAD, limit),
+            ).fetchall()
+        return [
+            {"idempotency_key": k, "payload": json.loads(p), "attempts": a, "last_error": e, "failed_at": t}
+            for k, p, a, e, t in rows
+        ]
+
+    async def dead_letters(self, limit: int = 100) -> list:
+        return await asyncio.to_thread(self._dead_letters, limit)
+
+    def _requeue(self, key: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ?"
+                " WHERE idempotency_key = ? AND status = ?",
+                (PENDING, time.time(), time.time(), key, DEAD),
+            )
+        return cursor.rowcount == 1
+
+    async def requeue(self, key: str) -> bool:
+        """Move a dead-lettered intent back to the queue."""
+        requeued = await asyncio.to_thread(self._requeue, key)
+        if requeued:
+            print(f"n8n intent requeued: {key}")
+            if self._wakeup is not None:
+                self._wakeup.set()
+        return requeued
+
+    # HTTP
+
+    def _authorize(self, request: Request) -> None:
+        if not self.api_token or request.headers.get("authorization") != f"Bearer {self.api_token}":
+            raise HTTPException(status_code=401, detail="unauthorized")
+
+    def router(self) -> APIRouter:
+        """The /outbox endpoints; only mount them when `api_token` is set."""
+        router = APIRouter()
+
+        @router.get("/outbox/dead")
+        async def list_dead_letters(request: Request, limit: int = 100):
+            self._authorize(request)
+            return await self.dead_letters(limit)
+
+        @router.post("/outbox/dead/{key}/requeue")
+        async def requeue_dead_letter(request: Request, key: str):
+            self._authorize(request)
+            if not self._workers:
+                # No lifespan hook (e.g. serverless): start workers to deliver it
+                await self.start()
+            if not await self.requeue(key):
+                raise HTTPException(status_code=404, detail="no dead-lettered intent with this key")
+            return {"requeued": key}
+
+        return router
+
+
+def create_outbox(webhook_url: str, get_client, timeout) -> Optional[IntentOutbox]:
+    """Build the outbox from N8N_OUTBOX_* settings; None when N8N_DISPATCH=sync."""
+    if os.environ.get("N8N_DISPATCH", "outbox").lower() == "sync":
+        return None
+    return IntentOutbox(
+        path=os.environ.get("N8N_OUTBOX_PATH", "intent_outbox.db"),
+        webhook_url=webhook_url,
+        get_client=get_client,
+        timeout=timeout,
+        concurrency=int(os.environ.get("N8N_OUTBOX_CONCURRENCY", "4")),
+        max_attempts=int(os.environ.get("N8N_OUTBOX_MAX_ATTEMPTS", "8")),
+        base_delay=float(os.environ.get("N8N_OUTBOX_BASE_DELAY", "2")),
+        max_delay=float(os.environ.get("N8N_OUTBOX_MAX_DELAY", "300")),
+        retention=float(os.environ.get("N8N_OUTBOX_RETENTION_DAYS", "7")) * 86400,
+        api_token=os.environ.get("N8N_OUTBOX_API_TOKEN") or None,
+    )
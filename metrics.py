@@ -0,0 +1,250 @@
+"""
+Minimal Prometheus-style metrics for the chat pipeline.
+
+Recording is a dict lookup plus a few integer/float updates on the event
+loop thread: no locks, no I/O, no logging (well under a microsecond per
+observation). The per-turn stage clock lives in a ContextVar, so concurrent
+turns never share state. Everything is rendered in the Prometheus text
+format by `render()` for the /metrics endpoint.
+"""
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import aclosing
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+# Latency buckets in seconds, from sub-millisecond stages to slow upstream calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    Set/inc/dec gauge. With `callback` (sync or async) the value is read at
+    scrape time instead; a dict result becomes one series per key, labelled
+    with `label`.
+    """
+
+    def __init__(self, name: str, help: str, callback: Optional[Callable] = None, label: str = "kind"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label = label
+        self._values: dict = {}
+
+    def set(self, value: float, **labels) -> None:
+        self._values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    async def collect(self) -> None:
+        if self.callback is None:
+            return
+        value = self.callback()
+        if inspect.isawaitable(value):
+            value = await value
+        if isinstance(value, dict):
+            for label_value, v in value.items():
+                if isinstance(v, (int, float)):
+                    self._values[((self.label, label_value),)] = v
+        else:
+            self._values[()] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 2)
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        # A metric registered again under the same name (e.g. a gauge from a
+        # second create_app() in one process) replaces the old one
+        self._metrics = [m for m in self._metrics if m.name != metric.name]
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def gauge(self, name: str, help: str, callback: Optional[Callable] = None, label: str = "kind") -> Gauge:
+        return self.register(Gauge(name, help, callback, label))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            if isinstance(metric, Gauge):
+                try:
+                    await metric.collect()
+                except Exception as e:
+                    print(f"WARNING: metrics callback for {metric.name} failed: {e}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "chatkit_stage_seconds", "Time spent per stage of a threads.add_user_message turn"
+)
+TURN_SECONDS = registry.histogram("chatkit_turn_seconds", "Full turn latency, request to [DONE]")
+INTENTS = registry.counter("chatkit_intents_total", "Tool-call intents routed to n8n")
+ERRORS = registry.counter("chatkit_errors_total", "Errors by type and stage")
+TURNS = registry.counter("chatkit_turns_total", "Completed turns by how they were answered")
+TOOL_SELECTIONS = registry.counter(
+    "chatkit_tool_selection_total", "Completions by the tool schemas sent (all, subset, none)"
+)
+ABORTED_COMPLETIONS = registry.counter(
+    "chatkit_completions_aborted_total", "Completions stopped because no client followed the turn any more"
+)
+ACTIVE_TURNS = registry.gauge("chatkit_active_threads", "Threads with a turn currently streaming")
+UPSTREAM_INFLIGHT = registry.gauge("chatkit_upstream_inflight", "In-flight upstream requests")
+
+# Per-turn stage clock: perf_counter() of the last mark, per asyncio task
+_stage_clock: ContextVar = ContextVar("chatkit_stage_clock", default=None)
+
+
+def start_turn() -> float:
+    now = time.perf_counter()
+    _stage_clock.set(now)
+    return now
+
+
+def mark(stage: str) -> None:
+    """Record the time since the previous mark (or start_turn) under `stage`."""
+    now = time.perf_counter()
+    last = _stage_clock.get()
+    if last is not None:
+        STAGE_SECONDS.observe(now - last, stage=stage)
+    _stage_clock.set(now)
+
+
+def observe(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+class upstream:
+    """Context manager tracking in-flight requests and latency for one upstream call."""
+
+    __slots__ = ("name", "stage", "start")
+
+    def __init__(self, name: str, stage: Optional[str] = None):
+        self.name = name
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        UPSTREAM_INFLIGHT.inc(upstream=self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        UPSTREAM_INFLIGHT.dec(upstream=self.name)
+        if self.stage:
+            STAGE_SECONDS.observe(time.perf_counter() - self.start, stage=self.stage)
+        if exc_type is not None and exc_type is not GeneratorExit:
+            ERRORS.inc(type=exc_type.__name__, stage=self.stage or self.name)
+        return False
+
+
+def record_error(exc: BaseException, stage: str) -> None:
+    ERRORS.inc(type=type(exc).__name__, stage=stage)
+
+
+async def track_turn(frames, started: float):
+    """
+    Wrap a turn's SSE generator: counts it as active while it runs and records
+    the full turn latency from `started` (a perf_counter() value). The time
+    spent handing frames to the client ("sse_flush") is recorded per response
+    by sse_stream.
+    """
+    ACTIVE_TURNS.inc()
+    try:
+        async with aclosing(frames):
+            async for frame in frames:
+                yield frame
+    finally:
+        ACTIVE_TURNS.dec()
+        TURN_SECONDS.observe(time.perf_counter() - started)
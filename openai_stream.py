@@ -0,0 +1,113 @@
+"""
+Incremental reading of OpenAI chat-completions responses.
+
+`iter_choices` yields `choices[0]` of every streamed chunk as soon as it
+arrives. A non-streamed response is replayed as a single chunk of the same
+shape, so callers only need to handle deltas. Token usage (the last chunk of
+a stream with `stream_options.include_usage`) arrives as a choice with an
+empty delta and `usage` and `model` keys.
+"""
+import os
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from payload_codec import encode_payload, loads
+
+# Point at a local stand-in (see stubs/openai_api.py) for benchmarks and offline runs
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+OPENAI_CHAT_URL = f"{OPENAI_BASE_URL}/chat/completions"
+OPENAI_CHATKIT_SESSIONS_URL = f"{OPENAI_BASE_URL}/chatkit/sessions"
+
+
+class ToolCallBuffer:
+    """Reassembles tool calls from streamed `delta.tool_calls` fragments."""
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    def add(self, fragments: list) -> None:
+        for fragment in fragments:
+            index = fragment.get("index", 0)
+            call = self._calls.setdefault(
+                index,
+                {"id": None, "type": "function", "function": {"name": "", "arguments": ""}},
+            )
+            if fragment.get("id"):
+                call["id"] = fragment["id"]
+            function = fragment.get("function") or {}
+            if function.get("name"):
+                call["function"]["name"] += function["name"]
+            if function.get("arguments"):
+                call["function"]["arguments"] += function["arguments"]
+
+    def calls(self) -> list:
+        return [self._calls[index] for index in sorted(self._calls)]
+
+    def __bool__(self) -> bool:
+        return bool(self._calls)
+
+
+def message_as_choice(choice: dict) -> dict:
+    """Convert a non-streamed `choices[0]` into the streamed delta shape."""
+    message = choice.get("message") or {}
+    delta = {"role": message.get("role", "assistant"), "content": message.get("content")}
+    if message.get("tool_calls"):
+        delta["tool_calls"] = [
+            dict(tool_call, index=index) for index, tool_call in enumerate(message["tool_calls"])
+        ]
+    return {"index": 0, "delta": delta, "finish_reason": choice.get("finish_reason")}
+
+
+def usage_as_choice(chunk: dict) -> dict:
+    return {"index": 0, "delta": {}, "finish_reason": None, "usage": chunk["usage"], "model": chunk.get("model")}
+
+
+async def iter_choices(
+    client: httpx.AsyncClient,
+    headers: dict,
+    payload,
+    timeout,
+    stream: bool = True,
+    model: Optional[str] = None,
+) -> AsyncIterator[dict]:
+    """
+    POST a chat completion and yield `choices[0]` deltas as they arrive.
+
+    `payload` is a payload_codec.ChatPayload or a plain request dict;
+    `model` overrides the dict's model.
+
+    Closing this generator early (e.g. with contextlib.aclosing when the
+    client disconnects) closes the upstream response as well.
+    """
+    body = encode_payload(payload, model, stream)
+    if not stream:
+        resp = await client.post(OPENAI_CHAT_URL, headers=headers, content=body, timeout=timeout)
+        resp.raise_for_status()
+        data = loads(resp.content)
+        yield message_as_choice(data["choices"][0])
+        if data.get("usage"):
+            yield usage_as_choice(data)
+        return
+
+    async with client.stream(
+        "POST",
+        OPENAI_CHAT_URL,
+        headers=headers,
+        content=body,
+        timeout=timeout,
+    ) as resp:
+        if resp.status_code >= 400:
+            await resp.aread()
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            chunk = loads(data)
+            if chunk.get("choices"):
+                yield chunk["choices"][0]
+            if chunk.get("usage"):
+                yield usage_as_choice(chunk)
@@ -0,0 +1,141 @@
+"""
+JSON encoding for OpenAI request bodies and SSE frames.
+
+`dumps()` returns compact UTF-8 bytes, using orjson or msgspec when one is
+installed and the standard library otherwise. `PayloadTemplate` serializes
+the static part of a chat-completions body (model, tools, tool_choice,
+stream flags and the system message) once, so a turn only encodes its own
+messages. The prefix bytes are identical on every request with the same
+tool subset, which keeps OpenAI's prompt cache hitting.
+"""
+import json
+from typing import Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+    dumps = orjson.dumps
+    loads = orjson.loads
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    dumps = msgspec.json.Encoder().encode
+    loads = msgspec.json.decode
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+    loads = json.loads
+
+
+def sse_frame(event: dict) -> bytes:
+    return b"data: " + dumps(event) + b"\n\n"
+
+
+class PayloadTemplate:
+    """Chat-completions body with a precomputed, byte-stable prefix."""
+
+    def __init__(self, system_prompt: str, tools: Optional[list] = None):
+        self.system_prompt = system_prompt
+        self.tools = tools
+        self._system = dumps({"role": "system", "content": system_prompt})
+        self._tools = {None: dumps(tools) if tools else None}  # tool names (None: all) -> bytes
+        self._prefixes: dict = {}  # (model, stream, tool_choice, tool names) -> bytes
+
+    def tools_json(self, names: Optional[tuple] = None) -> Optional[bytes]:
+        """The `tools` array for the tools called `names` (None: all), None when empty."""
+        encoded = self._tools.get(names, False)
+        if encoded is False:
+            subset = [tool for tool in self.tools or () if tool["function"]["name"] in names]
+            encoded = self._tools[names] = dumps(subset) if subset else None
+        return encoded
+
+    def prefix(self, model: str, stream: bool, tool_choice: Optional[str], tools: Optional[tuple] = None) -> bytes:
+        """Everything up to and including the system message of the `messages` array."""
+        key = (model, stream, tool_choice, tools)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            tools_json = self.tools_json(tools)
+            head = {"model": model}
+            if stream:
+                head["stream"] = True
+                head["stream_options"] = {"include_usage": True}
+            if tools_json is not None and tool_choice is not None:
+                head["tool_choice"] = tool_choice
+            prefix = dumps(head)[:-1]
+            if tools_json is not None:
+                prefix += b',"tools":' + tools_json
+            prefix = self._prefixes[key] = prefix + b',"messages":[' + self._system
+        return prefix
+
+    def encode(
+        self,
+        model: str,
+        messages: list,
+        stream: bool = True,
+        tool_choice: Optional[str] = "auto",
+        tools: Optional[tuple] = None,
+    ) -> bytes:
+        """
+        Body for `messages`, whose first entry is this template's system message.
+        `tools` limits the tool schemas sent to those names (None: all, (): none).
+        """
+        first = messages[0] if messages else None
+        if first is None or first.get("role") != "system" or first.get("content") != self.system_prompt:
+            raise ValueError("messages must start with the template's system message")
+        body = self.prefix(model, stream, tool_choice, tools)
+        if len(messages) > 1:
+            body += b"," + dumps(messages[1:])[1:-1]
+        return body + b"]}"
+
+    def payload(
+        self, messages: list, tool_choice: Optional[str] = "auto", tools: Optional[tuple] = None
+    ) -> "ChatPayload":
+        return ChatPayload(self, messages, tool_choice, tools)
+
+
+class ChatPayload:
+    """The messages of one completion, encoded against a shared template."""
+
+    __slots__ = ("template", "messages", "tool_choice", "tools")
+
+    def __init__(
+        self,
+        template: PayloadTemplate,
+        messages: list,
+        tool_choice: Optional[str] = "auto",
+        tools: Optional[tuple] = None,
+    ):
+        self.template = template
+        self.messages = messages
+        self.tool_choice = tool_choice
+        self.tools = tools
+
+    def encode(self, model: str, stream: bool = True) -> bytes:
+        return self.template.encode(model, self.messages, stream, self.tool_choice, self.tools)
+
+    def followup(self, messages: list, tool_choice: Optional[str] = "none") -> "ChatPayload":
+        """Same conversation and tools plus `messages` (e.g. a tool turn)."""
+        return ChatPayload(self.template, self.messages + messages, tool_choice, self.tools)
+
+
+def encode_payload(payload, model: Optional[str] = None, stream: bool = True) -> bytes:
+    """Encode a ChatPayload, or a plain request dict for one-off calls."""
+    if isinstance(payload, ChatPayload):
+        return payload.encode(model, stream)
+    body = dict(payload, model=model or payload.get("model"))
+    if stream:
+        body["stream"] = True
+        body.setdefault("stream_options", {"include_usage": True})
+    return dumps(body)
@@ -0,0 +1,101 @@
+"""
+What the /chatkit assistant says and can do: system prompt, function tools
+and the fixed replies used when the model or n8n cannot answer.
+"""
+
+SYSTEM_PROMPT = """Du är ZAAI:s AI-receptionist. Svara på frågor om ZAAI:s tjänster, priser och processer. Svara alltid på svenska om inget annat anges. Var vänlig och professionell. Hänvisa alltid till www.zaai.se för mer info.
+
+Om kunden vill boka, avboka eller omboka en tid – fråga aktivt efter nödvändig information i konversationen: namn, önskat datum, önskad tid och gärna e-post. Anropa funktionen först när du har tillräckligt med uppgifter.
+
+VIKTIGT – informationsinsamling:
+- Be aldrig om allt på en gång, ställ en fråga i taget
+- Om kunden inte ger e-post vid bokning/ombokning, fortsätt ändå – den är valfri
+- Bekräfta alltid de uppgifter du fått innan du anropar funktionen
+
+Om du inte kan svara på en fråga, eller om kunden uttryckligen vill prata med en människa – be först om kundens e-postadress om du inte redan har den. Anropa sedan funktionen eskalera_till_team med e-post, sammanfattning och anledning."""
+
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "boka_tid",
+            "description": "Boka ett möte eller demo för kunden. Anropa när kunden bekräftat namn, datum och tid.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "namn": {"type": "string", "description": "Kundens namn"},
+                    "datum": {"type": "string", "description": "Datum för mötet, t.ex. 2026-03-15"},
+                    "tid": {"type": "string", "description": "Tid för mötet, t.ex. 14:00"},
+                    "email": {"type": "string", "description": "Kundens e-postadress (valfri)"},
+                    "meddelande": {"type": "string", "description": "Eventuell notering (valfri)"}
+                },
+                "required": ["namn", "datum", "tid"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "avboka_tid",
+            "description": "Avboka ett befintligt möte för kunden.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "namn": {"type": "string", "description": "Kundens namn"},
+                    "datum": {"type": "string", "description": "Datum för mötet som ska avbokas"},
+                    "tid": {"type": "string", "description": "Tid för mötet (valfri)"}
+                },
+                "required": ["namn", "datum"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "omboka_tid",
+            "description": "Omboka ett befintligt möte till ny tid.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "namn": {"type": "string", "description": "Kundens namn"},
+                    "gammalt_datum": {"type": "string", "description": "Datum för det befintliga mötet"},
+                    "gammal_tid": {"type": "string", "description": "Tid för det befintliga mötet (valfri)"},
+                    "nytt_datum": {"type": "string", "description": "Nytt datum"},
+                    "ny_tid": {"type": "string", "description": "Ny tid"}
+                },
+                "required": ["namn", "gammalt_datum", "nytt_datum", "ny_tid"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "eskalera_till_team",
+            "description": "Skicka ärendet till ZAAI-teamet när kunden vill prata med en människa eller AI inte kan svara. Kräver kundens e-post – fråga om den saknas.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "email": {"type": "string", "description": "Kundens e-postadress (obligatorisk)"},
+                    "anledning": {"type": "string", "description": "Varför eskaleras ärendet?"},
+                    "sammanfattning": {"type": "string", "description": "Sammanfattning av konversationen"}
+                },
+                "required": ["email", "anledning", "sammanfattning"]
+            }
+        }
+    }
+]
+
+# Immediate acknowledgment shown while a queued intent is delivered to n8n
+INTENT_ACKS = {
+    "boka_tid": "Tack! Din bokningsförfrågan är mottagen. Du får en bekräftelse så snart mötet är registrerat.",
+    "avboka_tid": "Tack! Din avbokning är mottagen och behandlas nu.",
+    "omboka_tid": "Tack! Din ombokning är mottagen. Du får en bekräftelse på den nya tiden.",
+    "eskalera_till_team": "Tack! Jag har skickat ditt ärende till ZAAI-teamet. De hör av sig till dig via e-post.",
+}
+
+FALLBACK_REPLY = "Tyvärr kunde jag inte svara just nu. Vänligen försök igen."
+
+# Sent as an error event when the turn is shed for lack of upstream capacity
+BUSY_REPLY = "Det är många som chattar just nu. Vänligen försök igen om en liten stund."
+
+TOOL_ERROR_REPLY = "Åtgärden kunde inte genomföras just nu. Teamet har inte fått ärendet."
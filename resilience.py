@@ -0,0 +1,316 @@
+"""
+Resilience layer around the chat-completions call.
+
+- adaptive first-token timeout: a multiple of the observed p99 time to the
+  first chunk, clamped between a floor and a ceiling. Streamed requests
+  only: without streaming the first chunk is the whole answer, so just the
+  request timeout applies
+- circuit breaker per model: opens when the error rate in a sliding window
+  spikes, fails fast while open, lets one probe through after a cooldown
+- hedged requests (optional): if no chunk has arrived after the observed p95,
+  a second identical request is started and the first to answer wins
+- fallback chain: when a model fails before its first chunk (or its breaker
+  is open) the next model in the chain is tried
+
+Once the first chunk has been yielded the stream is committed to that model;
+later errors are raised to the caller.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import httpx
+
+import metrics
+from openai_stream import iter_choices
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FALLBACKS = metrics.registry.counter(
+    "chatkit_upstream_fallbacks_total", "Chat completion attempts abandoned for the next model"
+)
+HEDGES = metrics.registry.counter("chatkit_upstream_hedges_total", "Hedged chat completion requests")
+
+
+class UpstreamTimeout(Exception):
+    """No chunk arrived within the first-token timeout."""
+
+
+class UpstreamUnavailable(Exception):
+    """Every model in the chain failed or has an open circuit."""
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Errors that say something about upstream health (and justify a fallback)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status in (408, 429)
+    return isinstance(exc, (httpx.TransportError, UpstreamTimeout, asyncio.TimeoutError))
+
+
+class LatencyWindow:
+    """The last `size` samples, with percentiles once `min_samples` are in."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    def __init__(self, error_rate: float = 0.5, min_requests: int = 10, window: float = 30.0, cooldown: float = 15.0):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._events = deque()  # (monotonic time, failed)
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def _prune(self, now: float) -> None:
+        while self._events and self._events[0][0] < now - self.window:
+            _, failed = self._events.popleft()
+            self._failures -= failed
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._events.clear()
+        self._failures = 0
+
+    def record(self, ok: bool) -> None:
+        now = time.monotonic()
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if ok:
+                self.state = CLOSED
+            else:
+                self._open(now)
+            return
+        self._events.append((now, not ok))
+        self._failures += not ok
+        self._prune(now)
+        if len(self._events) >= self.min_requests and self._failures / len(self._events) >= self.error_rate:
+            print(f"WARNING: circuit opened ({self._failures}/{len(self._events)} failed)")
+            self._open(now)
+
+    def abandon(self) -> None:
+        """An allowed call ended without telling us anything (e.g. client left)."""
+        self._probing = False
+
+
+class ResilientChat:
+    def __init__(
+        self,
+        models: list,
+        get_client: Callable[[], httpx.AsyncClient],
+        timeout,
+        hedge: bool = False,
+        hedge_min_delay: float = 0.5,
+        min_timeout: float = 3.0,
+        max_timeout: float = 20.0,
+        timeout_factor: float = 3.0,
+        breaker_settings: Optional[dict] = None,
+    ):
+        self.models = models
+        self.get_client = get_client
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_factor = timeout_factor
+        self.breaker_settings = breaker_settings or {}
+        self.latency = {model: LatencyWindow() for model in models}
+        self.breakers = {model: CircuitBreaker(**self.breaker_settings) for model in models}
+
+    def chain_from(self, model: str) -> list:
+        """The chain for a turn held to `model` (e.g. over a usage budget): it, then the fallbacks."""
+        chain = [model] + [m for m in self.models[1:] if m != model]
+        for m in chain:
+            if m not in self.breakers:
+                self.latency[m] = LatencyWindow()
+                self.breakers[m] = CircuitBreaker(**self.breaker_settings)
+        return chain
+
+    def first_token_timeout(self, model: str) -> float:
+        p99 = self.latency[model].percentile(0.99)
+        if p99 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, p99 * self.timeout_factor))
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.latency[model].percentile(0.95)
+        return None if p95 is None else max(self.hedge_min_delay, p95)
+
+    async def _open(self, model: str, headers: dict, payload, stream: bool) -> tuple:
+        """Start one request and wait for its first chunk."""
+        started = time.perf_counter()
+        choices = iter_choices(
+            self.get_client(), headers=headers, payload=payload, timeout=self.timeout, stream=stream, model=model
+        )
+        try:
+            first = await choices.__anext__()
+        except StopAsyncIteration:
+            await choices.aclose()
+            first = {"index": 0, "delta": {}, "finish_reason": "stop"}
+        except BaseException:
+            await choices.aclose()
+            raise
+        self.latency[model].add(time.perf_counter() - started)
+        return choices, first
+
+    async def _first_response(self, model: str, headers: dict, payload, stream: bool) -> tuple:
+        """
+        (choices, first chunk) from the first request to answer, hedging after
+        the p95 delay and, when streaming, giving up after the adaptive
+        first-token timeout.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.first_token_timeout(model) if stream else None
+        hedge_at = self.hedge_delay(model)
+        tasks = [asyncio.ensure_future(self._open(model, headers, payload, stream))]
+        pending = set(tasks)
+        winner = None
+        error = None
+        try:
+            while pending:
+                now = loop.time()
+                if deadline is not None and now >= deadline:
+                    raise UpstreamTimeout(f"{model}: no response after {deadline - started:.1f}s")
+                wait = None if deadline is None else deadline - now
+                if hedge_at is not None:
+                    hedge_wait = max(0.0, started + hedge_at - now)
+                    wait = hedge_wait if wait is None else min(wait, hedge_wait)
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and loop.time() >= started + hedge_at and (pending or error is None):
+                    HEDGES.inc(model=model)
+                    hedge = asyncio.ensure_future(self._open(model, headers, payload, stream))
+                    tasks.append(hedge)
+                    pending.add(hedge)
+                    hedge_at = None
+            raise error
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await task.result()[0].aclose()
+
+    async def stream(
+        self,
+        headers: dict,
+        payload,
+        stream: bool = True,
+        models: Optional[list] = None,
+        on_model: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Yield `choices[0]` deltas like `iter_choices`, walking the fallback chain
+        (or `models`). `on_model` is called with the model the stream commits to.
+        """
+        models = models or self.models
+        last_error = None
+        for model in models:
+            breaker = self.breakers[model]
+            if not breaker.allow():
+                FALLBACKS.inc(model=model, reason="circuit_open")
+                continue
+            try:
+                choices, first = await self._first_response(model, headers, payload, stream)
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except Exception as e:
+                if not is_upstream_failure(e):
+                    breaker.abandon()
+                    raise
+                breaker.record(False)
+                print(f"WARNING: {model} failed before its first chunk: {e!r}")
+                FALLBACKS.inc(model=model, reason=type(e).__name__)
+                last_error = e
+                continue
+
+            breaker.record(True)
+            if on_model is not None:
+                on_model(model)
+            try:
+                yield first
+                async for choice in choices:
+                    yield choice
+            except Exception as e:
+                if is_upstream_failure(e):
+                    breaker.record(False)
+                raise
+            finally:
+                await choices.aclose()
+            return
+        raise UpstreamUnavailable(f"no model in {models} available") from last_error
+
+    def snapshot(self) -> dict:
+        return {model: breaker.state for model, breaker in self.breakers.items()}
+
+    def open_circuits(self) -> dict:
+        return {model: int(breaker.state != CLOSED) for model, breaker in self.breakers.items()}
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, str(default)))
+
+
+def create_resilient_chat(model: str, get_client, timeout) -> ResilientChat:
+    """Build the chain `model` + CHAT_MODEL_FALLBACKS from the OPENAI_* / BREAKER_* settings."""
+    fallbacks = os.environ.get("CHAT_MODEL_FALLBACKS", "gpt-4o-mini")
+    models = [model] + [m.strip() for m in fallbacks.split(",") if m.strip() and m.strip() != model]
+    return ResilientChat(
+        models,
+        get_client,
+        timeout,
+        hedge=os.environ.get("OPENAI_HEDGE", "0").lower() in ("1", "true", "yes"),
+        hedge_min_delay=_env_float("OPENAI_HEDGE_MIN_DELAY", 0.5),
+        min_timeout=_env_float("OPENAI_FIRST_TOKEN_TIMEOUT_MIN", 3.0),
+        max_timeout=_env_float("OPENAI_FIRST_TOKEN_TIMEOUT", 20.0),
+        timeout_factor=_env_float("OPENAI_FIRST_TOKEN_TIMEOUT_FACTOR", 3.0),
+        breaker_settings={
+            "error_rate": _env_float("BREAKER_ERROR_RATE", 0.5),
+            "min_requests": int(os.environ.get("BREAKER_MIN_REQUESTS", "10")),
+            "window": _env_float("BREAKER_WINDOW", 30.0),
+            "cooldown": _env_float("BREAKER_COOLDOWN", 15.0),
+        },
+    )
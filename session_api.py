@@ -0,0 +1,111 @@
+"""
+/api/chatkit/session: hands out ChatKit client secrets through the session
+broker (single-flight per device_id, cache, prewarmed anonymous pool).
+"""
+from fastapi import APIRouter, HTTPException, Request
+from pydantic import BaseModel
+from typing import Optional
+
+import http_pool
+import metrics
+from openai_stream import OPENAI_CHATKIT_SESSIONS_URL
+from session_pool import SessionBroker
+from settings import Settings
+
+
+class SessionRequest(BaseModel):
+    device_id: Optional[str] = None
+
+
+class SessionService:
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.broker = SessionBroker(
+            self.request_chatkit_session,
+            pool_size=settings.session_pool_size,
+            expiry_margin=settings.session_expiry_margin,
+        )
+        metrics.registry.gauge(
+            "chatkit_sessions", "ChatKit session broker counters and cache size", self.broker.snapshot
+        )
+
+    async def start(self) -> None:
+        await self.broker.start()
+
+    async def close(self) -> None:
+        await self.broker.close()
+
+    async def health(self) -> dict:
+        return {"sessions": self.broker.snapshot()}
+
+    async def request_chatkit_session(self, user: str) -> dict:
+        """POST /v1/chatkit/sessions for `user` and return OpenAI's session object."""
+        print(f"Creating ChatKit session: workflow={self.settings.workflow_id}, user={user}")
+
+        headers = {
+            "Content-Type": "application/json",
+            "OpenAI-Beta": "chatkit_beta=v1",
+            "Authorization": f"Bearer {self.settings.openai_api_key}"
+        }
+        json_data = {"workflow": {"id": self.settings.workflow_id}, "user": user}
+
+        client = http_pool.get_client()
+        response = await client.post(
+            OPENAI_CHATKIT_SESSIONS_URL,
+            headers=headers,
+            json=json_data,
+            timeout=http_pool.SESSION_TIMEOUT
+        )
+        if response.status_code != 200:
+            error_text = response.text
+            print(f"ERROR: OpenAI API returned {response.status_code}: {error_text}")
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"OpenAI API error: {error_text}"
+            )
+        session_data = response.json()
+        if not session_data.get("client_secret"):
+            raise HTTPException(status_code=500, detail="No client_secret in OpenAI API response")
+        print(f"Session created successfully: {session_data.get('id', 'unknown')}")
+        return session_data
+
+    async def create_chatkit_session(self, request: Request):
+        """
+        Create a new ChatKit session and return the client secret.
+        Supports both GET and POST methods.
+
+        GET: Accepts optional device_id as query parameter (?device_id=abc)
+        POST: Accepts optional device_id in JSON body ({"device_id": "abc"})
+
+        Without a device_id the session comes from a prewarmed anonymous pool.
+        """
+        try:
+            if not self.settings.workflow_id:
+                error_msg = "CHATKIT_WORKFLOW_ID environment variable is not set."
+                print(f"ERROR: {error_msg}")
+                raise HTTPException(status_code=500, detail=error_msg)
+
+            device_id = None
+            if request.method == "GET":
+                device_id = request.query_params.get("device_id")
+            elif request.method == "POST":
+                try:
+                    body = await request.json()
+                    device_id = body.get("device_id") if body else None
+                except Exception:
+                    device_id = None
+
+            session_data = await self.broker.get(device_id)
+            return {"client_secret": session_data["client_secret"]}
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=f"Error creating ChatKit session: {str(e)}")
+
+    def router(self) -> APIRouter:
+        router = APIRouter()
+        router.add_api_route("/api/chatkit/session", self.create_chatkit_session, methods=["GET", "POST"])
+        return router
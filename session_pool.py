@@ -0,0 +1,148 @@
+"""
+Request coalescing for ChatKit session creation.
+
+- single-flight: concurrent requests for the same device_id share one
+  upstream POST /v1/chatkit/sessions
+- cache: a device's session is reused until shortly before its `expires_at`
+- prewarmed pool: sessions for generated anonymous users are created in the
+  background, so visitors without a device_id get a client_secret without an
+  upstream round trip
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+# create_session(user) -> OpenAI session object (must contain client_secret)
+CreateSession = Callable[[str], Awaitable[dict]]
+
+
+class SessionBroker:
+    def __init__(
+        self,
+        create_session: CreateSession,
+        pool_size: int = 0,
+        expiry_margin: float = 60.0,
+        default_ttl: float = 300.0,
+        max_cached: int = 10_000,
+        refill_interval: float = 15.0,
+    ):
+        self.create_session = create_session
+        self.pool_size = pool_size
+        self.expiry_margin = expiry_margin
+        self.default_ttl = default_ttl
+        self.max_cached = max_cached
+        self.refill_interval = refill_interval
+        self._cache: OrderedDict = OrderedDict()  # device_id -> (session, expires_at)
+        self._inflight: dict = {}  # device_id -> asyncio.Task
+        self._pool: list = []  # [(session, expires_at)] for anonymous visitors
+        self._refiller: Optional[asyncio.Task] = None
+        self._refill_wakeup: Optional[asyncio.Event] = None
+        self.stats = {"upstream": 0, "cache_hits": 0, "coalesced": 0, "pool_hits": 0, "pool_misses": 0}
+
+    def _expires_at(self, session: dict) -> float:
+        return session.get("expires_at") or time.time() + self.default_ttl
+
+    def _fresh(self, expires_at: float) -> bool:
+        return expires_at - self.expiry_margin > time.time()
+
+    async def _create(self, user: str) -> tuple:
+        self.stats["upstream"] += 1
+        session = await self.create_session(user)
+        return session, self._expires_at(session)
+
+    # Lifecycle
+
+    async def start(self) -> None:
+        if self.pool_size > 0 and (self._refiller is None or self._refiller.done()):
+            self._refill_wakeup = asyncio.Event()
+            self._refiller = asyncio.create_task(self._refill_loop())
+
+    async def close(self) -> None:
+        if self._refiller is not None:
+            self._refiller.cancel()
+            try:
+                await self._refiller
+            except asyncio.CancelledError:
+                pass
+            self._refiller = None
+
+    # Lookup
+
+    async def get(self, device_id: Optional[str]) -> dict:
+        """Return a session for `device_id`, or a prewarmed anonymous one if None."""
+        if not device_id:
+            return await self._get_anonymous()
+
+        cached = self._cache.get(device_id)
+        if cached is not None and self._fresh(cached[1]):
+            self._cache.move_to_end(device_id)
+            self.stats["cache_hits"] += 1
+            return cached[0]
+
+        task = self._inflight.get(device_id)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(self._create(device_id))
+            self._inflight[device_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(device_id, None))
+        # shield(): one waiter disconnecting must not cancel the shared call
+        session, expires_at = await asyncio.shield(task)
+
+        self._cache[device_id] = (session, expires_at)
+        self._cache.move_to_end(device_id)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return session
+
+    async def _get_anonymous(self) -> dict:
+        if self.pool_size > 0 and self._refiller is None:
+            # No lifespan hook (e.g. serverless): start prewarming on first use
+            await self.start()
+        while self._pool:
+            session, expires_at = self._pool.pop()
+            if self._fresh(expires_at):
+                self.stats["pool_hits"] += 1
+                self._wake_refiller()
+                return session
+        self.stats["pool_misses"] += 1
+        self._wake_refiller()
+        session, _ = await self._create(str(uuid.uuid4()))
+        return session
+
+    # Prewarming
+
+    def _wake_refiller(self) -> None:
+        if self._refill_wakeup is not None:
+            self._refill_wakeup.set()
+
+    async def _refill(self) -> None:
+        self._pool = [entry for entry in self._pool if self._fresh(entry[1])]
+        missing = self.pool_size - len(self._pool)
+        if missing <= 0:
+            return
+        results = await asyncio.gather(
+            *(self._create(str(uuid.uuid4())) for _ in range(missing)), return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                print(f"WARNING: session prewarm failed: {result!r}")
+            else:
+                self._pool.append(result)
+
+    async def _refill_loop(self) -> None:
+        while True:
+            try:
+                await self._refill()
+            except Exception as e:
+                print(f"WARNING: session pool refill failed: {e}")
+            try:
+                await asyncio.wait_for(self._refill_wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refill_wakeup.clear()
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, cached=len(self._cache), pooled=len(self._pool))
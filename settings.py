@@ -0,0 +1,90 @@
+"""
+App settings, read once per process into a frozen object.
+
+`load_settings()` loads `.env` (local dev) the first time it is called and
+validates the variables every entry point needs. The tuning knobs of the
+individual subsystems (pool sizes, stores, caches, limits) are still read by
+their own `create_*` functions, which run after this so `.env` applies to
+them too.
+"""
+import dataclasses
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_N8N_INTENT_WEBHOOK = "https://zaaihbg.app.n8n.cloud/webhook/zaai-chattwidget-action"
+
+
+def _flag(name: str, default: str = "1") -> bool:
+    return os.environ.get(name, default).lower() not in ("0", "false", "no")
+
+
+@dataclass(frozen=True)
+class Settings:
+    openai_api_key: str
+    workflow_id: Optional[str] = None
+    domain_public_key: Optional[str] = None
+    # Optional routers
+    sessions_enabled: bool = True
+    chatkit_enabled: bool = True
+    cors_origins: tuple = ("*",)
+    # /chatkit
+    chat_model: str = "gpt-4o"
+    openai_stream: bool = True
+    tool_call_timeout: float = 30.0
+    tool_followup: bool = True
+    n8n_intent_webhook: str = DEFAULT_N8N_INTENT_WEBHOOK
+    # /api/chatkit/session
+    session_pool_size: int = 4
+    session_expiry_margin: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        api_key = os.environ.get("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError(
+                "OPENAI_API_KEY environment variable is not set. "
+                "Please set it in Render Environment or in a local .env file."
+            )
+        workflow_id = os.environ.get("CHATKIT_WORKFLOW_ID") or None
+        if not workflow_id:
+            print("WARNING: CHATKIT_WORKFLOW_ID environment variable is not set.")
+        domain_public_key = os.environ.get("CHATKIT_DOMAIN_PUBLIC_KEY") or None
+        if not domain_public_key:
+            print("WARNING: CHATKIT_DOMAIN_PUBLIC_KEY environment variable is not set.")
+
+        return cls(
+            openai_api_key=api_key,
+            workflow_id=workflow_id,
+            domain_public_key=domain_public_key,
+            sessions_enabled=_flag("SESSIONS_ENABLED"),
+            chatkit_enabled=_flag("CHATKIT_ENABLED"),
+            cors_origins=tuple(o.strip() for o in os.environ.get("CORS_ORIGINS", "*").split(",") if o.strip()),
+            chat_model=os.environ.get("CHAT_MODEL", "gpt-4o"),
+            openai_stream=_flag("OPENAI_STREAM"),
+            tool_call_timeout=float(os.environ.get("TOOL_CALL_TIMEOUT", "30")),
+            tool_followup=_flag("TOOL_FOLLOWUP"),
+            n8n_intent_webhook=os.environ.get("N8N_INTENT_WEBHOOK", DEFAULT_N8N_INTENT_WEBHOOK),
+            session_pool_size=int(os.environ.get("SESSION_POOL_SIZE", "4")) if workflow_id else 0,
+            session_expiry_margin=float(os.environ.get("SESSION_EXPIRY_MARGIN", "60")),
+        )
+
+    def replace(self, **changes) -> "Settings":
+        return dataclasses.replace(self, **changes)
+
+
+_settings: Optional[Settings] = None
+
+
+def load_settings() -> Settings:
+    """Load `.env` (if present) and the environment once; later calls return the same object."""
+    global _settings
+    if _settings is None:
+        env_path = os.path.join(ROOT, ".env")
+        if os.path.exists(env_path):
+            from dotenv import load_dotenv
+            load_dotenv(dotenv_path=env_path)
+        _settings = Settings.from_env()
+    return _settings
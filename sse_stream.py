@@ -0,0 +1,236 @@
+"""
+Resumable SSE transport for chat turns.
+
+A turn runs in a background task that publishes its frames to a TurnStream
+rather than writing to the HTTP response. Every frame gets an `id:` line
+(a Snowflake-style integer from cluster.IdGenerator, so ids only grow) and
+is kept in a replay buffer for the turn, capped at SSE_REPLAY_BYTES so a
+long answer streamed one delta per frame still fits. Responses subscribe to
+the stream:
+
+- after SSE_HEARTBEAT_INTERVAL seconds without an event a `: keep-alive`
+  comment is sent, so proxies (Render, Framer) keep the connection open
+  while OpenAI or n8n is slow
+- a client reconnecting with `Last-Event-ID` gets the buffered frames after
+  that id and then follows the live turn; the completion is not run again.
+  Only ids of the thread's latest turn resume it (`TurnStream.contains`)
+- every subscriber has a bounded queue (SSE_CLIENT_QUEUE frames). A client
+  that falls behind is disconnected and can resume from the buffer, so a
+  slow reader never stalls the turn or makes the server buffer without limit
+
+A turn whose client is gone keeps running for SSE_RESUME_GRACE seconds so it
+can be resumed, then aborts at the next upstream chunk. Finished streams stay
+resumable for SSE_REPLAY_TTL seconds.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from typing import Callable, Optional
+
+import metrics
+
+KEEP_ALIVE = b": keep-alive\n\n"
+
+RESUMES = metrics.registry.counter("chatkit_sse_resumes_total", "Reconnects with Last-Event-ID by result")
+SLOW_CLIENTS = metrics.registry.counter(
+    "chatkit_sse_slow_clients_total", "Responses closed because the client fell behind the turn"
+)
+
+
+class _Subscriber:
+    __slots__ = ("queue", "overflowed")
+
+    def __init__(self, size: int):
+        self.queue = asyncio.Queue(size)
+        self.overflowed = False
+
+
+class TurnStream:
+    """The frames of one turn: buffered for replay and fanned out to subscribers."""
+
+    def __init__(self, thread_id: str, hub: "StreamHub"):
+        self.thread_id = thread_id
+        self.hub = hub
+        self.events = deque()  # (event id, frame)
+        self.buffered = 0  # bytes in `events`
+        self.first_id = hub.next_id()  # below every id this turn hands out
+        self.last_id = self.first_id
+        self.dropped = None  # id of the newest frame pushed out of the buffer
+        self.subscribers = set()
+        self.finished = False
+        self.finished_at = 0.0
+        self.detached_at = time.monotonic()  # counts as detached until the response subscribes
+
+    def start(self, frames, on_done: Callable[[], None]) -> None:
+        """Run the turn generator `frames` in the background; `on_done` is called when it ends."""
+        self.hub.spawn(self.run(frames, on_done))
+
+    async def run(self, frames, on_done: Callable[[], None]) -> None:
+        try:
+            async with aclosing(frames):
+                async for frame in frames:
+                    self.publish(frame)
+        except Exception as e:
+            print(f"ERROR: turn stream for {self.thread_id} failed: {e!r}")
+            metrics.record_error(e, "turn")
+        finally:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            for subscriber in list(self.subscribers):
+                self._offer(subscriber, None)
+            on_done()
+
+    def publish(self, frame) -> None:
+        if isinstance(frame, str):
+            frame = frame.encode("utf-8")
+        event_id = self.hub.next_id()
+        frame = b"id: %d\n%s" % (event_id, frame)
+        self.events.append((event_id, frame))
+        self.last_id = event_id
+        self.buffered += len(frame)
+        while self.buffered > self.hub.replay_bytes and len(self.events) > 1:
+            self.dropped, oldest = self.events.popleft()
+            self.buffered -= len(oldest)
+        for subscriber in list(self.subscribers):
+            self._offer(subscriber, frame)
+
+    def _offer(self, subscriber: _Subscriber, frame: Optional[bytes]) -> None:
+        try:
+            subscriber.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # The response ends after what it has queued; the client resumes from the buffer
+            subscriber.overflowed = True
+            self._detach(subscriber)
+            SLOW_CLIENTS.inc()
+
+    def _detach(self, subscriber: _Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.detached_at is None:
+            self.detached_at = time.monotonic()
+
+    def abandoned(self) -> bool:
+        """True once no response has followed the turn for SSE_RESUME_GRACE seconds."""
+        return self.detached_at is not None and time.monotonic() - self.detached_at > self.hub.resume_grace
+
+    def contains(self, event_id: int) -> bool:
+        """Whether `event_id` was handed out by this turn (or is its start, before any frame)."""
+        return self.first_id <= event_id <= self.last_id
+
+    def can_replay(self, after: Optional[int]) -> bool:
+        """Whether every frame after event id `after` (None: the whole turn) is still buffered."""
+        return self.dropped is None or (after is not None and after >= self.dropped)
+
+    async def frames(self, after: Optional[int] = None):
+        """One response: the buffered frames after `after`, then the live ones, with keep-alives."""
+        backlog = [frame for event_id, frame in self.events if after is None or event_id > after]
+        subscriber = _Subscriber(self.hub.client_queue)
+        live = not self.finished
+        if live:
+            self.subscribers.add(subscriber)
+            self.detached_at = None
+        queue = subscriber.queue
+        heartbeat = self.hub.heartbeat
+        flush = 0.0
+        try:
+            for frame in backlog:
+                sent = time.perf_counter()
+                yield frame
+                flush += time.perf_counter() - sent
+            while live:
+                if not queue.empty():
+                    frame = queue.get_nowait()
+                elif subscriber.overflowed:
+                    return
+                else:
+                    try:
+                        frame = await asyncio.wait_for(queue.get(), heartbeat)
+                    except TimeoutError:
+                        yield KEEP_ALIVE
+                        continue
+                if frame is None:
+                    return
+                sent = time.perf_counter()
+                yield frame
+                flush += time.perf_counter() - sent
+        finally:
+            self._detach(subscriber)
+            metrics.observe("sse_flush", flush)
+
+
+class StreamHub:
+    """The latest TurnStream per thread and the tasks producing them."""
+
+    def __init__(
+        self,
+        next_id: Callable[[], int],
+        heartbeat: float = 15.0,
+        replay_bytes: int = 1 << 20,
+        replay_ttl: float = 60.0,
+        client_queue: int = 256,
+        resume_grace: float = 30.0,
+        max_streams: int = 1000,
+    ):
+        self.next_id = next_id
+        self.heartbeat = heartbeat
+        self.replay_bytes = replay_bytes
+        self.replay_ttl = replay_ttl
+        self.client_queue = client_queue
+        self.resume_grace = resume_grace
+        self.max_streams = max_streams
+        self._streams: OrderedDict = OrderedDict()
+        self._tasks = set()
+
+    def open(self, thread_id: str) -> TurnStream:
+        self._prune()
+        stream = self._streams[thread_id] = TurnStream(thread_id, self)
+        self._streams.move_to_end(thread_id)
+        return stream
+
+    def get(self, thread_id: str) -> Optional[TurnStream]:
+        stream = self._streams.get(thread_id)
+        if stream is not None and stream.finished and time.monotonic() - stream.finished_at > self.replay_ttl:
+            return None
+        return stream
+
+    def spawn(self, coro) -> None:
+        # Held here so the task is neither garbage collected nor tied to the request
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _prune(self) -> None:
+        # Streams are in start order, so expired ones are at the front; running ones are skipped
+        now = time.monotonic()
+        for thread_id, stream in list(self._streams.items()):
+            if not stream.finished:
+                continue
+            if now - stream.finished_at <= self.replay_ttl and len(self._streams) < self.max_streams:
+                break
+            del self._streams[thread_id]
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def snapshot(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "running": len(self._tasks),
+            "subscribers": sum(len(stream.subscribers) for stream in self._streams.values()),
+        }
+
+
+def create_streams(next_id: Callable[[], int]) -> StreamHub:
+    """Build from the SSE_* settings; `next_id` hands out increasing event ids."""
+    return StreamHub(
+        next_id,
+        heartbeat=float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15")),
+        replay_bytes=int(os.environ.get("SSE_REPLAY_BYTES", str(1 << 20))),
+        replay_ttl=float(os.environ.get("SSE_REPLAY_TTL", "60")),
+        client_queue=int(os.environ.get("SSE_CLIENT_QUEUE", "256")),
+        resume_grace=float(os.environ.get("SSE_RESUME_GRACE", "30")),
+        max_streams=int(os.environ.get("SSE_MAX_STREAMS", "1000")),
+    )
@@ -0,0 +1,52 @@
+"""
+Local stand-in for the n8n intent webhook.
+
+Run it and point the backend at it:
+
+    uvicorn stubs.n8n_webhook:app --port 5678
+    N8N_INTENT_WEBHOOK=http://localhost:5678/webhook/zaai-chattwidget-action python server.py
+
+Env:
+    STUB_N8N_FAILURE_RATE  share of requests answered with 503 (default 0)
+    STUB_N8N_LATENCY       seconds to wait before answering (default 0)
+
+Deliveries are de-duplicated on the Idempotency-Key header, like a real
+consumer should; GET /received lists what was accepted.
+"""
+import asyncio
+import os
+import random
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FAILURE_RATE = float(os.environ.get("STUB_N8N_FAILURE_RATE", "0"))
+LATENCY = float(os.environ.get("STUB_N8N_LATENCY", "0"))
+
+app = FastAPI()
+
+received: dict = {}
+stats = {"requests": 0, "failures": 0, "duplicates": 0}
+
+
+@app.post("/webhook/{name}")
+async def webhook(name: str, request: Request):
+    stats["requests"] += 1
+    if LATENCY:
+        await asyncio.sleep(LATENCY)
+    if random.random() < FAILURE_RATE:
+        stats["failures"] += 1
+        return JSONResponse({"error": "stub failure"}, status_code=503)
+
+    body = await request.json()
+    key = request.headers.get("Idempotency-Key") or body.get("idempotency_key")
+    if key and key in received:
+        stats["duplicates"] += 1
+    elif key:
+        received[key] = body
+    return {"response": f"Stub: {body.get('intent', 'okänd')} mottagen."}
+
+
+@app.get("/received")
+def list_received():
+    return {"stats": stats, "received": received}
@@ -0,0 +1,276 @@
+"""
+Local stand-in for the OpenAI endpoints the backend calls.
+
+    uvicorn stubs.openai_api:app --port 5679
+    OPENAI_BASE_URL=http://localhost:5679/v1 python server.py
+
+Mimics:
+- POST /v1/chat/completions  streaming and non-streaming, with tool calls
+  when the last user message mentions booking (or at STUB_OPENAI_TOOL_RATE),
+  and a plain text answer once tool results are in the messages
+- POST /v1/chatkit/sessions  returns a client_secret and expires_at
+- POST /v1/files, POST /v1/batches, GET /v1/batches/{id},
+  GET /v1/files/{id}/content  the Batch API: a batch runs every line through
+  /v1/chat/completions at once and is completed when it is created
+
+Env:
+    STUB_OPENAI_LATENCY      seconds before the first token (default 0.3)
+    STUB_OPENAI_JITTER       +/- random seconds added to the latency (default 0.1)
+    STUB_OPENAI_TOKEN_DELAY  seconds between streamed tokens (default 0.01)
+    STUB_OPENAI_REPLY_TOKENS tokens in a text answer (default 40)
+    STUB_OPENAI_TOOL_RATE    share of other turns answered with a tool call (default 0)
+    STUB_OPENAI_ERROR_RATE   share of requests answered with 500 (default 0)
+    STUB_OPENAI_FAIL_MODELS  comma-separated models that always answer 500
+    STUB_OPENAI_SLOW_RATE    share of requests delayed by STUB_OPENAI_SLOW_LATENCY
+    STUB_OPENAI_SLOW_LATENCY extra seconds before the first token (default 5)
+    STUB_OPENAI_SESSION_TTL  seconds until a session's expires_at (default 600)
+    STUB_OPENAI_ECHO_HISTORY start text answers with "[n] ", n = user messages
+                             in the request (used to check thread continuity)
+"""
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default as default_policy
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+LATENCY = float(os.environ.get("STUB_OPENAI_LATENCY", "0.3"))
+JITTER = float(os.environ.get("STUB_OPENAI_JITTER", "0.1"))
+TOKEN_DELAY = float(os.environ.get("STUB_OPENAI_TOKEN_DELAY", "0.01"))
+REPLY_TOKENS = int(os.environ.get("STUB_OPENAI_REPLY_TOKENS", "40"))
+TOOL_RATE = float(os.environ.get("STUB_OPENAI_TOOL_RATE", "0"))
+ERROR_RATE = float(os.environ.get("STUB_OPENAI_ERROR_RATE", "0"))
+FAIL_MODELS = {m.strip() for m in os.environ.get("STUB_OPENAI_FAIL_MODELS", "").split(",") if m.strip()}
+SLOW_RATE = float(os.environ.get("STUB_OPENAI_SLOW_RATE", "0"))
+SLOW_LATENCY = float(os.environ.get("STUB_OPENAI_SLOW_LATENCY", "5"))
+SESSION_TTL = int(os.environ.get("STUB_OPENAI_SESSION_TTL", "600"))
+ECHO_HISTORY = os.environ.get("STUB_OPENAI_ECHO_HISTORY", "0").lower() in ("1", "true", "yes")
+
+WORDS = "Tack för din fråga om ZAAI:s tjänster och priser – läs mer på www.zaai.se".split()
+
+app = FastAPI()
+
+stats = {"chat_completions": 0, "chatkit_sessions": 0, "errors": 0, "slow": 0, "models": {}, "tool_schemas": 0}
+
+
+async def _wait_first_token(slow: bool = False) -> None:
+    delay = LATENCY + random.uniform(-JITTER, JITTER) + (SLOW_LATENCY if slow else 0)
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def _wants_tool(messages: list) -> bool:
+    if messages and messages[-1].get("role") == "tool":
+        return False
+    last_user = next((m for m in reversed(messages) if m.get("role") == "user"), {})
+    text = str(last_user.get("content", "")).lower()
+    return "boka" in text or random.random() < TOOL_RATE
+
+
+def _usage(messages: list, completion_tokens: int, tools=None) -> dict:
+    prompt_tokens = sum(len(str(m.get("content") or "")) // 4 + 4 for m in messages)
+    if tools:
+        prompt_tokens += len(json.dumps(tools, ensure_ascii=False)) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _tool_call() -> dict:
+    return {
+        "id": f"call_{uuid.uuid4().hex[:12]}",
+        "type": "function",
+        "function": {
+            "name": "boka_tid",
+            "arguments": json.dumps({"namn": "Test Testsson", "datum": "2026-03-15", "tid": "14:00"}),
+        },
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    stats["chat_completions"] += 1
+    body = await request.json()
+    messages = body.get("messages", [])
+    stats["tool_schemas"] += len(body.get("tools") or ())
+    model = body.get("model", "gpt-4o")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    use_tool = body.get("tool_choice") != "none" and bool(body.get("tools")) and _wants_tool(messages)
+    tokens = [WORDS[i % len(WORDS)] + " " for i in range(REPLY_TOKENS)]
+    if ECHO_HISTORY:
+        tokens.insert(0, f"[{sum(1 for m in messages if m.get('role') == 'user')}] ")
+    stats["models"][model] = stats["models"].get(model, 0) + 1
+    slow = random.random() < SLOW_RATE
+    stats["slow"] += slow
+
+    if model in FAIL_MODELS or random.random() < ERROR_RATE:
+        stats["errors"] += 1
+        await _wait_first_token()
+        return JSONResponse({"error": {"message": "stub error", "type": "server_error"}}, status_code=500)
+
+    if not body.get("stream"):
+        await _wait_first_token(slow)
+        if use_tool:
+            message = {"role": "assistant", "content": None, "tool_calls": [_tool_call()]}
+            finish_reason, completion_tokens = "tool_calls", 20
+        else:
+            await asyncio.sleep(TOKEN_DELAY * len(tokens))
+            message = {"role": "assistant", "content": "".join(tokens).strip()}
+            finish_reason, completion_tokens = "stop", len(tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": _usage(messages, completion_tokens, body.get("tools")),
+        }
+
+    async def stream():
+        await _wait_first_token(slow)
+        yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+        if use_tool:
+            call = _tool_call()
+            arguments = call["function"]["arguments"]
+            yield _chunk(completion_id, model, {"tool_calls": [
+                {"index": 0, "id": call["id"], "type": "function",
+                 "function": {"name": call["function"]["name"], "arguments": ""}}
+            ]})
+            for start in range(0, len(arguments), 16):
+                await asyncio.sleep(TOKEN_DELAY)
+                yield _chunk(completion_id, model, {"tool_calls": [
+                    {"index": 0, "function": {"arguments": arguments[start:start + 16]}}
+                ]})
+            yield _chunk(completion_id, model, {}, "tool_calls")
+            completion_tokens = 20
+        else:
+            for token in tokens:
+                await asyncio.sleep(TOKEN_DELAY)
+                yield _chunk(completion_id, model, {"content": token})
+            yield _chunk(completion_id, model, {}, "stop")
+            completion_tokens = len(tokens)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": _usage(messages, completion_tokens, body.get("tools")),
+            }
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/v1/chatkit/sessions")
+async def chatkit_sessions(request: Request):
+    stats["chatkit_sessions"] += 1
+    body = await request.json()
+    await _wait_first_token()
+    return {
+        "id": f"cksess_{uuid.uuid4().hex[:12]}",
+        "object": "chatkit.session",
+        "user": body.get("user"),
+        "workflow": body.get("workflow"),
+        "client_secret": f"ek_stub_{uuid.uuid4().hex}",
+        "expires_at": int(time.time()) + SESSION_TTL,
+    }
+
+
+files: dict = {}  # file id -> bytes
+batches: dict = {}  # batch id -> batch object
+
+
+@app.post("/v1/files")
+async def upload_file(request: Request):
+    # Multipart parsed with the standard library, so the stub needs no python-multipart
+    raw = await request.body()
+    header = b"Content-Type: " + request.headers["content-type"].encode("latin-1") + b"\r\n\r\n"
+    parts = BytesParser(policy=default_policy).parsebytes(header + raw).iter_parts()
+    fields = {part.get_param("name", header="content-disposition"): part for part in parts}
+    file_id = f"file-{uuid.uuid4().hex[:12]}"
+    files[file_id] = fields["file"].get_payload(decode=True)
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(files[file_id]),
+        "created_at": int(time.time()),
+        "filename": fields["file"].get_filename(),
+        "purpose": fields["purpose"].get_content().strip() if "purpose" in fields else "batch",
+    }
+
+
+@app.get("/v1/files/{file_id}/content")
+async def file_content(file_id: str):
+    if file_id not in files:
+        raise HTTPException(status_code=404, detail="no such file")
+    return Response(files[file_id], media_type="application/jsonl")
+
+
+@app.post("/v1/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    if body.get("input_file_id") not in files:
+        raise HTTPException(status_code=404, detail="no such file")
+    lines = [json.loads(line) for line in files[body["input_file_id"]].splitlines() if line.strip()]
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stub") as client:
+        responses = await asyncio.gather(*(client.post(line["url"], json=line["body"]) for line in lines))
+    output = "".join(
+        json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+            "custom_id": line["custom_id"],
+            "response": {"status_code": response.status_code, "request_id": uuid.uuid4().hex, "body": response.json()},
+            "error": None,
+        }, ensure_ascii=False) + "\n"
+        for line, response in zip(lines, responses)
+    )
+    output_file_id = f"file-{uuid.uuid4().hex[:12]}"
+    files[output_file_id] = output.encode("utf-8")
+    completed = sum(1 for response in responses if response.status_code == 200)
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    batches[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": body.get("endpoint"),
+        "input_file_id": body["input_file_id"],
+        "completion_window": body.get("completion_window", "24h"),
+        "status": "completed",
+        "output_file_id": output_file_id,
+        "error_file_id": None,
+        "created_at": int(time.time()),
+        "request_counts": {"total": len(lines), "completed": completed, "failed": len(lines) - completed},
+    }
+    return batches[batch_id]
+
+
+@app.get("/v1/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    if batch_id not in batches:
+        raise HTTPException(status_code=404, detail="no such batch")
+    return batches[batch_id]
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
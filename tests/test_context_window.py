@@ -0,0 +1,73 @@
+"""
+Prompt construction (context_window.py) against the in-memory store: messages
+reach the rolling summary before the store trims them, and token counts are
+cached by content hash.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from context_window import ContextBuilder, TokenCounter  # noqa: E402
+from conversation_store import MemoryStore  # noqa: E402
+
+
+class ContextBuilderTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = MemoryStore(max_messages=20)
+        self.folded = []
+
+        async def summarizer(previous, messages, on_usage=None):
+            self.folded.extend(messages)
+            return f"{len(self.folded)} meddelanden"
+
+        self.builder = ContextBuilder(self.store, summarizer, max_prompt_tokens=100_000, keep_turns=2)
+
+    async def turn(self, thread_id: str, n: int) -> list:
+        await self.store.append(thread_id, {"role": "user", "content": f"fråga {n}"})
+        messages = await self.builder.build(thread_id, "system", await self.store.get(thread_id))
+        if n % 3 == 0:
+            call = {"id": f"call_{n}", "type": "function", "function": {"name": "book", "arguments": "{}"}}
+            await self.store.append(thread_id, {"role": "assistant", "content": None, "tool_calls": [call]})
+            await self.store.append(thread_id, {"role": "tool", "tool_call_id": f"call_{n}", "content": "ok"})
+        await self.store.append(thread_id, {"role": "assistant", "content": f"svar {n}"})
+        return messages
+
+    async def test_folds_messages_before_the_store_trims_them(self):
+        for n in range(60):
+            messages = await self.turn("thread_1", n)
+            self.assertEqual(messages[-1]["content"], f"fråga {n}")
+
+        kept = await self.store.get("thread_1")
+        seen = {m["content"] for m in self.folded + kept if m["role"] in ("user", "assistant")}
+        for n in range(60):
+            self.assertIn(f"fråga {n}", seen)
+            self.assertIn(f"svar {n}", seen)
+        summary = await self.store.get_summary("thread_1")
+        self.assertGreaterEqual(summary["covered"], await self.store.count("thread_1") - len(kept))
+
+    async def test_short_threads_are_not_summarized(self):
+        for n in range(4):
+            messages = await self.turn("thread_2", n)
+        self.assertEqual(self.folded, [])
+        self.assertEqual(messages[1], {"role": "user", "content": "fråga 0"})
+
+
+class TokenCounterTest(unittest.TestCase):
+    def test_cache_is_keyed_by_content_hash(self):
+        counter = TokenCounter()
+        text = "Vad kostar en konsultation? " * 200
+        tokens = counter.message_tokens({"role": "user", "content": text})
+        self.assertEqual(counter.message_tokens({"role": "user", "content": text}), tokens)
+        counter.message_tokens({"role": "assistant", "content": text})
+        self.assertEqual(len(counter._cache), 2)
+        for role, digest in counter._cache:
+            self.assertEqual(len(digest), 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
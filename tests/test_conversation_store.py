@@ -0,0 +1,53 @@
+"""
+The in-memory history store (conversation_store.py): the packed per-message
+size field and the rejection of contents too large for it.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+from array import array
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import conversation_store  # noqa: E402
+from conversation_store import _NO_CONTENT, _ROLE_BITS, MAX_CONTENT_BYTES, MemoryStore  # noqa: E402
+
+
+class MemoryStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = MemoryStore(max_messages=4)
+
+    def test_largest_content_size_fits_the_meta_entry(self):
+        meta = array("I", [MAX_CONTENT_BYTES << _ROLE_BITS | ((1 << _ROLE_BITS) - 1)])
+        self.assertEqual(meta[0] >> _ROLE_BITS, MAX_CONTENT_BYTES)
+        self.assertNotEqual(MAX_CONTENT_BYTES, _NO_CONTENT)
+
+    async def test_oversized_content_is_rejected_without_touching_the_thread(self):
+        await self.store.append("thread_1", {"role": "user", "content": "hej"})
+        with mock.patch.object(conversation_store, "MAX_CONTENT_BYTES", 8):
+            await self.store.append("thread_1", {"role": "assistant", "content": "åtta b"})  # 8 bytes
+            with self.assertRaisesRegex(ValueError, "9 bytes"):
+                await self.store.append("thread_1", {"role": "assistant", "content": "nio bytes"})
+        with mock.patch.object(conversation_store, "_ROLE_BITS", 2), self.assertRaisesRegex(ValueError, "roles"):
+            await self.store.append("thread_1", {"role": "developer", "content": "x"})  # no role code left
+
+        self.assertEqual(await self.store.count("thread_1"), 2)
+        self.assertEqual(
+            await self.store.get("thread_1"),
+            [{"role": "user", "content": "hej"}, {"role": "assistant", "content": "åtta b"}],
+        )
+
+    async def test_trimming_keeps_contents_aligned(self):
+        messages = [{"role": "user", "content": f"fråga {n}"} for n in range(6)]
+        messages.insert(3, {"role": "assistant", "content": None, "tool_calls": [{"id": "call_1"}]})
+        for message in messages:
+            await self.store.append("thread_2", message)
+        self.assertEqual(await self.store.get("thread_2"), messages[-4:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Intent outbox against the n8n stub (stubs/n8n_webhook.py, in process):
+retry with backoff, the move to the dead-letter queue, requeue through the
+admin route and pruning of delivered rows.
+
+    python -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import httpx
+from fastapi import FastAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import intent_outbox  # noqa: E402
+from intent_outbox import IntentOutbox  # noqa: E402
+from stubs import n8n_webhook  # noqa: E402
+
+WEBHOOK = "http://n8n/webhook/zaai-chattwidget-action"
+
+
+class IntentOutboxTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        n8n_webhook.FAILURE_RATE = 0.0
+        n8n_webhook.received.clear()
+        self.sent_at = []
+
+        async def on_request(request):
+            self.sent_at.append(time.monotonic())
+
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=n8n_webhook.app), event_hooks={"request": [on_request]}
+        )
+        self.outbox = IntentOutbox(
+            os.path.join(self.tmp.name, "outbox.db"),
+            WEBHOOK,
+            lambda: self.client,
+            timeout=5,
+            concurrency=1,
+            max_attempts=3,
+            base_delay=0.2,
+            max_delay=1.0,
+            poll_interval=0.02,
+            api_token="secret",
+        )
+
+    async def asyncTearDown(self):
+        await self.outbox.close()
+        await self.client.aclose()
+        n8n_webhook.FAILURE_RATE = 0.0
+        self.tmp.cleanup()
+
+    async def wait_for(self, status: str, count: int = 1, timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while (await self.outbox.stats())[status] < count:
+            if time.monotonic() > deadline:
+                self.fail(f"no {status} intent after {timeout}s: {await self.outbox.stats()}")
+            await asyncio.sleep(0.02)
+
+    async def test_retries_with_backoff_until_delivered(self):
+        n8n_webhook.FAILURE_RATE = 1.0
+        await self.outbox.enqueue("thread_1:call_1", {"intent": "booking"})
+        while len(self.sent_at) < 2:
+            await asyncio.sleep(0.02)
+        n8n_webhook.FAILURE_RATE = 0.0
+        await self.wait_for(intent_outbox.DELIVERED)
+
+        # First retry waits base_delay with jitter in [0.5, 1.0)
+        self.assertGreaterEqual(self.sent_at[1] - self.sent_at[0], 0.1)
+        self.assertIn("thread_1:call_1", n8n_webhook.received)
+        self.assertEqual(await self.outbox.dead_letters(), [])
+
+    async def test_dead_letter_and_requeue_through_admin_route(self):
+        dead_before = sum(intent_outbox.DEAD_LETTERS._values.values())
+        n8n_webhook.FAILURE_RATE = 1.0
+        await self.outbox.enqueue("thread_2:call_1", {"intent": "escalation"})
+        await self.wait_for(intent_outbox.DEAD)
+        self.assertEqual(len(self.sent_at), 3)  # max_attempts
+        self.assertEqual(sum(intent_outbox.DEAD_LETTERS._values.values()), dead_before + 1)
+
+        app = FastAPI()
+        app.include_router(self.outbox.router())
+        auth = {"authorization": "Bearer secret"}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as admin:
+            self.assertEqual((await admin.get("/outbox/dead")).status_code, 401)
+            dead = (await admin.get("/outbox/dead", headers=auth)).json()
+            self.assertEqual([d["idempotency_key"] for d in dead], ["thread_2:call_1"])
+            self.assertEqual(dead[0]["attempts"], 3)
+            self.assertIn("HTTP 503", dead[0]["last_error"])
+
+            n8n_webhook.FAILURE_RATE = 0.0
+            resp = await admin.post("/outbox/dead/thread_2:call_1/requeue", headers=auth)
+            self.assertEqual(resp.status_code, 200)
+            await self.wait_for(intent_outbox.DELIVERED)
+            self.assertEqual((await admin.post("/outbox/dead/thread_2:call_1/requeue", headers=auth)).status_code, 404)
+        self.assertIn("thread_2:call_1", n8n_webhook.received)
+
+    async def test_prunes_old_delivered_rows(self):
+        await self.outbox.enqueue("thread_3:call_1", {"intent": "booking"})
+        await self.wait_for(intent_outbox.DELIVERED)
+        self.outbox._pruned_at = 0.0
+        await self.outbox._maybe_prune()
+        self.assertEqual((await self.outbox.stats())[intent_outbox.DELIVERED], 1)  # younger than retention
+
+        with self.outbox._lock:
+            self.outbox._conn.execute("UPDATE outbox SET updated_at = ?", (time.time() - 8 * 86400,))
+        self.outbox._pruned_at = 0.0
+        await self.outbox._maybe_prune()
+        self.assertEqual((await self.outbox.stats())[intent_outbox.DELIVERED], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Upstream resilience (resilience.py): circuit breaker transitions, the
+fallback chain and the first-token timeout, against the OpenAI stub
+(stubs/openai_api.py, in process).
+
+    python -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import resilience  # noqa: E402
+from resilience import (  # noqa: E402
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    ResilientChat,
+    UpstreamTimeout,
+    UpstreamUnavailable,
+)
+from stubs import openai_api  # noqa: E402
+
+HEADERS = {"Authorization": "Bearer test"}
+PAYLOAD = {"model": "gpt-4o", "messages": [{"role": "user", "content": "Vad kostar en konsultation?"}]}
+
+
+def fallbacks(model: str, reason: str) -> float:
+    return resilience.FALLBACKS._values.get((("model", model), ("reason", reason)), 0)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_open_half_open_closed(self):
+        breaker = CircuitBreaker(error_rate=0.5, min_requests=4, window=30.0, cooldown=0.05)
+        for ok in (True, False, True):
+            self.assertTrue(breaker.allow())
+            breaker.record(ok)
+        self.assertEqual(breaker.state, CLOSED)  # below min_requests
+        breaker.record(False)
+        self.assertEqual(breaker.state, OPEN)  # 2 of 4 failed
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())  # the probe
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow())  # one probe at a time
+        breaker.record(False)
+        self.assertEqual(breaker.state, OPEN)  # failed probe: a new cooldown
+
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.abandon()  # the probe told us nothing; the next call probes instead
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow() and breaker.allow())
+
+    def test_old_failures_leave_the_window(self):
+        breaker = CircuitBreaker(error_rate=0.5, min_requests=4, window=0.05, cooldown=1.0)
+        for _ in range(3):
+            breaker.record(False)
+        time.sleep(0.06)
+        breaker.record(False)
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class ResilientChatTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        for name, value in (("LATENCY", 0.0), ("JITTER", 0.0), ("TOKEN_DELAY", 0.0), ("FAIL_MODELS", set())):
+            patch = mock.patch.object(openai_api, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=openai_api.app))
+        self.chat = ResilientChat(
+            ["gpt-4o", "gpt-4o-mini"],
+            lambda: self.client,
+            timeout=5.0,
+            max_timeout=0.2,
+            breaker_settings={"min_requests": 2, "cooldown": 0.1},
+        )
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def answer(self, stream: bool = True) -> tuple:
+        models = []
+        text = ""
+        async for choice in self.chat.stream(HEADERS, PAYLOAD, stream=stream, on_model=models.append):
+            text += (choice.get("delta") or {}).get("content") or ""
+        return models, text
+
+    async def test_falls_back_and_skips_an_open_circuit(self):
+        openai_api.FAIL_MODELS = {"gpt-4o"}
+        failed_before = fallbacks("gpt-4o", "HTTPStatusError")
+        skipped_before = fallbacks("gpt-4o", "circuit_open")
+
+        for _ in range(2):
+            models, text = await self.answer()
+            self.assertEqual(models, ["gpt-4o-mini"])
+            self.assertTrue(text)
+        self.assertEqual(self.chat.snapshot(), {"gpt-4o": OPEN, "gpt-4o-mini": CLOSED})
+        self.assertEqual(fallbacks("gpt-4o", "HTTPStatusError"), failed_before + 2)
+
+        models, _ = await self.answer()
+        self.assertEqual(models, ["gpt-4o-mini"])
+        self.assertEqual(fallbacks("gpt-4o", "circuit_open"), skipped_before + 1)
+
+        # Recovered: after the cooldown the probe goes to gpt-4o and closes its circuit
+        openai_api.FAIL_MODELS = set()
+        await asyncio.sleep(0.11)
+        models, _ = await self.answer()
+        self.assertEqual(models, ["gpt-4o"])
+        self.assertEqual(self.chat.snapshot()["gpt-4o"], CLOSED)
+
+    async def test_every_model_down(self):
+        openai_api.FAIL_MODELS = {"gpt-4o", "gpt-4o-mini"}
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            await self.answer()
+        self.assertIsInstance(raised.exception.__cause__, httpx.HTTPStatusError)
+
+    async def test_first_token_timeout_applies_to_streams_only(self):
+        openai_api.LATENCY = 0.4  # over max_timeout (0.2s)
+        with self.assertRaises(UpstreamUnavailable) as raised:
+            await self.answer(stream=True)
+        self.assertIsInstance(raised.exception.__cause__, UpstreamTimeout)
+
+        # Not streamed, the first chunk is the whole answer: only the request timeout applies
+        self.chat = ResilientChat(["gpt-4o"], lambda: self.client, timeout=5.0, max_timeout=0.2)
+        models, text = await self.answer(stream=False)
+        self.assertEqual(models, ["gpt-4o"])
+        self.assertTrue(text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+"""
+Resumable SSE turns (sse_stream.py): keep-alives, the bounded per-client
+queue, the per-turn replay buffer, and resuming through /chatkit against the
+OpenAI stub (stubs/openai_api.py, in process).
+
+    python -m unittest discover tests
+"""
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import http_pool  # noqa: E402
+import sse_stream  # noqa: E402
+from app_factory import create_app  # noqa: E402
+from settings import Settings  # noqa: E402
+from sse_stream import KEEP_ALIVE, StreamHub  # noqa: E402
+from stubs import openai_api  # noqa: E402
+
+
+def event_ids(frames) -> list:
+    return [int(frame.split(b"\n", 1)[0][4:]) for frame in frames if frame.startswith(b"id: ")]
+
+
+async def collect(frames) -> list:
+    return [frame async for frame in frames]
+
+
+class TurnStreamTest(unittest.IsolatedAsyncioTestCase):
+    def hub(self, **kwargs) -> StreamHub:
+        return StreamHub(itertools.count(1).__next__, **kwargs)
+
+    async def test_keep_alive_while_the_turn_is_quiet(self):
+        stream = self.hub(heartbeat=0.05).open("thread_1")
+
+        async def turn():
+            await asyncio.sleep(0.2)
+            yield "data: {}\n\n"
+
+        stream.start(turn(), lambda: None)
+        frames = await collect(stream.frames())
+        self.assertGreaterEqual(frames.count(KEEP_ALIVE), 2)
+        self.assertEqual(len(event_ids(frames)), 1)
+        self.assertTrue(frames[-1].startswith(b"id: "))
+
+    async def test_slow_client_is_cut_off_and_resumes_from_the_buffer(self):
+        slow_before = sum(sse_stream.SLOW_CLIENTS._values.values())
+        stream = self.hub(client_queue=2).open("thread_2")
+        go = asyncio.Event()
+
+        async def turn():
+            await go.wait()
+            for i in range(10):
+                yield f"data: {i}\n\n"
+
+        stream.start(turn(), lambda: None)
+        response = stream.frames()
+        first = asyncio.ensure_future(response.__anext__())
+        await asyncio.sleep(0)  # subscribed, waiting for the first frame
+        go.set()
+        received = [await first] + [frame async for frame in response]
+
+        # The burst overflows the queue of 2: the response ends with what it had queued
+        self.assertEqual(len(received), 2)
+        self.assertEqual(sum(sse_stream.SLOW_CLIENTS._values.values()), slow_before + 1)
+        self.assertFalse(stream.subscribers)
+
+        while not stream.finished:
+            await asyncio.sleep(0.01)
+        after = event_ids(received)[-1]
+        self.assertTrue(stream.contains(after) and stream.can_replay(after))
+        rest = await collect(stream.frames(after))
+        self.assertEqual(event_ids(received + rest), [event_id for event_id, _ in stream.events])
+        self.assertEqual(len(rest), 8)
+
+    async def test_replay_buffer_holds_a_long_turn_up_to_its_byte_cap(self):
+        frame = 'data: {"type":"thread.item.updated","update":{"delta":"ord "}}\n\n'
+        stream = self.hub().open("thread_3")
+        for _ in range(5000):  # a long answer, one delta per frame
+            stream.publish(frame)
+        self.assertIsNone(stream.dropped)
+        self.assertTrue(stream.can_replay(None))
+        self.assertEqual(len(stream.events), 5000)
+
+        stream = self.hub(replay_bytes=1000).open("thread_4")
+        for _ in range(100):
+            stream.publish(frame)
+        self.assertLessEqual(stream.buffered, 1000)
+        self.assertFalse(stream.can_replay(None))
+        self.assertFalse(stream.can_replay(stream.first_id))
+        self.assertTrue(stream.can_replay(stream.last_id - 1))
+        self.assertFalse(stream.contains(stream.last_id + 1))
+
+
+class ResumeHandlerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        env = mock.patch.dict(os.environ, {
+            "OPENAI_API_KEY": "test",
+            "FAQ_CACHE_ENABLED": "0",
+            "SUMMARY_MODEL": "",
+            "N8N_OUTBOX_PATH": os.path.join(self.tmp.name, "outbox.db"),
+            "USAGE_DB_PATH": os.path.join(self.tmp.name, "usage.db"),
+        })
+        env.start()
+        self.addCleanup(env.stop)
+        for name, value in (("LATENCY", 0.0), ("JITTER", 0.0), ("TOKEN_DELAY", 0.0)):
+            patch = mock.patch.object(openai_api, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.completions = 0
+
+        async def on_request(request):
+            if request.url.path.endswith("/chat/completions"):
+                self.completions += 1
+
+        http_pool._client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=openai_api.app), event_hooks={"request": [on_request]}
+        )
+        self.app = create_app(Settings.from_env().replace(sessions_enabled=False))
+        self.lifespan = self.app.router.lifespan_context(self.app)
+        await self.lifespan.__aenter__()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://app")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.lifespan.__aexit__(None, None, None)
+        self.tmp.cleanup()
+
+    async def post(self, req_type: str, params: dict, last_event_id=None) -> httpx.Response:
+        headers = {"x-device-id": "device_1"}
+        if last_event_id is not None:
+            headers["last-event-id"] = str(last_event_id)
+        return await self.client.post("/chatkit", json={"type": req_type, "params": params}, headers=headers)
+
+    async def turn(self, thread_id: str, text: str, last_event_id=None) -> httpx.Response:
+        params = {"thread_id": thread_id, "input": {"content": [{"type": "text", "text": text}]}}
+        return await self.post("threads.add_user_message", params, last_event_id)
+
+    @staticmethod
+    def frames(response: httpx.Response) -> list:
+        return [frame + b"\n\n" for frame in response.content.split(b"\n\n") if frame.startswith(b"id: ")]
+
+    async def test_resume_replays_only_the_missed_events(self):
+        frames = self.frames(await self.turn("thr_a", "Vad kostar en konsultation?"))
+        ids = event_ids(frames)
+        self.assertGreater(len(ids), 3)
+
+        response = await self.post("threads.resume", {"thread_id": "thr_a"}, last_event_id=ids[2])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.frames(response), frames[3:])
+
+        # A repeat without input text is a reconnect too
+        response = await self.post("threads.add_user_message", {"thread_id": "thr_a", "input": {"content": []}}, ids[1])
+        self.assertEqual(self.frames(response), frames[2:])
+
+        response = await self.post("threads.resume", {"thread_id": "thr_a", "last_event_id": ids[-2]})
+        self.assertEqual(self.frames(response), frames[-1:])
+        self.assertEqual(self.completions, 1)
+
+    async def test_new_input_with_last_event_id_is_a_new_turn(self):
+        first = self.frames(await self.turn("thr_b", "Hej!"))
+        second = self.frames(await self.turn("thr_b", "Var ligger ni?", last_event_id=event_ids(first)[-1]))
+
+        self.assertEqual(self.completions, 2)
+        self.assertGreater(min(event_ids(second)), max(event_ids(first)))
+        service = next(s for s in self.app.state.services if hasattr(s, "streams"))
+        history = await service.conversation_store.get("thr_b")
+        self.assertEqual([m["content"] for m in history if m["role"] == "user"], ["Hej!", "Var ligger ni?"])
+
+    async def test_ids_from_another_turn_are_expired(self):
+        first = self.frames(await self.turn("thr_c", "Hej!"))
+        await self.turn("thr_c", "Och öppettiderna?")
+
+        for last_event_id in (event_ids(first)[-1], "not-an-id", 1):
+            response = await self.post("threads.resume", {"thread_id": "thr_c"}, last_event_id)
+            self.assertEqual(response.status_code, 410, last_event_id)
+            self.assertEqual(response.json()["detail"], "stream_expired")
+        response = await self.post("threads.resume", {"thread_id": "thr_other"}, event_ids(first)[-1])
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual((await self.post("threads.resume", {})).status_code, 400)
+        self.assertEqual(self.completions, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,611 @@
+"""
+Token and cost accounting per turn, with budgets per thread, device and IP.
+
+Every turn's `usage` (summed over its completions, see TurnState.add_usage)
+is priced with USAGE_PRICES and recorded on the event loop as a few dict
+updates: one row per turn, and totals per thread, device (the admission
+client key: device_id, else the caller's IP), caller IP, model and UTC day. A
+background task writes them to SQLite every USAGE_FLUSH_INTERVAL seconds,
+or once USAGE_FLUSH_BATCH turns are waiting, in one transaction in a worker
+thread, so the hot path never touches the database.
+
+Budgets are checked before a turn is admitted, against totals held in
+memory (read once from SQLite when a thread or device is first seen):
+
+- USAGE_THREAD_MAX_TOKENS / USAGE_THREAD_MAX_COST: the whole thread
+- USAGE_DEVICE_DAILY_TOKENS / USAGE_DEVICE_DAILY_COST: one device, per UTC day
+- USAGE_IP_DAILY_TOKENS / USAGE_IP_DAILY_COST: one caller IP, per UTC day;
+  device ids and thread ids are chosen by the client, the IP is not
+- USAGE_DAILY_COST: everything, per UTC day
+
+Past a budget, turns run on USAGE_DOWNGRADE_MODEL; past USAGE_HARD_LIMIT times
+the budget (or right away with USAGE_OVER_BUDGET=refuse, or without a cheaper
+model) they are rejected with 429. Totals are per process between flushes,
+so with several workers a device budget may be overrun by what the others
+have not flushed yet.
+
+The /usage endpoints are only mounted when USAGE_API_TOKEN is set.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+
+import metrics
+from admission import Rejected
+
+TOKENS = metrics.registry.counter("chatkit_tokens_total", "OpenAI tokens used by turns, by model and kind")
+COST = metrics.registry.counter("chatkit_cost_usd_total", "Estimated OpenAI cost of turns in USD, by model")
+BUDGET_ACTIONS = metrics.registry.counter(
+    "chatkit_usage_budget_total", "Turns downgraded or refused by a usage budget"
+)
+
+# USD per 1M tokens: (input, cached input, output); matched by longest model-name prefix
+DEFAULT_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+}
+
+THREAD = "thread"
+DEVICE = "device"
+IP = "ip"
+MODEL = "model"
+TOTAL = "total"
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def _until_midnight() -> float:
+    return 86400 - time.time() % 86400
+
+
+class Totals:
+    """Turns, tokens and cost of one thread, device, model or day."""
+
+    __slots__ = ("turns", "prompt_tokens", "cached_tokens", "completion_tokens", "cost")
+
+    def __init__(self, turns=0, prompt_tokens=0, cached_tokens=0, completion_tokens=0, cost=0.0):
+        self.turns = turns
+        self.prompt_tokens = prompt_tokens
+        self.cached_tokens = cached_tokens
+        self.completion_tokens = completion_tokens
+        self.cost = cost
+
+    def add(self, other: "Totals") -> None:
+        self.turns += other.turns
+        self.prompt_tokens += other.prompt_tokens
+        self.cached_tokens += other.cached_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def row(self) -> tuple:
+        return self.turns, self.prompt_tokens, self.cached_tokens, self.completion_tokens, self.cost
+
+    def as_dict(self) -> dict:
+        return {
+            "turns": self.turns,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class Prices:
+    def __init__(self, prices: dict):
+        # Longest prefix first, so "gpt-4o-mini-2024-07-18" is not priced as gpt-4o
+        self.prices = sorted(prices.items(), key=lambda item: len(item[0]), reverse=True)
+        self._by_model: dict = {}
+
+    def get(self, model: Optional[str]) -> tuple:
+        price = self._by_model.get(model)
+        if price is None:
+            price = next((p for prefix, p in self.prices if model and model.startswith(prefix)), None)
+            if price is None:
+                print(f"WARNING: no USAGE_PRICES entry for model {model!r}, counted at no cost")
+                price = (0.0, 0.0, 0.0)
+            self._by_model[model] = price
+        return price
+
+    def cost(self, model: Optional[str], prompt: int, cached: int, completion: int) -> float:
+        input_price, cached_price, output_price = self.get(model)
+        return ((prompt - cached) * input_price + cached * cached_price + completion * output_price) / 1e6
+
+
+class Budget:
+    __slots__ = ("name", "max_tokens", "max_cost")
+
+    def __init__(self, name: str, max_tokens: int = 0, max_cost: float = 0.0):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+
+    def __bool__(self) -> bool:
+        return bool(self.max_tokens or self.max_cost)
+
+    def used(self, totals: Totals) -> float:
+        """Share of the budget used (1.0 = exhausted); 0 when unlimited."""
+        shares = [0.0]
+        if self.max_tokens:
+            shares.append(totals.tokens / self.max_tokens)
+        if self.max_cost:
+            shares.append(totals.cost / self.max_cost)
+        return max(shares)
+
+
+class UsageLedger:
+    def __init__(
+        self,
+        path: str,
+        prices: Prices,
+        thread_budget: Budget,
+        device_budget: Budget,
+        ip_budget: Budget,
+        daily_budget: Budget,
+        downgrade_model: Optional[str] = None,
+        hard_limit: float = 2.0,
+        flush_interval: float = 5.0,
+        flush_batch: int = 200,
+        max_keys: int = 100_000,
+        retention_days: float = 30.0,
+        api_token: Optional[str] = None,
+    ):
+        self.path = path
+        self.prices = prices
+        self.thread_budget = thread_budget
+        self.device_budget = device_budget
+        self.ip_budget = ip_budget
+        self.daily_budget = daily_budget
+        self.downgrade_model = downgrade_model
+        self.hard_limit = hard_limit
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_keys = max_keys
+        self.retention_days = retention_days
+        self.api_token = api_token
+        # Unflushed: (scope, key, day) -> Totals, and one tuple per turn
+        self._pending: dict = {}
+        self._pending_days: set = set()
+        self._turns: list = []
+        # Budget state, read through from SQLite: thread -> Totals, (device or ip, day) -> Totals, day -> Totals
+        self._threads: OrderedDict = OrderedDict()
+        self._devices: OrderedDict = OrderedDict()
+        self._ips: OrderedDict = OrderedDict()
+        self._days: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._pruned_at = 0.0
+        self._open()
+
+    def _open(self) -> None:
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage_totals ("
+            " scope TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " day TEXT NOT NULL,"
+            " turns INTEGER NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " cached_tokens INTEGER NOT NULL,"
+            " completion_tokens INTEGER NOT NULL,"
+            " cost REAL NOT NULL,"
+            " PRIMARY KEY (scope, key, day))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_totals_day ON usage_totals (day, scope)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage_turns ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " created_at REAL NOT NULL,"
+            " day TEXT NOT NULL,"
+            " thread_id TEXT NOT NULL,"
+            " device TEXT NOT NULL,"
+            " model TEXT,"
+            " source TEXT NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL,"
+            " cached_tokens INTEGER NOT NULL,"
+            " completion_tokens INTEGER NOT NULL,"
+            " cost REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_turns_thread ON usage_turns (thread_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_usage_turns_created ON usage_turns (created_at)")
+
+    # Lifecycle
+
+    async def start(self) -> None:
+        if self._conn is None:
+            self._open()
+        if self._flusher is not None:
+            return
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def _ensure_started(self) -> None:
+        if self._flusher is None:
+            # No lifespan hook (e.g. serverless): start the flusher on first use
+            await self.start()
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"ERROR: final usage flush failed, {len(self._turns)} turns lost: {e!r}")
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    # Hot path
+
+    def record(
+        self, thread_id: str, device: str, ip: str, model: Optional[str], usage: dict, source: str, turns: int = 1
+    ) -> None:
+        """
+        Account one finished turn; `usage` as summed by TurnState.add_usage.
+        Other calls made for a turn (summaries) are recorded with turns=0.
+        """
+        day = _today()
+        prompt = usage.get("prompt_tokens", 0)
+        cached = usage.get("cached_tokens", 0)
+        completion = usage.get("completion_tokens", 0)
+        cost = self.prices.cost(model, prompt, cached, completion) if model else 0.0  # cache answers are free
+        turn = Totals(turns, prompt, cached, completion, cost)
+
+        for key in ((THREAD, thread_id), (DEVICE, device), (IP, ip), (MODEL, model or ""), (TOTAL, "")):
+            totals = self._pending.get(key + (day,))
+            if totals is None:
+                totals = self._pending[key + (day,)] = Totals()
+            totals.add(turn)
+        self._pending_days.add(day)
+        # Budget state not held here is read from SQLite plus _pending when next needed
+        held = (self._threads.get(thread_id), self._devices.get((device, day)), self._ips.get((ip, day)), self._days.get(day))
+        for totals in held:
+            if totals is not None:
+                totals.add(turn)
+        self._turns.append(
+            (time.time(), day, thread_id, device, model, source, prompt, cached, completion, turn.cost)
+        )
+
+        if model:
+            TOKENS.inc(prompt - cached, model=model, kind="prompt")
+            TOKENS.inc(cached, model=model, kind="cached")
+            TOKENS.inc(completion, model=model, kind="completion")
+            COST.inc(turn.cost, model=model)
+        if len(self._turns) >= self.flush_batch and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def check(self, thread_id: str, device: str, ip: str) -> Optional[str]:
+        """
+        The model to hold this turn to when a budget is exceeded (None: no
+        budget is). Raises `Rejected` once a turn must be refused.
+        """
+        await self._ensure_started()
+        day = _today()
+        used = []
+        if self.thread_budget:
+            totals = self._threads.get(thread_id)
+            if totals is None:
+                totals = await self._load(self._threads, thread_id, THREAD, thread_id, None)
+            self._threads.move_to_end(thread_id)
+            used.append((self.thread_budget.used(totals), self.thread_budget.name, 86400))
+        if self.device_budget:
+            totals = await self._today(self._devices, DEVICE, device, day)
+            used.append((self.device_budget.used(totals), self.device_budget.name, _until_midnight()))
+        if self.ip_budget:
+            totals = await self._today(self._ips, IP, ip, day)
+            used.append((self.ip_budget.used(totals), self.ip_budget.name, _until_midnight()))
+        if self.daily_budget:
+            totals = self._days.get(day)
+            if totals is None:
+                self._days.clear()  # a new day: yesterday's total is no longer needed
+                totals = await self._load(self._days, day, TOTAL, "", day)
+            used.append((self.daily_budget.used(totals), self.daily_budget.name, _until_midnight()))
+        if not used:
+            return None
+
+        share, budget, retry_after = max(used)
+        if share < 1.0:
+            return None
+        if self.downgrade_model is not None and share < self.hard_limit:
+            BUDGET_ACTIONS.inc(budget=budget, action="downgrade")
+            return self.downgrade_model
+        BUDGET_ACTIONS.inc(budget=budget, action="refuse")
+        raise Rejected(429, f"{budget}_budget", retry_after)
+
+    async def _today(self, cache, scope: str, key: str, day: str) -> Totals:
+        totals = cache.get((key, day))
+        if totals is None:
+            totals = await self._load(cache, (key, day), scope, key, day)
+        cache.move_to_end((key, day))
+        return totals
+
+    async def _load(self, cache, cache_key, scope: str, key: str, day: Optional[str]) -> Totals:
+        # Under the flush lock, so no batch is on its way into SQLite while the
+        # stored totals are read: what is not in the database is in _pending
+        async with self._flush_lock:
+            totals = cache.get(cache_key)
+            if totals is not None:
+                return totals
+            totals = Totals(*await asyncio.to_thread(self._read_totals, scope, key, day))
+            for pending_day in (day,) if day is not None else self._pending_days:
+                pending = self._pending.get((scope, key, pending_day))
+                if pending is not None:
+                    totals.add(pending)
+            cache[cache_key] = totals
+            while len(cache) > self.max_keys:
+                cache.popitem(last=False)
+            return totals
+
+    def _read_totals(self, scope: str, key: str, day: Optional[str]) -> tuple:
+        query = (
+            "SELECT COALESCE(SUM(turns), 0), COALESCE(SUM(prompt_tokens), 0), COALESCE(SUM(cached_tokens), 0),"
+            " COALESCE(SUM(completion_tokens), 0), COALESCE(SUM(cost), 0.0)"
+            " FROM usage_totals WHERE scope = ? AND key = ?"
+        )
+        with self._lock:
+            if day is None:
+                return self._conn.execute(query, (scope, key)).fetchone()
+            return self._conn.execute(query + " AND day = ?", (scope, key, day)).fetchone()
+
+    # Flushing
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ERROR: usage flush failed, retrying: {e!r}")
+
+    async def flush(self) -> None:
+        """Write the recorded turns and totals to SQLite in one transaction."""
+        async with self._flush_lock:
+            if not self._turns and not self._pending:
+                return
+            pending, turns = self._pending, self._turns
+            self._pending, self._pending_days, self._turns = {}, set(), []
+            now = time.time()
+            prune = now - self._pruned_at > 3600
+            try:
+                # At least a day: today's device and IP totals are what their budgets read
+                prune_before = now - max(self.retention_days, 1) * 86400 if prune else None
+                await asyncio.to_thread(self._write, pending, turns, prune_before)
+            except BaseException:
+                # Kept for the next flush (in front of anything recorded since), up to a limit
+                for key, totals in pending.items():
+                    if key in self._pending:
+                        totals.add(self._pending[key])
+                    self._pending[key] = totals
+                    self._pending_days.add(key[2])
+                self._turns = (turns + self._turns)[-self.max_keys:]
+                raise
+            if prune:
+                self._pruned_at = now
+
+    def _write(self, pending: dict, turns: list, prune_before: Optional[float]) -> None:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO usage_totals"
+                    " (scope, key, day, turns, prompt_tokens, cached_tokens, completion_tokens, cost)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (scope, key, day) DO UPDATE SET"
+                    " turns = turns + excluded.turns,"
+                    " prompt_tokens = prompt_tokens + excluded.prompt_tokens,"
+                    " cached_tokens = cached_tokens + excluded.cached_tokens,"
+                    " completion_tokens = completion_tokens + excluded.completion_tokens,"
+                    " cost = cost + excluded.cost",
+                    [key + totals.row() for key, totals in pending.items()],
+                )
+                conn.executemany(
+                    "INSERT INTO usage_turns"
+                    " (created_at, day, thread_id, device, model, source,"
+                    " prompt_tokens, cached_tokens, completion_tokens, cost)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    turns,
+                )
+                if prune_before is not None:
+                    conn.execute("DELETE FROM usage_turns WHERE created_at < ?", (prune_before,))
+                    # One row per thread, device and IP and day; per model and day totals are kept
+                    conn.execute(
+                        "DELETE FROM usage_totals WHERE day < ? AND scope IN (?, ?, ?)",
+                        (time.strftime("%Y-%m-%d", time.gmtime(prune_before)), THREAD, DEVICE, IP),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    # Queries (flush first, so they include every finished turn)
+
+    def _rows(self, query: str, params: tuple) -> list:
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    async def _query(self, query: str, *params) -> list:
+        await self._ensure_started()
+        await self.flush()
+        return await asyncio.to_thread(self._rows, query, params)
+
+    async def totals(self, scope: str, key: str, days: int = 30) -> dict:
+        """Per-day totals of one thread or device, newest first, and their sum."""
+        rows = await self._query(
+            "SELECT day, turns, prompt_tokens, cached_tokens, completion_tokens, cost FROM usage_totals"
+            " WHERE scope = ? AND key = ? ORDER BY day DESC LIMIT ?",
+            scope, key, days,
+        )
+        total = Totals()
+        per_day = []
+        for day, *values in rows:
+            totals = Totals(*values)
+            total.add(totals)
+            per_day.append({"day": day, **totals.as_dict()})
+        return {"scope": scope, "key": key, **total.as_dict(), "days": per_day}
+
+    async def thread_turns(self, thread_id: str, limit: int = 100) -> list:
+        rows = await self._query(
+            "SELECT created_at, device, model, source, prompt_tokens, cached_tokens, completion_tokens, cost"
+            " FROM usage_turns WHERE thread_id = ? ORDER BY id DESC LIMIT ?",
+            thread_id, limit,
+        )
+        return [
+            {"created_at": created_at, "device": device, "model": model, "source": source,
+             **Totals(1, prompt, cached, completion, cost).as_dict()}
+            for created_at, device, model, source, prompt, cached, completion, cost in rows
+        ]
+
+    async def daily(self, days: int = 30) -> list:
+        """Totals per UTC day, newest first, with the split per model."""
+        rows = await self._query(
+            "SELECT day, scope, key, turns, prompt_tokens, cached_tokens, completion_tokens, cost FROM usage_totals"
+            " WHERE scope IN (?, ?) AND day >= ? ORDER BY day DESC",
+            TOTAL, MODEL, time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400)),
+        )
+        result: dict = {}
+        for day, scope, key, *values in rows:
+            entry = result.setdefault(day, {"day": day, "models": {}})
+            if scope == TOTAL:
+                entry.update(Totals(*values).as_dict())
+            else:
+                entry["models"][key] = Totals(*values).as_dict()
+        return list(result.values())
+
+    async def top(self, scope: str, day: str, by: str = "cost", limit: int = 20) -> list:
+        """The threads, devices or IPs that used the most on `day`."""
+        order = "cost" if by == "cost" else "prompt_tokens + completion_tokens"
+        rows = await self._query(
+            "SELECT key, turns, prompt_tokens, cached_tokens, completion_tokens, cost FROM usage_totals"
+            f" WHERE scope = ? AND day = ? ORDER BY {order} DESC LIMIT ?",
+            scope, day, limit,
+        )
+        return [{"key": key, **Totals(*values).as_dict()} for key, *values in rows]
+
+    def stats(self) -> dict:
+        return {
+            "pending_turns": len(self._turns),
+            "threads": len(self._threads),
+            "devices": len(self._devices),
+            "ips": len(self._ips),
+        }
+
+    # HTTP
+
+    def _authorize(self, request: Request) -> None:
+        if not self.api_token or request.headers.get("authorization") != f"Bearer {self.api_token}":
+            raise HTTPException(status_code=401, detail="unauthorized")
+
+    def router(self) -> APIRouter:
+        """The /usage endpoints; only mount them when `api_token` is set."""
+        router = APIRouter()
+
+        @router.get("/usage/threads/{thread_id}")
+        async def thread_usage(request: Request, thread_id: str, turns: int = 100):
+            self._authorize(request)
+            return dict(await self.totals(THREAD, thread_id), turns=await self.thread_turns(thread_id, turns))
+
+        @router.get("/usage/devices/{device}")
+        async def device_usage(request: Request, device: str, days: int = 30):
+            """`device` is a device_id, or a client key as recorded (`device:...`, `ip:...`)."""
+            self._authorize(request)
+            if not device.startswith(("device:", "ip:")):
+                device = f"device:{device}"
+            return await self.totals(DEVICE, device, days)
+
+        @router.get("/usage/ips/{ip}")
+        async def ip_usage(request: Request, ip: str, days: int = 30):
+            self._authorize(request)
+            return await self.totals(IP, ip, days)
+
+        @router.get("/usage/days")
+        async def daily_usage(request: Request, days: int = 30):
+            self._authorize(request)
+            return await self.daily(days)
+
+        @router.get("/usage/top")
+        async def top_usage(request: Request, scope: str = DEVICE, day: Optional[str] = None, by: str = "cost", limit: int = 20):
+            self._authorize(request)
+            if scope not in (THREAD, DEVICE, IP):
+                raise HTTPException(status_code=400, detail="scope must be thread, device or ip")
+            return await self.top(scope, day or _today(), by, limit)
+
+        return router
+
+
+def _load_prices() -> Prices:
+    prices = dict(DEFAULT_PRICES)
+    override = os.environ.get("USAGE_PRICES")
+    if override:
+        prices.update({model: tuple(price) for model, price in json.loads(override).items()})
+    return Prices(prices)
+
+
+def create_usage_ledger(chat_model: str) -> Optional[UsageLedger]:
+    """Build from the USAGE_* settings; None when USAGE_ACCOUNTING=0."""
+    if os.environ.get("USAGE_ACCOUNTING", "1").lower() in ("0", "false", "no"):
+        return None
+    downgrade_model = os.environ.get("USAGE_DOWNGRADE_MODEL", "gpt-4o-mini") or None
+    if downgrade_model == chat_model or os.environ.get("USAGE_OVER_BUDGET", "downgrade").lower() == "refuse":
+        downgrade_model = None
+    api_token = os.environ.get("USAGE_API_TOKEN") or None
+    if api_token is None:
+        print("USAGE_API_TOKEN is not set, the /usage endpoints are disabled.")
+    return UsageLedger(
+        path=os.environ.get("USAGE_DB_PATH", "usage.db"),
+        prices=_load_prices(),
+        thread_budget=Budget(
+            "thread",
+            max_tokens=int(os.environ.get("USAGE_THREAD_MAX_TOKENS", "200000")),
+            max_cost=float(os.environ.get("USAGE_THREAD_MAX_COST", "0")),
+        ),
+        device_budget=Budget(
+            "device",
+            max_tokens=int(os.environ.get("USAGE_DEVICE_DAILY_TOKENS", "500000")),
+            max_cost=float(os.environ.get("USAGE_DEVICE_DAILY_COST", "0")),
+        ),
+        # Shared by every device behind one IP (offices, NAT), hence roomier
+        ip_budget=Budget(
+            "ip",
+            max_tokens=int(os.environ.get("USAGE_IP_DAILY_TOKENS", "2000000")),
+            max_cost=float(os.environ.get("USAGE_IP_DAILY_COST", "0")),
+        ),
+        daily_budget=Budget("daily", max_cost=float(os.environ.get("USAGE_DAILY_COST", "0"))),
+        downgrade_model=downgrade_model,
+        hard_limit=float(os.environ.get("USAGE_HARD_LIMIT", "2")),
+        flush_interval=float(os.environ.get("USAGE_FLUSH_INTERVAL", "5")),
+        flush_batch=int(os.environ.get("USAGE_FLUSH_BATCH", "200")),
+        retention_days=float(os.environ.get("USAGE_TURN_RETENTION_DAYS", "30")),
+        api_token=api_token,
+    )